@@ -0,0 +1,475 @@
+"""
+Benchmarks for the hot paths of the disassembler. Every case builds its
+own project from a seeded random ROM, so results can be compared from
+one commit to the next on the same machine.
+
+    python benchmarks/bench.py                     # Run all the cases
+    python benchmarks/bench.py -k label            # Only matching cases
+    python benchmarks/bench.py --save results.json
+    python benchmarks/bench.py --compare benchmarks/baseline.json
+
+With --compare, the command fails if any case got slower than the
+baseline by more than the tolerance.
+"""
+from argparse import ArgumentParser
+from io import BytesIO
+import json
+from pathlib import Path
+import platform
+import random
+import sys
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+# Run from a checkout, without installing the package
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ungameboy.address import ROM, Address  # noqa: E402
+from ungameboy.dis import Disassembler  # noqa: E402
+from ungameboy.dis.data import parse_row_struct  # noqa: E402
+from ungameboy import project_save  # noqa: E402
+
+BASELINE = Path(__file__).parent / "baseline.json"
+
+Runner = Callable[[], None]
+Setup = Callable[[], None]
+
+
+class Case(NamedTuple):
+    name: str
+    build: Callable[[bool], Tuple[Runner, Optional[Setup]]]
+    repeat: int
+
+
+class Result(NamedTuple):
+    name: str
+    time_ms: float
+    peak_kib: float
+
+
+CASES: List[Case] = []
+# Temporary directories used by the cases, removed once they have run
+_TEMP_DIRS: List[TemporaryDirectory] = []
+
+
+def case(name: str, repeat=5):
+    """
+    Register a benchmark. The decorated function is given whether to
+    use a small workload, and returns the function to time along with
+    an optional setup, called before each run and not timed.
+    """
+    def decorator(build):
+        CASES.append(Case(name, build, repeat))
+        return build
+    return decorator
+
+
+def temp_dir() -> Path:
+    tmp_dir = TemporaryDirectory()
+    _TEMP_DIRS.append(tmp_dir)
+    return Path(tmp_dir.name)
+
+
+def random_rom_bytes(n_banks: int, seed=0) -> bytes:
+    size = n_banks * 0x4000
+    rom = bytearray(random.Random(seed).getrandbits(size * 8).to_bytes(size, 'big'))
+    # Entry point: nop; jp $0150
+    rom[0x100:0x104] = bytes([0x00, 0xc3, 0x50, 0x01])
+    return bytes(rom)
+
+
+def random_rom(n_banks: int, seed=0) -> Disassembler:
+    asm = Disassembler()
+    asm.load_rom(BytesIO(random_rom_bytes(n_banks, seed)))
+    asm.setup_new_rom()
+    # Give the indexer some entry points in each bank
+    with asm.batch(reindex=False, rollback=False):
+        for bank in range(n_banks):
+            for offset in range(0, 0x4000, 0x100):
+                asm.labels.auto_create(Address(ROM, bank, offset))
+    return asm
+
+
+def measure(name: str, run: Runner, setup: Setup = None, repeat=5) -> Result:
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = perf_counter()
+        run()
+        best = min(best, perf_counter() - start)
+
+    if setup is not None:
+        setup()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return Result(name, best * 1000, peak / 1024)
+
+
+# Cases
+
+@case("decode bank")
+def bench_decode_bank(quick: bool):
+    asm = random_rom(2)
+    rom = asm.rom
+
+    def decode():
+        offset = 0x4000
+        while offset < 0x8000:
+            offset += rom.decode_instruction(offset).length
+
+    return decode, None
+
+
+@case("index all banks", repeat=3)
+def bench_index(quick: bool):
+    asm = random_rom(2 if quick else 16)
+
+    def index():
+        for bank in range(asm.rom.n_banks):
+            asm.xrefs.index(bank)
+
+    return index, asm.xrefs.reset
+
+
+@case("query elements (bank)")
+def bench_elements(quick: bool):
+    asm = random_rom(2)
+    start = Address(ROM, 1, 0)
+    end = start.zone_end + 1
+    return lambda: list(asm.query_range(start, end)), None
+
+
+@case("build lines map")
+def bench_lines_map(quick: bool):
+    from ungameboy.prompt.control import AsmControl, AsmRegionView
+
+    asm = random_rom(2)
+    asm.xrefs.index(1)
+    ctrl = AsmControl(asm)
+    return lambda: AsmRegionView(ctrl, ROM, 1), None
+
+
+@case("render screen")
+def bench_render_screen(quick: bool, height=60):
+    from ungameboy.prompt.control import AsmControl
+
+    asm = random_rom(2)
+    asm.xrefs.index(1)
+    ctrl = AsmControl(asm)
+    ctrl.seek(Address(ROM, 1, 0))
+
+    def render():
+        content = ctrl.create_content(120, height)
+        for line in range(ctrl.cursor, ctrl.cursor + height):
+            content.get_line(line)
+
+    # Lines are cached by the view, so start from a fresh one every time
+    return render, lambda: ctrl.refresh()
+
+
+@case("insert data blocks")
+def bench_insert_data(quick: bool):
+    n_blocks = 200 if quick else 2000
+    asm = random_rom(8)
+    structure = parse_row_struct('db,dw,addr')
+    addresses = [
+        Address.from_rom_offset(0x4000 + n * 0x30) for n in range(n_blocks)
+    ]
+
+    def setup():
+        asm.data.reset()
+
+    def insert():
+        for addr in addresses:
+            asm.data.create_table(addr, 8, structure)
+
+    return insert, setup
+
+
+@case("rename labels", repeat=1)
+def bench_rename_labels(quick: bool):
+    n_labels, n_renames = (10_000, 1000) if quick else (100_000, 10_000)
+    asm = Disassembler()
+    asm.load_rom(BytesIO(bytes(0x4000 * 8)))
+    # One global every 16 addresses, with locals in between
+    with asm.batch(reindex=False, rollback=False):
+        for n in range(n_labels):
+            addr = Address.from_rom_offset(n + n // 3 + 0x100)
+            asm.labels.auto_create(addr, local=n % 16 != 0)
+
+    names = [name for name in asm.labels._by_name if '.' not in name]
+    names = names[:n_renames]
+
+    def rename():
+        for n, name in enumerate(names):
+            asm.labels.rename(name, f"renamed_{n}")
+        for n, name in enumerate(names):
+            asm.labels.rename(f"renamed_{n}", name)
+
+    return rename, None
+
+
+def write_sym_file(n_symbols: int) -> Path:
+    sym_path = temp_dir() / "bench.sym"
+
+    # 1 global for every 4 symbols, spread over the banks
+    with open(sym_path, 'w') as sym_file:
+        for n in range(n_symbols):
+            bank, offset = divmod(n * 4, 0x4000)
+            name = f"Func_{n // 4}"
+            if n % 4:
+                name += f".loop{n}"
+            sym_file.write(f"{bank + 1:02x}:{0x4000 + offset:04x} {name}\n")
+    return sym_path
+
+
+@case("import .sym", repeat=3)
+def bench_import_sym(quick: bool):
+    n_symbols = 10_000 if quick else 100_000
+    sym_path = write_sym_file(n_symbols)
+    n_banks = n_symbols * 4 // 0x4000 + 2
+    rom = random_rom_bytes(n_banks)
+    state = {}
+
+    def setup():
+        state['asm'] = Disassembler()
+        state['asm'].load_rom(BytesIO(rom))
+
+    def import_sym():
+        state['asm'].labels.import_sym(str(sym_path))
+
+    return import_sym, setup
+
+
+@case("import .sym labels", repeat=3)
+def bench_import_sym_labels(quick: bool):
+    # Without a ROM, nothing gets indexed: only reading and inserting
+    sym_path = write_sym_file(10_000 if quick else 100_000)
+    state = {}
+
+    def setup():
+        state['asm'] = Disassembler()
+
+    def import_sym():
+        state['asm'].labels.import_sym(str(sym_path))
+
+    return import_sym, setup
+
+
+@case("complete labels")
+def bench_complete_labels(quick: bool):
+    from prompt_toolkit.completion import CompleteEvent
+    from prompt_toolkit.document import Document
+
+    from ungameboy.commands import create_core_cli_v2
+    from ungameboy.prompt.prompt import CommandCompleter
+
+    n_labels = 5000 if quick else 50_000
+    asm = Disassembler()
+    asm.load_rom(BytesIO(bytes(0x4000 * 8)))
+    with asm.batch(reindex=False, rollback=False):
+        # One global every 8 labels, with its locals after it
+        asm.labels.create_many(
+            (
+                Address.from_rom_offset(0x100 + 2 * n),
+                f"Func_{n // 8}" + (f".loop{n % 8}" if n % 8 else ""),
+            )
+            for n in range(n_labels)
+        )
+    completer = CommandCompleter(create_core_cli_v2(asm), asm)
+    event = CompleteEvent()
+
+    # Each keystroke of a few label names, common prefixes and substrings
+    # as well as rare ones
+    lines = [
+        f"label rename {name[:end]}"
+        for name in ("Func_1234", "unc_", "loop3", "xyz", "c_9")
+        for end in range(1, len(name) + 1)
+    ]
+
+    def complete():
+        for line in lines:
+            list(completer.get_completions(Document(line), event))
+
+    return complete, None
+
+
+def _project(quick: bool):
+    """Project with a bit of everything, saved in a temporary directory"""
+    project_save.PROJECTS_DIR = temp_dir()
+    rom_path = project_save.PROJECTS_DIR / "bench.gb"
+    rom_path.write_bytes(random_rom_bytes(16))
+    asm = Disassembler()
+    with open(rom_path, 'rb') as rom_file:
+        asm.load_rom(rom_file)
+    asm.setup_new_rom()
+    asm.project_name = "bench"
+
+    n_items = 500 if quick else 5000
+    structure = parse_row_struct('db,dw')
+    with asm.batch(reindex=False, rollback=False):
+        for n in range(n_items):
+            # 512 items per bank, so that none crosses into the next one
+            addr = Address.from_rom_offset(0x4000 + n * 0x20)
+            asm.labels.auto_create(addr)
+            asm.labels.auto_create(addr + 4, local=True)
+            asm.comments.set_inline(addr + 4, f"Comment number {n}")
+            asm.data.create_table(addr + 8, 4, structure)
+    return asm
+
+
+@case("save project", repeat=3)
+def bench_save_project(quick: bool):
+    asm = _project(quick)
+    return lambda: project_save.save_project(asm), None
+
+
+@case("load project", repeat=3)
+def bench_load_project(quick: bool):
+    asm = _project(quick)
+    project_save.save_project(asm)
+    state = {}
+
+    def setup():
+        state['asm'] = Disassembler()
+        state['asm'].project_name = "bench"
+
+    def load():
+        project_save.load_project(state['asm'])
+
+    return load, setup
+
+
+@case("snapshot project")
+def bench_snapshot_project(quick: bool):
+    asm = _project(quick)
+    return asm.snapshot, None
+
+
+@case("export bank")
+def bench_export_bank(quick: bool):
+    from ungameboy.export import RgbdsExporter
+
+    exporter = RgbdsExporter(random_rom(2))
+
+    def export():
+        for _ in exporter.iter_bank(1):
+            pass
+
+    return export, None
+
+
+# Running and reporting
+
+def run_cases(
+        keyword: str = '', quick=False, repeat: int = None
+) -> List[Result]:
+    results = []
+    projects_dir = project_save.PROJECTS_DIR
+    try:
+        for bench in CASES:
+            if keyword not in bench.name:
+                continue
+            run, setup = bench.build(quick)
+            results.append(measure(
+                bench.name, run, setup, repeat or bench.repeat
+            ))
+    finally:
+        project_save.PROJECTS_DIR = projects_dir
+        while _TEMP_DIRS:
+            _TEMP_DIRS.pop().cleanup()
+    return results
+
+
+def save_results(results: List[Result], path: Path):
+    # The notes on the cases are written by hand, keep them
+    notes = {}
+    if path.exists():
+        with open(path, 'r', encoding='utf8') as previous:
+            notes = json.load(previous).get("notes", {})
+
+    data = {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": {
+            res.name: {
+                "time_ms": round(res.time_ms, 2),
+                "peak_kib": round(res.peak_kib, 1),
+            }
+            for res in results
+        },
+    }
+    if notes:
+        data["notes"] = notes
+    with open(path, 'w', encoding='utf8') as out:
+        json.dump(data, out, indent=2)
+        out.write("\n")
+
+
+def compare_results(
+        results: List[Result], path: Path, tolerance: float
+) -> List[str]:
+    """Print the ratios to the baseline, and return the slower cases"""
+    with open(path, 'r', encoding='utf8') as baseline_file:
+        baseline: Dict[str, dict] = json.load(baseline_file)["results"]
+
+    regressions = []
+    for res in results:
+        ref = baseline.get(res.name)
+        if ref is None:
+            print(f"{res.name:<24} (not in baseline)")
+            continue
+        time_ratio = res.time_ms / ref["time_ms"]
+        mem_ratio = res.peak_kib / max(ref["peak_kib"], 1)
+        flag = ''
+        if time_ratio > tolerance:
+            regressions.append(res.name)
+            flag = '  SLOWER'
+        print(
+            f"{res.name:<24} {time_ratio:6.2f}x time  "
+            f"{mem_ratio:6.2f}x memory{flag}"
+        )
+    return regressions
+
+
+def main(argv: List[str] = None):
+    parser = ArgumentParser(description="Run the UnGameBoy benchmarks")
+    parser.add_argument("-k", "--keyword", default='',
+                        help="Only run the cases with this in their name")
+    parser.add_argument("--quick", action='store_true',
+                        help="Use small workloads, for testing")
+    parser.add_argument("--repeat", type=int,
+                        help="Number of runs of each case, keeping the best")
+    parser.add_argument("--save", type=Path, metavar="JSON",
+                        help="Write the results to a file")
+    parser.add_argument("--compare", type=Path, metavar="JSON",
+                        nargs='?', const=BASELINE,
+                        help="Compare with a baseline (default: %(const)s)")
+    parser.add_argument("--tolerance", type=float, default=1.3,
+                        help="Slowdown ratio reported as a regression")
+    args = parser.parse_args(argv)
+
+    results = run_cases(args.keyword, args.quick, args.repeat)
+    for res in results:
+        print(
+            f"{res.name:<24} {res.time_ms:9.2f} ms  "
+            f"{res.peak_kib:9.1f} KiB peak"
+        )
+
+    if args.save:
+        save_results(results, args.save)
+    if args.compare:
+        print()
+        if compare_results(results, args.compare, args.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -11,7 +11,8 @@ setuptools.setup(
     ],
     entry_points={
         "console_scripts": [
-            "ungameboy = ungameboy.prompt.application:run"
+            "ungameboy = ungameboy.prompt.application:run",
+            "ungameboy-batch = ungameboy.batch:main",
         ]
     }
 )
@@ -0,0 +1,61 @@
+from io import BytesIO
+import sys
+import tracemalloc
+
+from ungameboy.address import Address
+from ungameboy.dis import Disassembler
+from ungameboy.dis.analysis import deep_sizeof
+
+
+def make_asm():
+    rom = bytearray(0x8000)
+    rom[0x100:0x104] = bytes([0x00, 0xc3, 0x50, 0x01])
+    asm = Disassembler()
+    asm.load_rom(BytesIO(bytes(rom)))
+    asm.setup_new_rom()
+    with asm.batch(reindex=False, rollback=False):
+        for n in range(100):
+            addr = Address.from_rom_offset(0x4000 + n * 0x10)
+            asm.labels.create(addr, f"label_{n}")
+            asm.comments.set_inline(addr, f"{n:04}" + "x" * 1000)
+    asm.xrefs.index(0)
+    return asm
+
+
+def test_deep_sizeof():
+    shared = "x" * 1000
+    seen = set()
+    size = deep_sizeof([shared, shared], seen)
+    assert size == sys.getsizeof([shared, shared]) + sys.getsizeof(shared)
+    # Already counted
+    assert deep_sizeof(shared, seen) == 0
+
+
+def test_memory_usage():
+    asm = make_asm()
+    usage = dict(asm.analyze.memory_usage())
+    assert usage["rom"] > 0x8000
+    assert usage["comments.inline"] > 100 * 1000
+    # Broken down into the parts of the managers
+    assert "xrefs._mappings.call.auto.refs_in" in usage
+    assert "labels._search_index._pending" in usage
+    assert not any(path.endswith(".asm") for path in usage)
+
+
+def test_memory_report():
+    asm = make_asm()
+    report = asm.analyze.memory_report(top=3)
+    assert report[0] == "Retained size per manager:"
+    assert report[1].split()[0] == "comments"
+    offenders = report.index("Top offenders:")
+    assert report[offenders + 1].split()[0] == "comments.inline"
+    assert len(report) == offenders + 4
+
+    try:
+        report = asm.analyze.memory_report(trace=True)
+        assert report[-1] == "Tracing allocations from now on"
+        report = asm.analyze.memory_report(top=3)
+        sites = report.index("Top allocation sites:")
+        assert len(report) <= sites + 4
+    finally:
+        tracemalloc.stop()
@@ -0,0 +1,80 @@
+import subprocess
+import sys
+
+from ungameboy import project_save
+from ungameboy.address import Address
+from ungameboy.batch import index_banks, main
+from ungameboy.dis import Disassembler
+from ungameboy.synthetic import generate_rom
+
+
+def load(name):
+    asm = Disassembler()
+    asm.project_name = name
+    project_save.load_project(asm)
+    return asm
+
+
+def test_no_prompt_toolkit():
+    code = "import sys, ungameboy.batch; print('prompt_toolkit' in sys.modules)"
+    output = subprocess.run(
+        [sys.executable, "-c", code], check=True, capture_output=True,
+    ).stdout
+    assert output.strip() == b"False"
+
+
+def test_batch_commands(tmp_path, monkeypatch, capsys):
+    monkeypatch.setattr(project_save, "PROJECTS_DIR", tmp_path / "projects")
+    rom_path = tmp_path / "test.gb"
+    rom_path.write_bytes(generate_rom(64).rom)
+    commands = tmp_path / "commands.txt"
+    commands.write_text(
+        "# Annotations\n"
+        "label create 01:4000 Func_4000\n"
+        "\n"
+        "comment inline Func_4000 'Entry point of the bank'\n"
+    )
+
+    assert main([str(rom_path), "--save", "test", "-c", str(commands)]) == 0
+    asm = load("test")
+    addr = Address.from_rom_offset(0x4000)
+    assert asm.labels.lookup("Func_4000").address == addr
+    assert asm.comments.inline[addr] == "Entry point of the bank"
+    assert asm.labels.lookup("main").address == Address.from_rom_offset(0x150)
+
+    # Nothing is saved when a command fails
+    commands.write_text("label create 01:5000 Func_5000\nlabel delete nope\n")
+    assert main(["-p", "test", "-c", str(commands), "--timing"]) == 1
+    assert f"{commands}:2:" in capsys.readouterr().err
+    assert "Func_5000" not in load("test").labels
+
+    commands.write_text("label create 01:5000 Func_5000\n")
+    assert main(["-p", "test", "-c", str(commands), "--timing"]) == 0
+    err = capsys.readouterr().err.splitlines()
+    assert [line.split()[0] for line in err] == [
+        "load", "commands", "save", "1",
+    ]
+    assert "Func_5000" in load("test").labels
+
+
+def test_parallel_index(tmp_path):
+    rom_path = tmp_path / "test.gb"
+    rom_path.write_bytes(generate_rom(128).rom)
+
+    def indexed(workers):
+        asm = Disassembler()
+        with open(rom_path, 'rb') as rom:
+            asm.load_rom(rom)
+        with asm.batch(reindex=False, rollback=False):
+            asm.setup_new_rom()
+            for n in range(0, 0x20000, 0x400):
+                asm.labels.auto_create(Address.from_rom_offset(n + 0x150))
+        index_banks(asm, workers)
+        return [
+            sorted(asm.xrefs.auto_links(bank))
+            for bank in range(asm.rom.n_banks)
+        ]
+
+    serial = indexed(1)
+    assert all(serial)
+    assert indexed(2) == serial
@@ -0,0 +1,39 @@
+from importlib.util import module_from_spec, spec_from_file_location
+import json
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).resolve().parent.parent / "benchmarks"
+
+
+def load_bench():
+    spec = spec_from_file_location("bench", BENCH_DIR / "bench.py")
+    bench = module_from_spec(spec)
+    spec.loader.exec_module(bench)
+    return bench
+
+
+def test_benchmarks_run(tmp_path):
+    bench = load_bench()
+    results = bench.run_cases(quick=True, repeat=1)
+    assert [res.name for res in results] == [case.name for case in bench.CASES]
+    assert all(res.time_ms > 0 for res in results)
+
+    # All the cases have a reference in the baseline
+    with open(bench.BASELINE, 'r', encoding='utf8') as baseline:
+        assert set(json.load(baseline)["results"]) == {
+            case.name for case in bench.CASES
+        }
+
+    path = tmp_path / "results.json"
+    bench.save_results(results, path)
+    assert bench.compare_results(results, path, tolerance=1.5) == []
+
+    # The notes written by hand are kept by the next save
+    with open(path, 'r', encoding='utf8') as saved:
+        data = json.load(saved)
+    data["notes"] = {"decode bank": "Note"}
+    with open(path, 'w', encoding='utf8') as saved:
+        json.dump(data, saved)
+    bench.save_results(results, path)
+    with open(path, 'r', encoding='utf8') as saved:
+        assert json.load(saved)["notes"] == {"decode bank": "Note"}
@@ -0,0 +1,93 @@
+import shlex
+
+from hypothesis import assume, given, strategies as st
+import pytest
+
+from ungameboy.address import Address
+from ungameboy.dis import Disassembler
+from ungameboy.commands import UgbCommandGroup, split_command
+
+
+def make_cli():
+    calls = []
+    cli = UgbCommandGroup(Disassembler(), "test")
+
+    @cli.add_command("run")
+    def run(address: Address, count: int = 1, name: str = '', *, flag=False):
+        calls.append((address, count, name, flag))
+
+    @cli.create_group("group").add_command("echo")
+    def echo(text: str):
+        calls.append(text)
+
+    return cli, calls
+
+
+def test_run_many_matches_call():
+    lines = [
+        "run ROM.1:4000",
+        "run $150 0x10 --flag",
+        "run ROM.0:0150 --name 'it'\"'\"'s here' 3",
+        "",
+        "# Comment",
+    ]
+    cli, calls = make_cli()
+    for line in lines:
+        if line and not line.startswith('#'):
+            cli(line)
+    expected = calls.copy()
+
+    calls.clear()
+    cli.run_many(lines)
+    assert calls == expected == [
+        (Address.parse("ROM.1:4000"), 1, '', False),
+        (Address.parse("$150"), 16, '', True),
+        (Address.parse("ROM.0:0150"), 3, "it's here", False),
+    ]
+
+
+@pytest.mark.parametrize("line", [
+    "run", "run $150 1 a b", "run $150 --name", "run $150 --other",
+    "run $150 --count 1 2", "run nowhere",
+])
+def test_invalid_arguments(line):
+    cli, _ = make_cli()
+    with pytest.raises(TypeError):
+        cli(line)
+    with pytest.raises(TypeError):
+        cli.run_many([line])
+
+
+@pytest.mark.parametrize("line", ["group", "group other", "other", "run2 $150"])
+def test_invalid_commands(line):
+    cli, _ = make_cli()
+    with pytest.raises(TypeError):
+        cli(line)
+    with pytest.raises(TypeError):
+        cli.run_many([line])
+
+
+@given(st.text(alphabet=' \t\n\x0b\xa0"\'\\#ab;$'))
+def test_split_command(line):
+    try:
+        expected = shlex.split(line)
+    except ValueError:
+        assume(False)
+    assert split_command(line) == expected
+
+
+def test_same_split_everywhere():
+    lines = [
+        r"group echo a\ b",
+        "group echo '#1'",
+        "group echo \"it's\"",
+        "group  echo\tc",
+    ]
+    cli, calls = make_cli()
+    for line in lines:
+        cli(line)
+    assert calls == ["a b", "#1", "it's", "c"]
+
+    calls.clear()
+    cli.run_many(lines)
+    assert calls == ["a b", "#1", "it's", "c"]
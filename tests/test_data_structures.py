@@ -0,0 +1,122 @@
+import operator
+
+from hypothesis import given, strategies as st
+import pytest
+
+from ungameboy.data_structures import SortedMapping, TrigramIndex
+
+names = st.text(alphabet="abcdefAB_.", min_size=1, max_size=12)
+
+
+@given(st.sets(names), st.sets(names), names, st.integers(0, 5))
+def test_trigram_find(added, removed, query, flushed):
+    index = TrigramIndex(added)
+    # Index some of the pending names before removing some
+    assert index.flush_some(flushed) == max(len(added) - flushed, 0)
+    for name in removed:
+        index.discard(name)
+
+    expected = sorted(
+        name for name in added - removed if query.lower() in name.lower()
+    )
+    assert index.find(query) == expected
+
+    is_global = (lambda name: '.' not in name)
+    assert index.find(query, where=is_global) == [
+        name for name in expected if is_global(name)
+    ]
+    limited = index.find(query, limit=3)
+    assert len(limited) == min(3, len(expected))
+    assert set(limited) <= set(expected) and limited == sorted(limited)
+
+
+def test_trigram_fuzzy():
+    index = TrigramIndex(["PlayerUpdate", "UpdatePlayerSprite", "EnemyInit"])
+    ranked = [name for _, name in index.fuzzy("playr", limit=5)]
+    assert ranked[:2] == ["PlayerUpdate", "UpdatePlayerSprite"]
+    assert "EnemyInit" not in ranked
+
+    # Substring matches rank before close spellings
+    index.add("UpdateEnemy")
+    ranked = [name for _, name in index.fuzzy("playerupd")]
+    assert ranked[0] == "PlayerUpdate"
+    assert "UpdateEnemy" in ranked
+
+
+keys = st.integers(0, 2000)
+
+
+@given(st.lists(st.tuples(
+    st.sampled_from([
+        "set", "del", "many", "merge", "delete_many", "add", "copy",
+    ]),
+    st.lists(keys, min_size=1, max_size=600),
+), max_size=30))
+def test_sorted_mapping(operations):
+    mapping = SortedMapping(copy_value=list.copy)
+    model = {}
+    # Copies taken along the way, with what they held at the time
+    copies = []
+
+    for op, op_keys in operations:
+        if op == "set":
+            for key in op_keys:
+                mapping[key], model[key] = [key], [key]
+        elif op == "del":
+            for key in op_keys:
+                if key in model:
+                    del mapping[key], model[key]
+        elif op == "many":
+            mapping.update_many((key, [key]) for key in op_keys)
+            model.update((key, [key]) for key in op_keys)
+        elif op == "merge":
+            mapping.update_many(
+                ((key, [-key]) for key in op_keys), merge=operator.add,
+            )
+            for key in set(op_keys):
+                model[key] = model.get(key, []) + [-key]
+        elif op == "delete_many":
+            present = {key for key in op_keys if key in model}
+            mapping.delete_many(present)
+            for key in present:
+                del model[key]
+        elif op == "add":
+            # Values changed in place are not seen by the copies
+            for key in op_keys:
+                mapping.setdefault(key, []).append(-key)
+                model[key] = model.get(key, []) + [-key]
+        else:
+            copies.append((mapping.copy(), {
+                key: list(value) for key, value in model.items()
+            }))
+
+    assert list(mapping) == sorted(model)
+    assert dict(mapping.iter_from(0)) == model
+    for copy, expected in copies:
+        assert len(copy) == len(expected)
+        assert dict(copy.iter_from(0)) == expected
+
+
+@given(st.sets(keys, min_size=1), keys, keys)
+def test_sorted_mapping_lookups(items, lookup, end):
+    mapping = SortedMapping((key, -key) for key in items)
+    ordered = sorted(items)
+
+    below = [key for key in ordered if key <= lookup]
+    above = [key for key in ordered if key >= lookup]
+    if below:
+        assert mapping.get_le(lookup) == (below[-1], -below[-1])
+    else:
+        with pytest.raises(KeyError):
+            mapping.get_le(lookup)
+    if above:
+        assert mapping.get_ge(lookup) == (above[0], -above[0])
+    after = [key for key in ordered if key > lookup]
+    if after:
+        assert mapping.get_gt(lookup) == (after[0], -after[0])
+
+    assert mapping.keys_between(lookup, end) == [
+        key for key in ordered if lookup <= key < end
+    ]
+    assert (lookup in mapping) == (lookup in items)
+    assert mapping.get(lookup) == (-lookup if lookup in items else None)
@@ -1,7 +1,44 @@
-from ungameboy.dis.graphics import zip_bits
+from ungameboy.address import Address
+from ungameboy.dis.data import Data
+from ungameboy.dis.graphics import (
+    decode_1bpp, decode_2bpp, decode_2bpp_planar, read_bitmap, zip_bits
+)
 
 
 class TestZip():
     zipped = bytes.fromhex('0707181f203f407f')
     unzipped = bytes.fromhex('003f03ea0eaa3aaa')
     assert bytes(zip_bits(zipped)) == unzipped
+
+
+def slow_2bpp(data):
+    for zipped in zip_bits(data):
+        yield zipped >> 6
+        yield (zipped & 0x30) >> 4
+        yield (zipped & 0x0c) >> 2
+        yield zipped & 0x03
+
+
+def test_decode_2bpp():
+    data = bytes(range(256)) + bytes(range(255, -1, -1))
+    assert decode_2bpp(data) == bytes(slow_2bpp(data))
+    assert decode_2bpp(bytes.fromhex('ff00')) == bytes([1] * 8)
+    assert decode_2bpp(bytes.fromhex('00ff')) == bytes([2] * 8)
+
+
+def test_decode_other_formats():
+    assert decode_1bpp(b'\xf0') == bytes([3] * 4 + [0] * 4)
+
+    tile = bytes(range(16))
+    planar = tile[0::2] + tile[1::2]
+    assert decode_2bpp_planar(planar) == decode_2bpp(tile)
+
+
+def test_read_bitmap_cache():
+    data = Data(Address.from_rom_offset(0x1000), 5)
+    data.rom_bytes = bytes.fromhex('ff00ff00ff')
+
+    bitmap = read_bitmap(data)
+    assert bitmap == bytes([1] * 16)
+    assert read_bitmap(data) is bitmap
+    assert len(read_bitmap(data, '1bpp')) == 40
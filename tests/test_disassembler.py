@@ -0,0 +1,197 @@
+from contextlib import nullcontext
+import gc
+from io import BytesIO
+import random
+
+import pytest
+
+from ungameboy.address import Address
+from ungameboy.dis import DataBlock, Disassembler, Instruction
+from ungameboy.commands import create_core_cli_v2, split_commands
+
+
+def make_asm():
+    rom = bytearray(0x8000)
+    # nop; jp $0150 at the entry point, then a call and a return
+    rom[0x100:0x104] = bytes([0x00, 0xc3, 0x50, 0x01])
+    rom[0x150:0x154] = bytes([0xcd, 0x60, 0x01, 0xc9])
+    rom[0x160] = 0xc9
+
+    asm = Disassembler()
+    asm.load_rom(BytesIO(bytes(rom)))
+    asm.setup_new_rom()
+    asm.xrefs.index(0)
+    return asm
+
+
+def test_query_fields():
+    asm = make_asm()
+    addr = Address.from_rom_offset(0x150)
+
+    res = asm.query(addr, ["labels", "dest_address", "next_address"])
+    assert set(res) == {"labels", "dest_address", "next_address"}
+    assert [lb.name for lb in res["labels"]] == ["main"]
+    assert res["dest_address"] == Address.from_rom_offset(0x160)
+    assert res["next_address"] == addr + 3
+
+    elem = asm[addr]
+    full = asm.query(addr)
+    assert full["raw_instruction"] == elem.raw_instruction
+    assert full["xrefs"] == elem.xrefs
+
+
+def test_query_range_matches_getitem():
+    asm = make_asm()
+    start = Address.from_rom_offset(0x100)
+    elems = list(asm.query_range(start, start + 0x70))
+
+    assert all(isinstance(elem, Instruction) for elem in elems[:2])
+    assert isinstance(elems[2], DataBlock)
+    assert elems[3].address == Address.from_rom_offset(0x150)
+    assert elems[3].scope.name == "main"
+    for elem in elems:
+        assert elem == asm[elem.address]
+
+
+def test_deferred_index_matches_immediate():
+    rng = random.Random(1)
+    rom = bytes(rng.getrandbits(8) for _ in range(0x8000))
+    starts = sorted({
+        Address.from_rom_offset(rng.randrange(0x150, 0x8000))
+        for _ in range(200)
+    })
+
+    def xrefs_after(deferred: bool):
+        asm = Disassembler()
+        asm.load_rom(BytesIO(rom))
+        names = [(addr, f"label_{n}") for n, addr in enumerate(starts)]
+        if deferred:
+            asm.labels.create_many(names)
+        else:
+            for addr, name in names:
+                asm.labels.create(addr, name)
+        return [
+            asm.xrefs.get_xrefs(Address.from_rom_offset(offset))
+            for offset in range(0x8000)
+        ]
+
+    assert xrefs_after(deferred=True) == xrefs_after(deferred=False)
+
+
+def test_iter_index_matches_index():
+    rom = bytearray(0x8000)
+    rom[0x100:0x104] = bytes([0x00, 0xc3, 0x50, 0x01])
+    rom[0x150:0x154] = bytes([0xcd, 0x60, 0x01, 0xc9])
+    rom[0x160] = 0xc9
+
+    def links(step: bool):
+        asm = Disassembler()
+        asm.load_rom(BytesIO(bytes(rom)))
+        asm.setup_new_rom()
+        if step:
+            steps = list(asm.xrefs.iter_index(0, fast=True))
+            assert steps == sorted(steps)
+        else:
+            asm.xrefs.index(0)
+        return asm.xrefs.auto_links(0)
+
+    assert links(step=True) == links(step=False) != []
+
+
+def test_batch_rollback():
+    asm = make_asm()
+    target = Address.from_rom_offset(0x160)
+    before = asm.xrefs.get_xrefs(target)
+
+    try:
+        with asm.batch():
+            asm.labels.create(Address.from_rom_offset(0x150), "func")
+            asm.comments.set_inline(target, "will be rolled back")
+            raise RuntimeError()
+    except RuntimeError:
+        pass
+
+    assert not asm.in_batch
+    assert "func" not in asm.labels
+    assert asm.labels.find("func") == []
+    assert target not in asm.comments.inline
+    assert asm.xrefs.get_xrefs(target) == before
+
+    with asm.batch():
+        asm.labels.create(Address.from_rom_offset(0x150), "func")
+    assert asm.xrefs.get_xrefs(target).called_by
+    # The search index is built again from the names after the rollback
+    assert asm.labels.find("func") == ["func"]
+    assert asm.labels.find("main") == ["main"]
+
+
+@pytest.mark.parametrize("in_batch", [False, True])
+def test_data_changes_reindex(in_batch):
+    asm = make_asm()
+    func, target = Address.from_rom_offset(0x150), Address.from_rom_offset(0x160)
+
+    def edits():
+        return asm.batch() if in_batch else nullcontext()
+
+    with edits():
+        asm.data.create_basic(func, 4)
+        # The garbage collector only pauses for the bulk work
+        assert gc.isenabled()
+    assert not asm.xrefs.get_xrefs(target).called_by
+
+    # The code under the deleted block gets indexed again from its label
+    with edits():
+        asm.data.delete(func)
+    assert asm.xrefs.get_xrefs(target).called_by == {func}
+
+    with edits():
+        asm.data.create_basic(func, 4)
+        asm.data.delete(func)
+        asm.data.create_basic(func + 3, 1)
+    assert asm.xrefs.get_xrefs(target).called_by == {func}
+
+
+def save_items(asm):
+    return [list(manager.save_items()) for manager in asm.managers]
+
+
+def test_snapshot():
+    asm = make_asm()
+    entry = Address.from_rom_offset(0x100)
+    asm.labels.create(entry, "start")
+    asm.labels.create(Address.from_rom_offset(0x103), "start.loop")
+    asm.comments.append_block_line(entry, "Entry point")
+    asm.sections.create(entry, "Boot")
+    asm.context.set_force_scalar(entry + 1)
+    asm.data.create_basic(Address.from_rom_offset(0x200), 4)
+
+    snapshot = asm.snapshot()
+    expected = save_items(snapshot)
+    assert expected == save_items(asm)
+    assert ('section', 'create', entry, "Boot") in expected[5]
+
+    asm.labels.rename("start", "boot")
+    asm.labels.delete("boot.loop")
+    asm.comments.append_block_line(entry, "Second line")
+    asm.comments.set_inline(entry, "jump")
+    asm.xrefs.index(1)
+    asm.sections.create(Address.from_rom_offset(0x150), "Main")
+    asm.context.clear_context(entry + 1)
+    asm.data.delete(Address.from_rom_offset(0x200))
+    assert save_items(snapshot) == expected
+    assert snapshot.labels.find("start") == ["start", "start.loop"]
+    assert save_items(asm) != expected
+
+    with pytest.raises(RuntimeError):
+        with snapshot.batch():
+            pass
+    with pytest.raises(RuntimeError):
+        create_core_cli_v2(snapshot)("label create $200 other")
+    assert save_items(snapshot) == expected
+
+
+def test_split_commands():
+    line = 'label create $150 func; comment inline $150 "a; b" ;;'
+    assert split_commands(line) == [
+        'label create $150 func', 'comment inline $150 "a; b"',
+    ]
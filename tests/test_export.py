@@ -0,0 +1,235 @@
+from io import BytesIO
+from pathlib import Path
+import re
+import shutil
+import subprocess
+from typing import Dict, List
+
+import pytest
+
+from ungameboy.address import Address
+from ungameboy.dis import Disassembler
+from ungameboy.dis.data import parse_row_struct
+from ungameboy.export import RgbdsExporter, export_project
+
+
+def make_asm():
+    rom = bytearray(0x8000)
+    rom[0x100:0x104] = bytes([0x00, 0xc3, 0x50, 0x01])
+    # ld a, [$c010]; jr @; jp $0150; ld bc, $1234
+    rom[0x150:0x15b] = bytes([
+        0xfa, 0x10, 0xc0, 0x18, 0xfe, 0xc3, 0x50, 0x01, 0x01, 0x34, 0x12,
+    ])
+    # jp $0210, twice
+    rom[0x200:0x203] = rom[0x220:0x223] = bytes([0xc3, 0x10, 0x02])
+    rom[0x4000:0x4004] = bytes([0x12, 0x34, 0x56, 0x78])
+
+    asm = Disassembler()
+    asm.load_rom(BytesIO(bytes(rom)))
+    asm.setup_new_rom()
+    asm.labels.create(Address.parse("WRAM.0:c010"), "wVar")
+    asm.labels.create(Address.from_rom_offset(0x153), ".loop")
+    # In the middle of the ld bc instruction
+    asm.labels.create(Address.from_rom_offset(0x159), ".inside")
+    asm.data.create_table(
+        Address.from_rom_offset(0x4000), 2, parse_row_struct('db,db')
+    )
+    asm.comments.set_inline(Address.from_rom_offset(0x150), "Load it")
+    return asm
+
+
+def add_sections(asm):
+    # In the middle of the jr instruction
+    asm.sections.create(Address.from_rom_offset(0x154), "Split")
+    # Mid-bank, with the locals of the global before it
+    asm.sections.create(Address.from_rom_offset(0x200), "Later")
+    asm.labels.create(Address.from_rom_offset(0x210), ".after")
+    asm.labels.create(Address.from_rom_offset(0x220), ".next")
+    # In the middle of a row of the table, and after it
+    asm.sections.create(Address.from_rom_offset(0x4003), "Table end")
+    asm.labels.create(Address.from_rom_offset(0x4001), "InRow")
+    asm.labels.create(Address.from_rom_offset(0x4010), "Bank1")
+
+
+def test_export_bank():
+    lines = list(RgbdsExporter(make_asm()).iter_bank(0))
+    start = lines.index("main:")
+    assert lines[start:start + 9] == [
+        "main:",
+        "    ld a, [wVar]  ; Load it",
+        ".loop",
+        "    jr .loop",
+        "    jp main",
+        "    db $01",
+        ".inside",
+        "    inc [hl]",
+        "    ld [de], a",
+    ]
+
+    lines = list(RgbdsExporter(make_asm()).iter_bank(1))
+    assert lines[:5] == [
+        "; ROM bank $01",
+        "",
+        'SECTION "ROM Bank $01", ROMX[$4000], BANK[$01]',
+        "    ; Table: 2 × db,db",
+        "    db $12, $34",
+    ]
+
+
+def test_export_workers(tmp_path):
+    asm = make_asm()
+    add_sections(asm)
+    export_project(asm, tmp_path / "serial")
+    export_project(asm, tmp_path / "parallel", workers=2)
+
+    files = sorted(path.name for path in (tmp_path / "serial").iterdir())
+    assert files == ["bank_00.asm", "bank_01.asm", "main.asm", "ram.asm"]
+    for name in files:
+        serial = (tmp_path / "serial" / name).read_text()
+        assert serial == (tmp_path / "parallel" / name).read_text()
+
+    ram = (tmp_path / "serial" / "ram.asm").read_text().splitlines()
+    assert ram[-3:] == ['SECTION "WRAM", WRAM0[$c000]', "    ds $10", "wVar:"]
+
+
+# What rgbasm and rgblink would check, as they may not be installed:
+# the syntax of each line, the scope of local labels, the labels used
+# being defined, and the bytes of each section being where it says.
+
+SECTION_RE = re.compile(
+    r'SECTION "[^"]+", (ROM0|ROMX|WRAM0|WRAMX|VRAM|SRAM|OAM|HRAM)'
+    r'\[\$([0-9a-f]{4})\](?:, BANK\[\$([0-9a-f]{2})\])?'
+)
+OPERAND_RE = re.compile(r"[\w.$]+")
+REGISTERS = {
+    'a', 'b', 'c', 'd', 'e', 'h', 'l', 'af', 'bc', 'de', 'hl', 'sp',
+    'z', 'nz', 'nc',
+}
+NUMBER_RE = re.compile(r"\$[0-9a-f]+|[+-]?\d+")
+
+
+def operands(text: str) -> List[str]:
+    """Label names and numbers in the operands of a line"""
+    return [
+        token for token in OPERAND_RE.findall(text)
+        if token not in REGISTERS and token not in ('HIGH', 'LOW')
+    ]
+
+
+def instruction_form(line: str) -> str:
+    mnemonic, _, args = line.strip().partition(' ')
+    return mnemonic + ' ' + OPERAND_RE.sub(
+        lambda match: match[0] if match[0] in REGISTERS else 'X', args
+    )
+
+
+def instruction_sizes() -> Dict[str, int]:
+    """Size of each instruction, by its form with the operands left out"""
+    rom = bytearray(0x8000)
+    starts = []
+    for code in range(0x100):
+        # Arguments that point to ROM, with CB-prefixed codes after
+        pos = 0x200 + 4 * code
+        rom[pos:pos + 3] = bytes([code, 0x34, 0x12])
+        starts.append(pos)
+        pos += 0x400
+        rom[pos:pos + 2] = bytes([0xcb, code])
+        starts.append(pos)
+
+    asm = Disassembler()
+    asm.load_rom(BytesIO(bytes(rom)))
+    exporter = RgbdsExporter(asm)
+    sizes: Dict[str, int] = {}
+    for start in starts:
+        elem = asm[Address.from_rom_offset(start)]
+        form = instruction_form(exporter.render_instruction(elem))
+        assert sizes.setdefault(form, elem.size) == elem.size, form
+    return sizes
+
+
+def check_rgbds(directory: Path, n_banks: int):
+    sizes = instruction_sizes()
+    defined, used = set(), []
+    files = ["ram.asm"] + [f"bank_{bank:02x}.asm" for bank in range(n_banks)]
+    main = (directory / "main.asm").read_text().splitlines()
+    assert [line for line in main if line.startswith("INCLUDE")] == [
+        f'INCLUDE "{name}"' for name in files
+    ]
+
+    def define(name: str):
+        assert name not in defined, f"{name} defined twice"
+        defined.add(name)
+
+    for name in files:
+        scope, pos, end = None, None, None
+        for line in (directory / name).read_text().splitlines():
+            line = line.partition(';')[0].rstrip()
+            if not line:
+                continue
+
+            if line.startswith("SECTION"):
+                match = SECTION_RE.fullmatch(line)
+                assert match, line
+                # The label scope does not carry over to a new section
+                scope = None
+                if match[1] in ('ROM0', 'ROMX'):
+                    offset = int(match[2], 16) & 0x3fff
+                    assert pos is None or pos == offset, line
+                    pos, end = offset, 0x4000
+                else:
+                    pos = None
+            elif line.startswith("DEF "):
+                define(line.split()[1])
+            elif line.startswith("."):
+                assert scope is not None, f"{line} out of a global's scope"
+                define(scope + line)
+            elif not line[0].isspace():
+                assert line.endswith(":"), line
+                label = line[:-1]
+                define(label)
+                if '.' not in label:
+                    scope = label
+            else:
+                mnemonic, _, args = line.strip().partition(' ')
+                if mnemonic == 'ds':
+                    size = int(operands(args)[0][1:], 16)
+                elif mnemonic in ('db', 'dw'):
+                    size = (args.count(',') + 1) * (1 + (mnemonic == 'dw'))
+                else:
+                    size = sizes[instruction_form(line)]
+                if pos is not None:
+                    pos += size
+
+                for token in operands(args):
+                    if NUMBER_RE.fullmatch(token) or token == '@':
+                        continue
+                    if token.startswith('.'):
+                        assert scope is not None, f"{line} out of scope"
+                        token = scope + token
+                    used.append(token)
+
+        assert pos == end, f"{name} ends at {pos}"
+
+    assert set(used) <= defined
+
+
+def test_export_is_valid(tmp_path):
+    asm = make_asm()
+    add_sections(asm)
+    export_project(asm, tmp_path)
+    check_rgbds(tmp_path, 2)
+
+    bank_0 = (tmp_path / "bank_00.asm").read_text().splitlines()
+    assert "    jp main.after" in bank_0
+    assert "    jp .after" not in bank_0[:bank_0.index("main.after:")]
+
+
+@pytest.mark.skipif(shutil.which("rgbasm") is None, reason="needs RGBDS")
+def test_export_assembles(tmp_path):
+    asm = make_asm()
+    add_sections(asm)
+    export_project(asm, tmp_path)
+
+    for command in ["rgbasm -o main.o main.asm", "rgblink -o game.gb main.o"]:
+        subprocess.run(command.split(), cwd=tmp_path, check=True)
+    assert (tmp_path / "game.gb").read_bytes() == bytes(asm.rom.rom)
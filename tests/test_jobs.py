@@ -0,0 +1,138 @@
+from io import BytesIO
+
+import pytest
+
+from ungameboy.address import ROM, Address
+from ungameboy.dis import Disassembler
+from ungameboy.commands import create_core_cli_v2
+from ungameboy.jobs import JobStatus
+from ungameboy.scripts import SCRIPTS, asm_script
+
+
+def make_asm(background=False):
+    rom = bytearray(0x10000)
+    rom[0x100:0x104] = bytes([0x00, 0xc3, 0x50, 0x01])
+    rom[0x150:0x154] = bytes([0xcd, 0x60, 0x01, 0xc9])
+    rom[0x160] = 0xc9
+    asm = Disassembler()
+    asm.load_rom(BytesIO(bytes(rom)))
+    asm.setup_new_rom()
+    asm.jobs.background = background
+    return asm
+
+
+def counter(log, name, steps):
+    for n in range(steps):
+        log.append(name)
+        yield f"{n + 1}/{steps}"
+
+
+def test_runs_right_away_without_background():
+    asm = make_asm()
+    log = []
+    job = asm.jobs.submit("count", counter(log, "a", 3))
+    assert job.status is JobStatus.Done
+    assert job.progress == "3/3"
+    assert log == ["a"] * 3
+    assert not asm.jobs.jobs
+
+
+def test_priorities():
+    asm = make_asm(background=True)
+    log = []
+    submitted = []
+    asm.jobs.on_submit = lambda: submitted.append(True)
+    asm.jobs.submit("low", counter(log, "low", 2), priority=-1)
+    asm.jobs.submit("first", counter(log, "first", 2))
+    asm.jobs.submit("second", counter(log, "second", 2))
+    assert log == [] and len(submitted) == 3
+
+    finished = asm.jobs.run_all()
+    assert [job.name for job in finished] == ["first", "second", "low"]
+    assert log == ["first"] * 2 + ["second"] * 2 + ["low"] * 2
+    assert all(job.status is JobStatus.Done for job in finished)
+
+
+def test_slices_and_cancel():
+    asm = make_asm(background=True)
+    log = []
+    job = asm.jobs.submit("count", counter(log, "a", 100))
+
+    assert asm.jobs.run_slice(0) == []
+    assert job.status is JobStatus.Running
+    assert len(log) == 1
+
+    cancelled = asm.jobs.cancel(job.id)
+    assert cancelled is job and job.status is JobStatus.Cancelled
+    assert asm.jobs.run_all() == []
+    assert len(log) == 1
+    with pytest.raises(KeyError):
+        asm.jobs.cancel(job.id)
+
+
+def test_failures():
+    def failing():
+        yield "started"
+        raise ValueError("oops")
+
+    asm = make_asm(background=True)
+    job = asm.jobs.submit("fail", failing())
+    assert asm.jobs.run_all() == [job]
+    assert job.status is JobStatus.Failed
+    assert isinstance(job.error, ValueError)
+    assert "oops" in asm.jobs.list()[-1]
+
+    # Without background, the error goes to the caller
+    asm.jobs.background = False
+    with pytest.raises(ValueError):
+        asm.jobs.submit("fail", failing())
+
+
+def test_commands():
+    expected = make_asm()
+    expected.xrefs.index(0)
+
+    asm = make_asm(background=True)
+    cli = create_core_cli_v2(asm)
+    cli("xref index 0")
+    cli("analyze detect_empty_banks")
+    assert [job.name for job in asm.jobs.jobs] == [
+        "xref index 00", "analyze detect_empty_banks",
+    ]
+    listing = cli("jobs list")
+    assert len(listing) == 3
+
+    cli("jobs cancel 2")
+    asm.jobs.run_all()
+    assert asm.xrefs.auto_links(0) == expected.xrefs.auto_links(0) != []
+    assert asm.data.get_data(Address(ROM, 3, 0)) is None
+
+    # In a batch, the job is done by the end of the command
+    with asm.batch():
+        cli("analyze detect_empty_banks")
+    assert not asm.jobs.jobs
+    assert asm.data.get_data(Address(ROM, 3, 0)) is not None
+
+
+def test_generator_scripts():
+    @asm_script("test.label_steps")
+    def label_steps(asm, count: int):
+        for n in range(count):
+            asm.labels.create(Address.from_rom_offset(0x200 + n), f"step_{n}")
+            yield n
+
+    try:
+        asm = make_asm(background=True)
+        cli = create_core_cli_v2(asm)
+        cli("script run test.label_steps 3")
+        job = asm.jobs.current
+        assert job.name == "script label_steps"
+        assert "step_0" not in asm.labels.find("step")
+
+        asm.jobs.run_slice(0)
+        assert job.progress == "0"
+        asm.jobs.run_all()
+        assert job.status is JobStatus.Done
+        assert asm.labels.lookup("step_2").address.offset == 0x200 + 2
+    finally:
+        del SCRIPTS["test.label_steps"]
@@ -0,0 +1,99 @@
+import random
+
+from ungameboy.address import WRAM, Address
+from ungameboy.dis import Disassembler
+from ungameboy.dis.labels import Label
+
+
+def rebuilt_labels(labels):
+    """Labels at each address, recomputed from the globals and locals"""
+    expected = {}
+    for addr, names in labels._globals.items():
+        for name in names:
+            expected.setdefault(addr, []).append(Label(addr, name))
+    for addr, names in labels._locals.items():
+        scope = labels.scope_at(addr)[-1].global_name
+        for name in names:
+            expected.setdefault(addr, []).append(Label(addr, scope, name))
+    return expected
+
+
+def test_incremental_updates():
+    rng = random.Random(0)
+    asm = Disassembler()
+    labels = asm.labels  # Labels in RAM, so that nothing gets indexed
+    labels.create(Address(WRAM, 0, 0), "Start")
+
+    for step in range(500):
+        addr = Address(WRAM, 0, rng.randrange(0x1000))
+        names = [name for name in labels._by_name]
+        action = rng.choice(["global", "local", "rename", "delete"])
+        try:
+            if action == "global":
+                labels.create(addr, f"glob{step}")
+            elif action == "local":
+                labels.create(addr, f".loc{step}")
+            elif not names:
+                continue
+            elif action == "rename":
+                name = rng.choice(names)
+                prefix = "." if "." in name else ""
+                labels.rename(name, f"{prefix}renamed{step}")
+            else:
+                labels.delete(rng.choice(names[1:] or names))
+        except ValueError:
+            pass
+
+        assert dict(labels._all.items()) == rebuilt_labels(labels)
+        assert sorted(labels._by_name) == sorted(
+            lb.name for lbs in labels._all.values() for lb in lbs
+        )
+        assert labels.find("") == sorted(labels._by_name)
+
+
+def test_sym_round_trip(tmp_path):
+    sym_path = tmp_path / "game.sym"
+    sym_path.write_text(
+        "; File generated by rgblink\n"
+        "00:0150 Main\n"
+        "00:0153 Main.loop\n"
+        "01:4000 Banked\n"
+        "00:4010 NoMBC ; ROM without banks\n"
+        "00:c000 wBuffer\n"
+    )
+
+    asm = Disassembler()
+    asm.labels.import_sym(str(sym_path))
+    assert asm.labels.lookup("Main.loop").address == Address.parse("$153")
+    assert asm.labels.lookup("Banked").address == Address.parse("ROM.1:4000")
+    assert asm.labels.lookup("NoMBC").address == Address.parse("ROM.1:4010")
+    assert asm.labels.lookup("wBuffer").address == Address.parse("WRAM.0:c000")
+
+    export_path = tmp_path / "export.sym"
+    asm.labels.export_sym(str(export_path))
+    other = Disassembler()
+    other.labels.import_sym(str(export_path))
+    assert dict(other.labels._all.items()) == dict(asm.labels._all.items())
+
+
+def test_find_and_index_names():
+    asm = Disassembler()
+    labels = asm.labels
+    labels.create_many(
+        (Address(WRAM, 0, n), f"Var_{n - n % 4}" + (f".x{n}" if n % 4 else ""))
+        for n in range(5000)
+    )
+
+    # The job building the index ahead of the searches
+    steps = list(labels.iter_index_names())
+    assert steps and steps == sorted(steps, reverse=True)
+    assert len(labels._search_index._pending) == 0
+
+    assert labels.find("var_12") == sorted(
+        name for name in labels._by_name if "var_12" in name.lower()
+    )
+    assert labels.find("var_12", local=False) == sorted(
+        name for name in labels._by_name
+        if name.startswith("Var_12") and "." not in name
+    )
+    assert len(labels.find("var_", limit=10)) == 10
@@ -0,0 +1,164 @@
+from io import BytesIO
+import random
+from threading import Event, Thread
+import time
+
+import pytest
+
+from ungameboy.address import ROM, Address
+from ungameboy.dis import Disassembler
+from ungameboy.commands import create_core_cli_v2
+from ungameboy.locking import RWLock
+
+
+def in_thread(func, *args) -> Thread:
+    thread = Thread(target=func, args=args, daemon=True)
+    thread.start()
+    return thread
+
+
+def test_readers_share():
+    lock = RWLock()
+    inside = Event()
+    release = Event()
+
+    def reader():
+        with lock.read():
+            inside.set()
+            release.wait(5)
+
+    thread = in_thread(reader)
+    assert inside.wait(5)
+    assert lock.acquire_read(blocking=False)
+    lock.release_read()
+    assert not lock.acquire_write(blocking=False)
+    assert not lock.acquire_write(timeout=0.01)
+
+    release.set()
+    thread.join(5)
+    assert lock.acquire_write(blocking=False)
+    lock.release_write()
+
+
+def test_writer_excludes():
+    lock = RWLock()
+    inside = Event()
+    release = Event()
+
+    def writer():
+        with lock.write():
+            inside.set()
+            release.wait(5)
+
+    thread = in_thread(writer)
+    assert inside.wait(5)
+    assert not lock.acquire_read(blocking=False)
+    assert not lock.acquire_read(timeout=0.01)
+    assert not lock.acquire_write(blocking=False)
+
+    release.set()
+    thread.join(5)
+    with lock.read():
+        pass
+
+
+def test_reentrant():
+    lock = RWLock()
+    with lock.write():
+        with lock.write(), lock.read():
+            assert lock.writing
+        assert lock.writing
+    assert not lock.writing
+
+    with lock.read(), lock.read():
+        with pytest.raises(RuntimeError):
+            lock.acquire_write()
+    with pytest.raises(RuntimeError):
+        lock.release_read()
+    with pytest.raises(RuntimeError):
+        lock.release_write()
+
+
+def test_waiting_writer_goes_first():
+    lock = RWLock()
+    order = []
+    lock.acquire_read()
+
+    def writer():
+        with lock.write():
+            order.append("writer")
+
+    def reader():
+        with lock.read():
+            order.append("reader")
+
+    writer_thread = in_thread(writer)
+    while not lock._writers_waiting:
+        time.sleep(0.001)
+    reader_thread = in_thread(reader)
+    time.sleep(0.01)
+    assert order == []
+
+    lock.release_read()
+    writer_thread.join(5)
+    reader_thread.join(5)
+    assert order == ["writer", "reader"]
+
+
+def make_asm():
+    rng = random.Random(0)
+    rom = bytes(rng.getrandbits(8) for _ in range(0x8000))
+    asm = Disassembler()
+    asm.load_rom(BytesIO(rom))
+    asm.setup_new_rom()
+    return asm
+
+
+def test_stress_readers_and_writers():
+    asm = make_asm()
+    cli = create_core_cli_v2(asm)
+    n_labels = len(asm.labels._by_name)
+    in_bank = len(list(asm.labels.get_all_in_bank(ROM, 1)))
+    stop = Event()
+    errors = []
+
+    def hammer(func):
+        try:
+            while not stop.is_set():
+                func()
+        except Exception as exc:
+            errors.append(exc)
+            stop.set()
+
+    def write():
+        # Each batch is all or nothing for the readers
+        rng = random.Random()
+        offsets = rng.sample(range(0x4000, 0x8000), 50)
+        with asm.batch():
+            for n, offset in enumerate(offsets):
+                asm.labels.create(Address.from_rom_offset(offset), f"tmp_{n}")
+        with asm.batch():
+            for n in range(50):
+                cli(f"label delete tmp_{n}")
+
+    def snapshot():
+        copy = asm.copy_state()
+        assert len(copy.labels._by_name) in (n_labels, n_labels + 50)
+
+    def read():
+        with asm.lock.read():
+            start = Address.from_rom_offset(rng.randrange(0x4000, 0x7f00))
+            assert len(list(asm.query_range(start, start + 0x100))) > 0
+            labels = len(list(asm.labels.get_all_in_bank(ROM, 1)))
+            assert labels in (in_bank, in_bank + 50)
+
+    rng = random.Random(1)
+    threads = [in_thread(hammer, func) for func in (write, snapshot, read)]
+    time.sleep(1.5)
+    stop.set()
+    for thread in threads:
+        thread.join(10)
+
+    assert not errors
+    assert len(asm.labels._by_name) == n_labels
+    assert not asm.lock._readers and asm.lock._writer is None
@@ -0,0 +1,72 @@
+from io import BytesIO
+import pstats
+
+import pytest
+
+from ungameboy.dis import Disassembler, ROMBytes
+from ungameboy.commands import create_core_cli_v2
+from ungameboy.profiling import PROFILER
+
+
+@pytest.fixture
+def profiler():
+    PROFILER.reset()
+    yield PROFILER
+    PROFILER.disable()
+    PROFILER.reset()
+
+
+def make_asm():
+    rom = bytearray(0x8000)
+    rom[0x100:0x104] = bytes([0x00, 0xc3, 0x50, 0x01])
+    asm = Disassembler()
+    asm.load_rom(BytesIO(bytes(rom)))
+    asm.setup_new_rom()
+    return asm
+
+
+def test_disabled(profiler):
+    decode = ROMBytes.decode_instruction
+    profiler.enable()
+    assert ROMBytes.decode_instruction is not decode
+    profiler.disable()
+    # No wrapper left behind
+    assert ROMBytes.decode_instruction is decode
+
+    make_asm().xrefs.index(0)
+    assert not profiler.timings
+
+
+def test_report(profiler):
+    asm = make_asm()
+    cli = create_core_cli_v2(asm)
+    cli("profile on")
+    cli("xref index 0")
+    cli("profile off")
+    cli("xref index 0")
+
+    assert profiler.timings["command xref index"].count == 1
+    decode = profiler.timings["decode_instruction"]
+    assert decode.count > 1
+    assert decode.percentile(50) <= decode.percentile(99) <= decode.max
+
+    report = cli("profile report")
+    assert report[0].split() == [
+        "timer", "calls", "total", "mean", "p50", "p95", "p99", "max",
+    ]
+    # Sorted by cumulative time
+    assert report[1].split()[0:2] == ["command", "xref"]
+
+    cli("profile reset")
+    assert not profiler.timings
+
+
+def test_dump(profiler, tmp_path):
+    asm = make_asm()
+    cli = create_core_cli_v2(asm)
+    path = tmp_path / "index.prof"
+    cli(f"profile dump {path} 'xref index 0'")
+
+    stats = pstats.Stats(str(path))
+    assert any(func[2] == "index_from" for func in stats.stats)
+    assert not profiler.timings
@@ -0,0 +1,170 @@
+from datetime import datetime, timezone
+
+from ungameboy import project_save
+from ungameboy.address import Address
+from ungameboy.dis import Disassembler
+from ungameboy.commands import create_core_cli_v2
+from ungameboy.scripts import SCRIPTS, asm_script
+
+
+def make_project(tmp_path, monkeypatch, n_banks=2):
+    monkeypatch.setattr(project_save, "PROJECTS_DIR", tmp_path / "projects")
+    rom_path = tmp_path / "test.gb"
+    rom_path.write_bytes(bytes(n_banks * 0x4000))
+
+    asm = Disassembler()
+    with open(rom_path, 'rb') as rom:
+        asm.load_rom(rom)
+    asm.project_name = "test"
+    return asm
+
+
+def load(name="test"):
+    asm = Disassembler()
+    asm.project_name = name
+    project_save.load_project(asm)
+    return asm
+
+
+def test_journal_replay(tmp_path, monkeypatch):
+    asm = make_project(tmp_path, monkeypatch)
+    asm.sections.create(Address.from_rom_offset(0x150), "Main code")
+    project_save.save_project(asm)
+
+    # Edits after the save are only in the journal
+    asm.labels.create(Address.from_rom_offset(0x150), "main")
+    project_save.record_command(asm, "label create $150 main")
+    asm.comments.set_inline(Address.from_rom_offset(0x150), "hello world")
+    for command in asm.comments.save_items_at(Address.from_rom_offset(0x150)):
+        project_save.record_command(asm, command)
+
+    loaded = load()
+    assert "main" in loaded.labels
+    assert loaded.comments.inline == asm.comments.inline
+    assert loaded.sections.get_section(Address.from_rom_offset(0x150)).name == (
+        "Main code"
+    )
+
+    # Compaction writes a new snapshot and trims the journal
+    asm.last_save = datetime.min.replace(tzinfo=timezone.utc)
+    save = project_save.autosave_project(asm)
+    save.join()
+    assert save.error is None
+    assert list(asm.journal.read_after(None)) == []
+    loaded = load()
+    assert "main" in loaded.labels
+
+
+def test_journal_mark_prevents_double_replay(tmp_path, monkeypatch):
+    asm = make_project(tmp_path, monkeypatch)
+    asm.labels.create(Address.from_rom_offset(0x150), "main")
+    asm.labels.rename("main", "start")
+    project_save.record_command(asm, "label create $150 main")
+    project_save.record_command(asm, "label rename main start")
+
+    # Snapshot written, but the journal was not trimmed yet
+    token = asm.journal.mark()
+    project_path = project_save.PROJECTS_DIR / "test.ugb.txt"
+    project_save.save_to_file(asm, project_path, token)
+
+    # Replaying the rename on top of the snapshot would fail
+    assert "start" in load().labels
+
+
+def test_import_sym_then_journal(tmp_path, monkeypatch):
+    from ungameboy.commands import create_core_cli_v2
+
+    asm = make_project(tmp_path, monkeypatch)
+    project_save.save_project(asm)
+    cli = create_core_cli_v2(asm)
+    sym_path = tmp_path / "test.sym"
+    sym_path.write_text("00:0150 main\n00:0160 func\n", encoding='utf8')
+
+    def run(command):
+        # As the prompt does
+        handler, args = cli.get_handler(command)
+        handler.run_tokens(args)
+        if handler.journal:
+            project_save.record_command(asm, command)
+
+    # A save still running does not get in the way
+    asm.saving = project_save.BackgroundSave(asm)
+    asm.saving.start()
+    run(f"label import-sym {sym_path}")
+    run("label rename func helper")
+    loaded = load()
+    assert "main" in loaded.labels
+    assert "helper" in loaded.labels
+    assert "func" not in loaded.labels
+
+    # In a batch, the save waits until the batch succeeds
+    sym_path.write_text("00:0170 other\n", encoding='utf8')
+    try:
+        with asm.batch():
+            run(f"label import-sym {sym_path}")
+            raise RuntimeError()
+    except RuntimeError:
+        pass
+    assert "other" not in asm.labels
+    assert not asm.save_pending
+    assert "other" not in load().labels
+
+    with asm.batch():
+        run(f"label import-sym {sym_path}")
+        run("label rename other more")
+    assert "more" in load().labels
+
+
+def test_cancelled_job_is_saved_not_journaled(tmp_path, monkeypatch):
+    asm = make_project(tmp_path, monkeypatch, n_banks=4)
+    project_save.save_project(asm)
+    asm.jobs.background = True
+    cli = create_core_cli_v2(asm)
+
+    # Banks 1 and 2 get marked, then the job is cancelled
+    for command in ["analyze detect_empty_banks", "xref index 0"]:
+        handler, _ = cli.get_handler(command)
+        cli(command)
+        assert not handler.journal
+    detect = asm.jobs.current
+    for _ in range(3):
+        detect.step()
+    cli(f"jobs cancel {detect.id}")
+    marked = [Address.from_rom_offset(0x4000), Address.from_rom_offset(0x8000)]
+    assert asm.data.get_data(marked[1] + 0x4000) is None
+
+    assert list(asm.journal.read_after(None)) == []
+    loaded = load()
+    assert [loaded.data.get_data(addr) is not None for addr in marked] == [
+        True, True,
+    ]
+    assert loaded.data.get_data(marked[1] + 0x4000) is None
+
+
+def test_cancelled_script_is_saved_not_journaled(tmp_path, monkeypatch):
+    @asm_script("test.save_steps")
+    def save_steps(asm):
+        for n in range(3):
+            asm.labels.create(Address.from_rom_offset(0x200 + n), f"step_{n}")
+            yield n
+
+    try:
+        asm = make_project(tmp_path, monkeypatch)
+        project_save.save_project(asm)
+        asm.jobs.background = True
+        cli = create_core_cli_v2(asm)
+
+        command = "script run test.save_steps"
+        handler, _ = cli.get_handler(command)
+        cli(command)
+        assert not handler.journal
+        job = asm.jobs.current
+        job.step()
+        cli(f"jobs cancel {job.id}")
+
+        assert list(asm.journal.read_after(None)) == []
+        loaded = load()
+        assert "step_0" in loaded.labels
+        assert "step_1" not in loaded.labels
+    finally:
+        del SCRIPTS["test.save_steps"]
@@ -0,0 +1,197 @@
+from io import BytesIO
+
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.completion import CompleteEvent
+from prompt_toolkit.document import Document
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+import pytest
+
+from ungameboy.address import Address
+from ungameboy.dis import Disassembler
+from ungameboy.commands import create_core_cli_v2
+from ungameboy.prompt.application import UGBApplication
+from ungameboy.prompt.gfx_display import PIXEL_CLASSES, GraphicsControl
+from ungameboy.prompt.prompt import CommandCompleter, split_typed
+from ungameboy.prompt.xref_browser import count_xrefs, get_selected_xref
+
+
+@pytest.fixture
+def ugb():
+    rom = bytearray(0x8000)
+    # nop; jp $0150 at the entry point, then two calls and a return
+    rom[0x100:0x104] = bytes([0x00, 0xc3, 0x50, 0x01])
+    rom[0x150:0x157] = bytes([0xcd, 0x60, 0x01, 0xcd, 0x60, 0x01, 0xc9])
+    rom[0x160] = 0xc9
+    # Two tiles: one of color 1 only, then one with mixed colors on top
+    rom[0x1000:0x1010] = bytes.fromhex('ff00') * 8
+    rom[0x1010:0x1018] = bytes.fromhex('00ff0ff0f00fffff')
+    asm = Disassembler()
+    asm.load_rom(BytesIO(bytes(rom)))
+    asm.setup_new_rom()
+    asm.xrefs.index(0)
+
+    with create_pipe_input() as pipe, \
+            create_app_session(input=pipe, output=DummyOutput()):
+        yield UGBApplication(asm)
+
+
+def test_gfx_render_line():
+    bitmap = bytes([0, 0, 1, 1, 1, 2, 3, 3]) + bytes([1] * 56) + bytes(64)
+    tokens = GraphicsControl.render_line(bitmap, 0, 2, 8, False)
+    # Consecutive pixels of the same color are merged
+    assert tokens == [
+        (PIXEL_CLASSES[0], '    '),
+        (PIXEL_CLASSES[1], '      '),
+        (PIXEL_CLASSES[2], '  '),
+        (PIXEL_CLASSES[3], '    '),
+        (PIXEL_CLASSES[0], '  ' * 8),
+    ]
+
+    # The tile IDs take the place of the first two pixels
+    tokens = GraphicsControl.render_line(bitmap, 0, 2, 8, True)
+    assert tokens[0] == (PIXEL_CLASSES[0], '0000')
+    assert tokens[-1] == (PIXEL_CLASSES[0], '0001' + '  ' * 6)
+
+
+def test_gfx_lines_cache(ugb):
+    create_core_cli_v2(ugb.asm)("data create basic $1000 32")
+    ugb.gfx.address = Address.from_rom_offset(0x1000)
+    control = ugb.layout.gfx_control
+
+    content = control.create_content(80, 20)
+    assert content.line_count == 8
+    first = content.get_line(0)
+    assert first == [(PIXEL_CLASSES[1], '  ' * 8), (PIXEL_CLASSES[2], '  ' * 8)]
+    assert content.get_line(0) is first
+    assert control.create_content(80, 20).get_line(0) is first
+
+    # Changing the display parameters renders the lines again
+    ugb.gfx.columns = 1
+    content = control.create_content(80, 20)
+    assert content.line_count == 16
+    assert content.get_line(0) == [(PIXEL_CLASSES[1], '  ' * 8)]
+    assert content.get_line(0) is not first
+    assert content.get_line(9) == [
+        (PIXEL_CLASSES[2], '  ' * 4), (PIXEL_CLASSES[1], '  ' * 4),
+    ]
+
+
+def line_text(tokens):
+    return ''.join(text for _, text in tokens)
+
+
+def test_xref_browser(ugb):
+    asm = ugb.asm
+    control = ugb.layout.xrefs_control
+    first, second = Address.from_rom_offset(0x150), Address.from_rom_offset(0x153)
+    ugb.xrefs.address = Address.from_rom_offset(0x160)
+
+    content = control.create_content(80, 20)
+    assert [line_text(content.get_line(n)) for n in range(3)] == [
+        'Called from:', f'  {first} (main +$0)', f'  {second} (main +$3)',
+    ]
+    assert count_xrefs(ugb) == 2
+    ugb.xrefs.cursor = 1
+    assert get_selected_xref(ugb) == second
+
+    # Nothing changed, the references are not sorted again
+    xrefs = control.xrefs
+    assert control.xrefs is xrefs
+
+    # Labels, xrefs and docstrings each refresh the content
+    asm.labels.rename("main", "func")
+    content = control.create_content(80, 20)
+    assert line_text(content.get_line(2)) == f'  {second} (func +$3)'
+    assert content.get_line(2)[1][0].endswith(',hl')
+
+    asm.xrefs.clear_auto(second)
+    assert control.xrefs == [first]
+    asm.comments.append_block_line(ugb.xrefs.address, "Does nothing")
+    content = control.create_content(80, 20)
+    assert line_text(content.get_line(0)) == '; Does nothing'
+    assert line_text(content.get_line(3)) == f'  {first} (func +$0)'
+
+
+def test_xref_browser_comment_only(ugb):
+    control = ugb.layout.xrefs_control
+    ugb.xrefs.address = Address.from_rom_offset(0x170)
+    content = control.create_content(80, 20)
+    assert content.line_count == 1
+    assert line_text(content.get_line(0)) == 'No references found'
+
+    # The docstring is shown even without any reference
+    ugb.asm.comments.append_block_line(ugb.xrefs.address, "Unused")
+    content = control.create_content(80, 20)
+    assert content.line_count == 1
+    assert line_text(content.get_line(0)) == '; Unused'
+    assert control.xrefs == []
+
+
+def test_split_typed():
+    assert split_typed('') == ([], '')
+    assert split_typed('label re') == (['label'], 're')
+    assert split_typed('label ') == (['label'], '')
+    assert split_typed('run "a b" \'c') == (['run', 'a b'], 'c')
+    assert split_typed('run a\\ ') == (['run'], 'a ')
+
+
+def completions(completer, text):
+    return [
+        (item.text, item.start_position)
+        for item in completer.get_completions(Document(text), CompleteEvent())
+    ]
+
+
+def test_command_completer(ugb):
+    asm = ugb.asm
+    cli = create_core_cli_v2(asm)
+    run_cli = cli.create_group("run")
+
+    @run_cli.add_command("with-text")
+    def with_text(text: str, address: Address, *, flag=False, count=0):
+        pass
+
+    completer = CommandCompleter(cli, asm)
+
+    def complete(text):
+        return completions(completer, text)
+
+    assert ('label', -3) in complete('lab')
+    assert complete('label ren') == [('rename', -3)]
+    assert complete('nothing her') == []
+    assert complete('label rename mai') == [('main', -3)]
+
+    # Quoted arguments count as one
+    assert complete('run with-text "a b" mai') == [('main', -3)]
+    assert complete('run with-text a b mai') == []
+    assert complete('run with-text --count 3 "a b" mai') == [('main', -3)]
+    assert complete('run with-text --count mai') == []
+    assert complete('run with-text a --fl') == [('--flag', -4)]
+
+
+def test_label_completer(ugb):
+    asm = ugb.asm
+    asm.labels.create(Address.from_rom_offset(0x200), "domain")
+    asm.labels.create(Address.from_rom_offset(0x201), "domain.again")
+    completer = CommandCompleter(create_core_cli_v2(asm), asm)
+
+    # Names containing the text follow the prefix matches, from three
+    # characters on, and local labels only once a scope is typed
+    assert completions(completer, 'label delete ma') == [('main', -2)]
+    assert completions(completer, 'label delete mai') == [
+        ('main', -3), ('domain', -3),
+    ]
+    assert completions(completer, 'label delete ai') == []
+    assert completions(completer, 'label delete n.ag') == [
+        ('domain.again', -4),
+    ]
+
+
+def test_run_command(ugb):
+    # Shortcuts give their arguments as a list
+    ugb.prompt.run_command(['inspect', '$160'])
+    assert ugb.xrefs.address == Address.from_rom_offset(0x160)
+
+    ugb.prompt.run_command('label create $200 first; label create $210 "second"')
+    assert ugb.asm.labels.get_labels(Address.from_rom_offset(0x210))
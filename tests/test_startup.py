@@ -0,0 +1,80 @@
+import json
+import os
+from pathlib import Path
+import subprocess
+import sys
+from time import perf_counter
+from typing import List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+# From launching ungameboy with a ROM to its first frame
+BUDGET_MS = 200
+# Only needed by some commands or once code is shown, they are imported
+# or built when first used
+DEFERRED = {
+    'cProfile', 'tracemalloc', 'uuid', 'multiprocessing', 'ungameboy.batch',
+    'ungameboy.export', 'ungameboy.synthetic', 'ungameboy.prompt.lexer',
+}
+
+# What `ungameboy ROM` does, with the terminal left out. The ROM is only
+# loaded after the first frame, which shows the loading progress.
+FIRST_FRAME = """
+import json, sys
+from prompt_toolkit.application import create_app_session
+from prompt_toolkit.input import create_pipe_input
+from prompt_toolkit.output import DummyOutput
+from ungameboy.dis import Disassembler
+from ungameboy.prompt.application import UGBApplication
+
+def first_frame(app):
+    if app.is_done:
+        return
+    instructions = vars(sys.modules['ungameboy.dis.instructions'])
+    print(json.dumps({
+        'modules': sorted(sys.modules),
+        'tables': 'CODE_POINTS' in instructions,
+    }), flush=True)
+    app.exit()
+
+with create_pipe_input() as pipe, \\
+        create_app_session(input=pipe, output=DummyOutput()):
+    asm = Disassembler()
+    asm.rom_path = sys.argv[1]
+    ugb = UGBApplication(asm)
+    ugb.app.after_render += first_frame
+    ugb.run()
+"""
+
+
+def first_frame(rom_path: Path, cache_dir: Path) -> Tuple[float, dict]:
+    """Time to the first frame in ms, and what was loaded by then"""
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=str(cache_dir))
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [
+        str(ROOT), env.get('PYTHONPATH'),
+    ]))
+
+    start = perf_counter()
+    with subprocess.Popen(
+            [sys.executable, "-c", FIRST_FRAME, str(rom_path)],
+            env=env, stdout=subprocess.PIPE, text=True,
+    ) as process:
+        line = process.stdout.readline()
+        elapsed = (perf_counter() - start) * 1000
+        process.stdout.read()
+    assert process.returncode == 0
+    return elapsed, json.loads(line)
+
+
+def test_first_frame(tmp_path):
+    rom_path = tmp_path / "test.gb"
+    rom_path.write_bytes(bytes(0x8000))
+    first_frame(rom_path, tmp_path)  # Write the bytecode cache
+
+    times: List[float] = []
+    for _ in range(3):
+        elapsed, loaded = first_frame(rom_path, tmp_path)
+        assert not DEFERRED & set(loaded['modules'])
+        assert not loaded['tables']
+        times.append(elapsed)
+    assert min(times) < BUDGET_MS
@@ -0,0 +1,56 @@
+from ungameboy import project_save
+from ungameboy.dis import Disassembler
+from ungameboy.dis.data import EmptyData, Jumptable
+from ungameboy.dis.decoder import HeaderDecoder
+from ungameboy.synthetic import generate_rom, write_project
+
+
+def test_deterministic():
+    assert generate_rom(64, seed=1).rom == generate_rom(64, seed=1).rom
+    assert generate_rom(64, seed=1).rom != generate_rom(64, seed=2).rom
+
+
+def test_header():
+    synth = generate_rom(256)
+    rom = synth.rom
+    assert len(rom) == 256 * 1024
+    header = HeaderDecoder(rom[0x100:0x150])
+    assert header.rom_banks == 16
+    assert header.title == "SYNTHETIC"
+    assert header.main_offset == synth.functions[0]
+
+    checksum = 0
+    for byte in rom[0x134:0x14d]:
+        checksum = (checksum - byte - 1) & 0xff
+    assert rom[0x14d] == checksum
+    total = sum(rom) - rom[0x14e] - rom[0x14f]
+    assert int.from_bytes(rom[0x14e:0x150], 'big') == total & 0xffff
+
+
+def test_load_project(tmp_path, monkeypatch):
+    monkeypatch.setattr(project_save, "PROJECTS_DIR", tmp_path / "projects")
+    synth = generate_rom(128)
+    write_project(synth, tmp_path / "synth.gb", "synth", n_labels=3000)
+
+    asm = Disassembler()
+    asm.project_name = "synth"
+    project_save.load_project(asm)
+    assert asm.rom.n_banks == 8
+    assert len(asm.labels._by_name) == 3000
+    assert asm.labels.lookup("main").address == synth.functions[0]
+
+    table, _ = synth.jump_tables[0]
+    assert isinstance(asm.data.get_data(table), Jumptable)
+    address, _ = synth.empty[-1]
+    assert isinstance(asm.data.get_data(address), EmptyData)
+    assert asm.comments.inline
+
+    # Functions call each other
+    for bank in range(asm.rom.n_banks):
+        asm.xrefs.index(bank)
+    called = [
+        func for func in synth.functions
+        if asm.xrefs.get_xrefs(func).called_by
+    ]
+    assert len(called) > len(synth.functions) * 0.9
+    assert synth.far_calls
@@ -69,6 +69,11 @@ class MemoryType(Enum):
             return NotImplemented
         return self._order > other._order
 
+    # Members are singletons, so hashing by identity is correct, and much
+    # cheaper than the default Enum hash, written in Python. It matters
+    # since every address lookup hashes its memory type.
+    __hash__ = object.__hash__
+
 
 ROM, VRAM, SRAM, WRAM, _, OAM, _, IOR, HRAM = MemoryType
 
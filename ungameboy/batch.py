@@ -0,0 +1,179 @@
+"""
+Headless entry point, to apply commands to a project without the UI.
+
+    ungameboy-batch game.gb --save game -c labels.txt -c comments.txt
+    ungameboy-batch -p game --index --workers 4 < commands.txt
+
+The commands are the same as at the prompt, one per line. Lines that
+are empty or start with '#' are skipped. The project is only saved if
+all the commands succeed.
+"""
+
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing import get_context
+import sys
+from time import perf_counter
+from typing import IO, Iterable, Iterator, List, Optional, Tuple
+
+from .address import Address
+from .dis import Disassembler
+from .commands import create_core_cli_v2
+from .profiling import PROFILER
+from .project_save import (
+    load_project, pickle_state, save_project, unpickle_state,
+)
+
+__all__ = ['index_banks', 'main', 'run_commands']
+
+Link = Tuple[str, Address, Address]
+
+
+class CommandError(Exception):
+    pass
+
+
+def run_commands(asm: Disassembler, lines: Iterable[str], source='<stdin>'):
+    """Run commands from a file, telling which line failed if any"""
+    cli = create_core_cli_v2(asm)
+    line_num = 0
+
+    def numbered() -> Iterator[str]:
+        nonlocal line_num
+        for line_num, line in enumerate(lines, start=1):
+            yield line
+
+    try:
+        cli.run_many(numbered())
+    except Exception as exc:
+        raise CommandError(f"{source}:{line_num}: {exc!r}") from exc
+    return line_num
+
+
+_worker_asm: Optional[Disassembler] = None
+
+
+def _init_worker(rom: bytes, state: bytes):
+    global _worker_asm
+    _worker_asm = unpickle_state(rom, state)
+
+
+def _index_bank(bank: int) -> List[Link]:
+    _worker_asm.xrefs.index(bank)
+    return _worker_asm.xrefs.auto_links(bank)
+
+
+def index_banks(asm: Disassembler, workers: int = 1):
+    """
+    Index all the ROM banks, splitting them between that many worker
+    processes. The result is the same as indexing them one by one.
+    """
+    banks = range(asm.rom.n_banks)
+    if workers <= 1:
+        for bank in banks:
+            asm.xrefs.index(bank)
+        return
+
+    # Workers get the state that the indexing reads, like for the export
+    state = pickle_state(asm, ('data', 'labels', 'context'))
+    with ProcessPoolExecutor(
+            workers,
+            mp_context=get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(asm.rom.rom, state),
+    ) as pool:
+        for links in pool.map(_index_bank, banks):
+            asm.xrefs.create_auto_links(links)
+
+
+@contextmanager
+def _phase(name: str, timings: List[Tuple[str, float]]) -> Iterator[None]:
+    start = perf_counter()
+    yield
+    timings.append((name, perf_counter() - start))
+
+
+def _command_files(paths: List[str]) -> Iterator[Tuple[str, IO[str]]]:
+    for path in paths or ['-']:
+        if path == '-':
+            yield '<stdin>', sys.stdin
+        else:
+            with open(path, 'r', encoding='utf8') as cmd_file:
+                yield path, cmd_file
+
+
+def main(argv: List[str] = None) -> int:
+    parser = ArgumentParser(
+        prog="ungameboy-batch",
+        description="Run UnGameBoy commands on a ROM or project, and save it",
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("rom", nargs='?', help="ROM to start a project from")
+    source.add_argument("-p", "--project", help="Project to load")
+    parser.add_argument("-c", "--commands", action='append', metavar="FILE",
+                        help="File of commands to run, '-' for stdin "
+                             "(default), can be repeated")
+    parser.add_argument("-s", "--save", metavar="NAME",
+                        help="Save the project under that name")
+    parser.add_argument("-n", "--dry-run", action='store_true',
+                        help="Do not save the project")
+    parser.add_argument("--index", action='store_true',
+                        help="Index all the banks after running the commands")
+    parser.add_argument("-j", "--workers", type=int, default=1,
+                        help="Number of processes for the indexing")
+    parser.add_argument("--timing", action='store_true',
+                        help="Print the duration of each step")
+    parser.add_argument("--profile", action='store_true',
+                        help="Print the profiler report at the end")
+    args = parser.parse_args(argv)
+
+    if args.profile:
+        PROFILER.enable()
+    timings: List[Tuple[str, float]] = []
+    asm = Disassembler()
+
+    with _phase("load", timings):
+        if args.project:
+            asm.project_name = args.project
+            load_project(asm)
+        else:
+            with open(args.rom, 'rb') as rom_file:
+                asm.load_rom(rom_file)
+            with asm.batch(reindex=False, rollback=False):
+                asm.setup_new_rom()
+                asm.analyze.detect_empty_banks()
+    if args.save:
+        asm.project_name = args.save
+
+    n_lines = 0
+    with _phase("commands", timings):
+        try:
+            # Commands are not indexed on the fly, so many of them can be
+            # applied quickly. They are indexed afterwards with --index.
+            with asm.batch(reindex=False, rollback=False):
+                for name, cmd_file in _command_files(args.commands):
+                    n_lines += run_commands(asm, cmd_file, name)
+        except CommandError as exc:
+            print(exc, file=sys.stderr)
+            return 1
+
+    if args.index:
+        with _phase("index", timings):
+            index_banks(asm, args.workers)
+
+    if asm.project_name and not args.dry_run:
+        with _phase("save", timings):
+            save_project(asm)
+
+    if args.timing:
+        for name, elapsed in timings:
+            print(f"{name:<10} {elapsed * 1000:10.1f} ms", file=sys.stderr)
+        print(f"{n_lines:,} lines of commands", file=sys.stderr)
+    if args.profile:
+        print("\n".join(PROFILER.report()), file=sys.stderr)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,16 +1,24 @@
+from functools import lru_cache
 from inspect import Parameter, signature
+import re
 import shlex
-from typing import TYPE_CHECKING, Callable, Dict, List, Tuple, Union
+from typing import (
+    TYPE_CHECKING, Any, Callable, Dict, Iterable, List, Sequence, Tuple, Union,
+)
 
 from .address import Address
 from .dis.data import DataProcessor
-from .project_save import save_project, load_project, import_plugin
+from .profiling import PROFILER
+from .project_save import (
+    save_project, save_now, load_project, import_plugin, record_command,
+)
 
 if TYPE_CHECKING:
     from .dis.disassembler import Disassembler
 
 __all__ = [
     'LabelName', 'UgbCommand', 'UgbCommandGroup', 'create_core_cli_v2',
+    'format_output', 'split_command', 'split_commands',
 ]
 
 Cmd = Union[str, Tuple[str]]
@@ -23,17 +31,26 @@ class LabelName(str):
 class UgbCommand:
     """Handling code for a single command."""
 
-    def __init__(self, asm: 'Disassembler', handler: Callable):
+    def __init__(
+            self, asm: 'Disassembler', handler: Callable, journal=True,
+            name: str = '',
+    ):
+        self.name = name or handler.__name__
         self.args: List[Parameter] = []
         self.options: Dict[str, Parameter] = {}
         self.handler = handler
         self.asm = asm
+        # Whether running the command should be recorded in the project
+        # journal. Commands that only display things or that work on the
+        # project files themselves are not.
+        self.journal = journal
 
         # Go through the arguments for the handler. For now, support is
         # limited to positional or keyword args. Keyword args with False
         # as default will be considered "flags" that can be specified at
         # the end of the call.
-        for param in signature(handler).parameters.values():
+        params = signature(handler).parameters
+        for param in params.values():
             if param.kind is Parameter.KEYWORD_ONLY:
                 if param.default is Parameter.empty:
                     raise TypeError("Keyword-only arg must have a default")
@@ -47,85 +64,116 @@ class UgbCommand:
             else:
                 raise TypeError(f"Unsupported command arg type: {param}")
 
+        # Converters for the arguments, picked once from the annotations
+        self.converters: Dict[str, Callable[[str], Any]] = {
+            name: self._get_converter(param.annotation)
+            for name, param in params.items()
+        }
+        self.required = frozenset(
+            param.name for param in self.args
+            if param.default is Parameter.empty
+        )
+
+    def _get_converter(self, arg_type) -> Callable[[str], Any]:
+        if arg_type is Address:
+            return self._to_address
+        if arg_type is int:
+            return _to_int
+        if arg_type is DataProcessor:
+            return arg_type.parse
+        return str
+
+    def _to_address(self, value: str) -> Address:
+        labels = self.asm.labels
+        if value in labels:
+            return labels.lookup(value).address
+        try:
+            return parse_address(value)
+        except ValueError:
+            raise TypeError(f"Not a valid address or label: {value}")
+
     def process_arg(self, value, param: Parameter):
         """Apply type conversion to the argument"""
         if not isinstance(value, str):
             return value
-        arg_type = param.annotation
+        return self.converters[param.name](value)
 
-        if arg_type is Address:
-            if value in self.asm.labels:
-                return self.asm.labels.lookup(value).address
-            try:
-                value = Address.parse(value)
-            except ValueError:
-                raise TypeError(f"Not a valid address or label: {value}")
+    def run_tokens(self, tokens: Sequence):
+        """Run the command with its arguments already split"""
+        with self.asm.lock.write():
+            if PROFILER.enabled:
+                with PROFILER.section(f"command {self.name}"):
+                    return self._run_tokens(tokens)
+            return self._run_tokens(tokens)
 
-        if arg_type is int:
-            if value.startswith('0x'):
-                value, base = value[2:], 16
-            elif value.startswith('$'):
-                value, base = value[1:], 16
+    def _run_tokens(self, tokens: Sequence):
+        args = {}
+        positional = iter(self.args)
+        tokens = iter(tokens)
+
+        for token in tokens:
+            if isinstance(token, str) and token.startswith("--"):
+                param = self.options.get(token[2:])
+                if param is None:
+                    raise TypeError(f"Unrecognized argument: {token}")
+                if param.default is False:
+                    value = True
+                else:
+                    value = next(tokens, None)
+                    if value is None:
+                        raise TypeError("Ran out of arguments")
             else:
-                base = 10
-            return int(value, base=base)
+                param = next(positional, None)
+                if param is None:
+                    raise TypeError(f"Extra unused argument: {token}")
+                value = token
 
-        if arg_type is DataProcessor:
-            return arg_type.parse(value)
+            name = param.name
+            if name in args:
+                raise TypeError(f"Argument {name} already defined")
+            if isinstance(value, str):
+                value = self.converters[name](value)
+            args[name] = value
 
-        return value
+        if not self.required.issubset(args):
+            raise TypeError("Missing arguments")
 
-    def __call__(self, command: Cmd):
-        args_queue = self.args.copy()
-        args = {}
+        return self.handler(**args)
 
+    def __call__(self, command: Cmd):
         if isinstance(command, str):
-            command = command.strip()
+            command = split_command(command)
+        return self.run_tokens(command)
 
-        def get_head() -> str:
-            nonlocal command
-            if isinstance(command, str):
-                if command.startswith(('"', "'")):
-                    head, *command = shlex.split(command)
-                else:
-                    head, _, command = command.partition(' ')
-                    command = command.lstrip()
-            else:
-                if not command:
-                    raise TypeError("Ran out of arguments")
-                head, *command = command
-            return head
 
-        def register(value, parameter: Parameter):
-            name = parameter.name
-            if name in args:
-                raise TypeError(f"Argument {name} already defined")
-            args[name] = self.process_arg(value, parameter)
+# Characters that str.split does not handle the way shlex does
+_NEEDS_SHLEX = re.compile(r'["\'\\]|[^\S \t\r\n]')
 
-        # Go through the positional arguments
-        while command:
-            arg = get_head()
 
-            if arg.startswith("--"):
-                arg = arg[2:]
-                if arg not in self.options:
-                    raise TypeError(f"Unrecognized argument: --{arg}")
+def split_command(command: str) -> List[str]:
+    """
+    Split a command into its arguments, with the quoting rules of the
+    shell. The commands typed at the prompt and the lines of the project
+    files are split the same way, so a saved command replays as typed.
+    """
+    if _NEEDS_SHLEX.search(command) is None:
+        return command.split()
+    return shlex.split(command)
 
-                param = self.options[arg]
-                if param.default is False:
-                    register(True, param)
-                else:
-                    register(get_head(), param)
 
-            else:
-                if not args_queue:
-                    raise TypeError(f"Extra unused argument: {arg}")
-                register(arg, args_queue.pop(0))
+def _to_int(value: str) -> int:
+    if value.startswith('0x'):
+        value, base = value[2:], 16
+    elif value.startswith('$'):
+        value, base = value[1:], 16
+    else:
+        base = 10
+    return int(value, base=base)
 
-        if any(param.default is Parameter.empty for param in args_queue):
-            raise TypeError("Missing arguments")
 
-        return self.handler(**args)
+# Addresses are immutable, and the same ones come up again and again
+# when replaying a project.
+parse_address = lru_cache(maxsize=1 << 16)(Address.parse)
 
 
 class UgbCommandGroup:
@@ -134,13 +182,13 @@ class UgbCommandGroup:
         self.name = name
         self.commands: Dict[str, Union[UgbCommand, 'UgbCommandGroup']] = {}
 
-    def add_command(self, name: str, handler: Callable = None):
+    def add_command(self, name: str, handler: Callable = None, journal=True):
         if handler is None:
             # Work as a decorator
-            return lambda func: self.add_command(name, func)
+            return lambda func: self.add_command(name, func, journal)
         if name in self.commands:
             raise KeyError(f"Command {name} already exists")
-        handler = UgbCommand(self.asm, handler)
+        handler = UgbCommand(self.asm, handler, journal, f"{self.name} {name}")
         self.commands[name] = handler
 
     def add_group(self, group: 'UgbCommandGroup'):
@@ -155,44 +203,94 @@ class UgbCommandGroup:
         self.add_group(group)
         return group
 
-    def get_handler(self, command: Cmd) -> Tuple[UgbCommand, Cmd]:
+    def get_handler(self, command: Cmd) -> Tuple[UgbCommand, Sequence]:
+        """Find the command to run, and the arguments that are left"""
         if isinstance(command, str):
-            instruction, _, command = command.strip().partition(' ')
-            command.lstrip()
-        else:
-            instruction, *command = command
-
-        handler = self.commands[instruction]
-        if isinstance(handler, UgbCommandGroup):
-            return handler.get_handler(command)
-        else:
-            return handler, command
+            command = split_command(command)
+
+        node: Union[UgbCommand, UgbCommandGroup] = self
+        pos = 0
+        while isinstance(node, UgbCommandGroup):
+            if pos == len(command):
+                raise TypeError(f"Incomplete command: {node.name}")
+            name = command[pos]
+            node = node.commands.get(name)
+            if node is None:
+                raise TypeError(f"Unknown command: {name}")
+            pos += 1
+        return node, command[pos:]
 
     def __call__(self, command: Union[str, Tuple[str]]):
         handler, command = self.get_handler(command)
         return handler(command)
 
+    def run_many(self, lines: Iterable[str]):
+        """
+        Run many commands, in the quoted format used by the project files.
+        Blank lines and lines starting with '#' are ignored.
+        """
+        get_handler = self.get_handler
+        for line in lines:
+            line = line.strip()
+            if not line or line[0] == '#':
+                continue
+            handler, tokens = get_handler(split_command(line))
+            handler.run_tokens(tokens)
+
+
+def split_commands(line: str) -> List[str]:
+    """Split a line on the semicolons that are not within quotes"""
+    commands = []
+    start, quote = 0, ''
+    for pos, char in enumerate(line):
+        if quote:
+            if char == quote:
+                quote = ''
+        elif char in '"\'':
+            quote = char
+        elif char == ';':
+            commands.append(line[start:pos])
+            start = pos + 1
+    commands.append(line[start:])
+    return [command.strip() for command in commands if command.strip()]
+
+
+def format_output(result) -> List[str]:
+    """Turn the value returned by a command into lines of text"""
+    if isinstance(result, str):
+        return result.splitlines()
+    if isinstance(result, dict):
+        return [f"{key}: {value}" for key, value in result.items()]
+    try:
+        return [str(item) for item in result]
+    except TypeError:
+        return [str(result)]
+
 
 def create_core_cli_v2(asm: 'Disassembler') -> UgbCommandGroup:
     ugb_cli = UgbCommandGroup(asm, "ungameboy")
     plugin_cli = ugb_cli.create_group("plugin")
     project_cli = ugb_cli.create_group("project")
 
-    @ugb_cli.add_command("load-rom")
+    @ugb_cli.add_command("load-rom", journal=False)
     def load_rom(rom_path: str):
+        replacing = asm.is_loaded
         with open(rom_path, 'rb') as rom_file:
             asm.load_rom(rom_file)
+        # The project files start from the ROM, and the journal does not
+        if replacing:
+            save_now(asm)
 
     plugin_cli.add_command("import", import_plugin)
 
     # Project commands
-    @project_cli.add_command("save")
+    @project_cli.add_command("save", journal=False)
     def project_save(name: str = ''):
         if name:
             asm.project_name = name
         save_project(asm)
 
-    @project_cli.add_command("load")
+    @project_cli.add_command("load", journal=False)
     def project_load(name: str = ''):
         if asm.is_loaded:
             raise ValueError("Project already loaded")
@@ -200,6 +298,32 @@ def create_core_cli_v2(asm: 'Disassembler') -> UgbCommandGroup:
             asm.project_name = name
         load_project(asm)
 
+    @project_cli.add_command("export", journal=False)
+    def project_export(directory: str, workers: int = 1):
+        from .export import export_project
+        export_project(asm, directory, workers)
+
+    # Profiling commands
+    profile_cli = ugb_cli.create_group("profile")
+    profile_cli.add_command("on", PROFILER.enable, journal=False)
+    profile_cli.add_command("off", PROFILER.disable, journal=False)
+    profile_cli.add_command("reset", PROFILER.reset, journal=False)
+    profile_cli.add_command("report", PROFILER.report, journal=False)
+
+    @profile_cli.add_command("dump", journal=False)
+    def profile_dump(path: str, command: str):
+        """Run a command under cProfile, and save the pstats to a file"""
+        handler, args = ugb_cli.get_handler(command)
+        result = PROFILER.dump(path, handler, args)
+        if handler.journal:
+            record_command(asm, command)
+        return result
+
+    # Background jobs
+    jobs_cli = ugb_cli.create_group("jobs")
+    jobs_cli.add_command("list", asm.jobs.list, journal=False)
+    jobs_cli.add_command("cancel", asm.jobs.cancel, journal=False)
+
     for mgr in asm.managers:
         ugb_cli.add_group(mgr.build_cli_v2())
 
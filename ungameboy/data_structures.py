@@ -1,6 +1,12 @@
 from bisect import bisect_left, bisect_right
+from collections import Counter
+from heapq import nsmallest
+from itertools import chain, islice
 from operator import itemgetter
-from typing import Generic, Iterator, List, Sequence, MutableMapping, Tuple, TypeVar
+from typing import (
+    Callable, Dict, Generic, Iterable, Iterator, List, Optional, Sequence, Set,
+    MutableMapping, Tuple, TypeVar,
+)
 
 from .address import Address
 
@@ -10,79 +16,359 @@ V = TypeVar('V')
 T = TypeVar('T')
 
 
-class SortedMapping(MutableMapping[K, V]):
-    def __init__(self, items: List[Tuple[K, V]] = ()):
-        self._keys: List[K] = []
-        self._values: List[V] = []
+# Entries per chunk of a SortedMapping. A chunk is split in two when it
+# grows past twice that size.
+CHUNK_SIZE = 256
+
 
-        pre_sorted = sorted(items, key=itemgetter(0))
+class SortedMapping(MutableMapping[K, V]):
+    """
+    Mapping that keeps its keys sorted, stored as a list of chunks of
+    keys and values. Copies share the chunks, and a chunk gets copied by
+    the first change made to it on either side, so that copying is O(1)
+    and changes only copy the chunks that they touch.
+
+    Values are shared between copies as well, until their chunk gets
+    copied, with `copy_value` when given. Values that get changed in
+    place must be fetched with `setdefault` or `mutable`, never with a
+    plain lookup.
+    """
 
-        for key, value in pre_sorted:
-            if self._keys and self._keys[-1] == key:
-                self._values[-1] = value
-            else:
-                self._keys.append(key)
-                self._values.append(value)
+    def __init__(
+            self,
+            items: Iterable[Tuple[K, V]] = (),
+            copy_value: Callable[[V], V] = None,
+    ):
+        self._copy_value = copy_value
+        self._keys: List[List[K]] = []
+        self._values: List[List[V]] = []
+        # Last key of each chunk
+        self._maxes: List[K] = []
+        self._len = 0
+        # Chunks that are not shared with a copy, by id of their keys
+        self._owned: Set[int] = set()
+        # Whether the lists of chunks are shared with a copy
+        self._shared = False
+
+        merged = dict(sorted(items, key=itemgetter(0)))
+        self._extend(list(merged.items()))
 
     def __len__(self):
-        return len(self._keys)
+        return self._len
 
-    def __iter__(self):
-        return iter(self._keys)
+    def __iter__(self) -> Iterator[K]:
+        return chain.from_iterable(self._keys)
 
     def __getitem__(self, item: K) -> V:
-        pos = bisect_left(self._keys, item)
-        if pos >= len(self) or self._keys[pos] != item:
-            raise KeyError(item)
-        return self._values[pos]
+        maxes = self._maxes
+        idx = bisect_left(maxes, item)
+        if idx < len(maxes):
+            keys = self._keys[idx]
+            pos = bisect_left(keys, item)
+            if keys[pos] == item:
+                return self._values[idx][pos]
+        raise KeyError(item)
+
+    def __contains__(self, item) -> bool:
+        maxes = self._maxes
+        idx = bisect_left(maxes, item)
+        if idx < len(maxes):
+            keys = self._keys[idx]
+            return keys[bisect_left(keys, item)] == item
+        return False
+
+    def get(self, key: K, default=None):
+        # Faster than the mixin method, which raises and catches
+        # a KeyError for every missing key.
+        maxes = self._maxes
+        idx = bisect_left(maxes, key)
+        if idx < len(maxes):
+            keys = self._keys[idx]
+            pos = bisect_left(keys, key)
+            if keys[pos] == key:
+                return self._values[idx][pos]
+        return default
+
+    # Copy on write
+
+    def copy(self) -> 'SortedMapping[K, V]':
+        """Independent copy, which shares the chunks until they change"""
+        new = type(self)(copy_value=self._copy_value)
+        new._keys, new._values = self._keys, self._values
+        new._maxes, new._len = self._maxes, self._len
+        new._shared = self._shared = True
+        self._owned = set()
+        return new
+
+    def __deepcopy__(self, memo) -> 'SortedMapping[K, V]':
+        # Values are immutable, or copied with their chunks
+        return self.copy()
+
+    def _own(self, idx: int):
+        """Make a chunk safe to change in place"""
+        if self._shared:
+            self._own_lists()
+
+        keys = self._keys[idx]
+        if id(keys) in self._owned:
+            return
+        keys = self._keys[idx] = keys.copy()
+        if self._copy_value is None:
+            self._values[idx] = self._values[idx].copy()
+        else:
+            copy_value = self._copy_value
+            self._values[idx] = [copy_value(val) for val in self._values[idx]]
+        self._owned.add(id(keys))
+
+    def _set_chunks(self, idx: int, end: int, chunks: List[Tuple[list, list]]):
+        """Replace the chunks from idx to end with new ones"""
+        if self._shared:
+            self._own_lists()
+        for keys in self._keys[idx:end]:
+            self._owned.discard(id(keys))
+        self._keys[idx:end] = [keys for keys, _ in chunks]
+        self._values[idx:end] = [values for _, values in chunks]
+        self._maxes[idx:end] = [keys[-1] for keys, _ in chunks]
+        self._owned.update(id(keys) for keys, _ in chunks)
+
+    def _own_lists(self):
+        self._keys = self._keys.copy()
+        self._values = self._values.copy()
+        self._maxes = self._maxes.copy()
+        self._shared = False
+
+    @staticmethod
+    def _chunked(keys: list, values: list) -> List[Tuple[list, list]]:
+        return [
+            (keys[pos:pos + CHUNK_SIZE], values[pos:pos + CHUNK_SIZE])
+            for pos in range(0, len(keys), CHUNK_SIZE)
+        ]
+
+    def _extend(self, items: List[Tuple[K, V]]):
+        """Add sorted items that all go after the last key"""
+        if not items:
+            return
+        keys = [key for key, _ in items]
+        values = [value for _, value in items]
+        self._len += len(items)
+
+        # Fill up the last chunk first, items are often added one by one
+        if self._keys and len(self._keys[-1]) < CHUNK_SIZE:
+            idx = len(self._keys) - 1
+            self._own(idx)
+            room = CHUNK_SIZE - len(self._keys[idx])
+            self._keys[idx].extend(keys[:room])
+            self._values[idx].extend(values[:room])
+            self._maxes[idx] = self._keys[idx][-1]
+            keys, values = keys[room:], values[room:]
+            if not keys:
+                return
+
+        self._set_chunks(len(self._keys), len(self._keys), self._chunked(
+            keys, values
+        ))
+
+    def _split(self, idx: int):
+        keys, values = self._keys[idx], self._values[idx]
+        half = len(keys) // 2
+        self._set_chunks(idx, idx + 1, [
+            (keys[:half], values[:half]), (keys[half:], values[half:]),
+        ])
+
+    # Changes
+
+    def setdefault(self, key: K, default: V = None) -> V:
+        """Same as for dicts, the value can be changed in place"""
+        maxes = self._maxes
+        idx = bisect_left(maxes, key)
+        if idx < len(maxes):
+            pos = bisect_left(self._keys[idx], key)
+            if self._keys[idx][pos] == key:
+                self._own(idx)
+                return self._values[idx][pos]
+        self[key] = default
+        return default
+
+    def mutable(self, key: K, default=None):
+        """Same as get, for a value that will be changed in place"""
+        maxes = self._maxes
+        idx = bisect_left(maxes, key)
+        if idx < len(maxes):
+            pos = bisect_left(self._keys[idx], key)
+            if self._keys[idx][pos] == key:
+                self._own(idx)
+                return self._values[idx][pos]
+        return default
 
     def __setitem__(self, key: K, value: V):
-        pos = bisect_left(self._keys, key)
-        if pos < len(self) and self._keys[pos] == key:
-            self._values[pos] = value
-        else:
-            self._keys.insert(pos, key)
-            self._values.insert(pos, value)
+        maxes = self._maxes
+        idx = bisect_left(maxes, key)
+        if idx == len(maxes):
+            if not maxes:
+                self._extend([(key, value)])
+                return
+            idx -= 1
+
+        self._own(idx)
+        keys, values = self._keys[idx], self._values[idx]
+        pos = bisect_left(keys, key)
+        if pos < len(keys) and keys[pos] == key:
+            values[pos] = value
+            return
+
+        keys.insert(pos, key)
+        values.insert(pos, value)
+        self._len += 1
+        if pos == len(keys) - 1:
+            self._maxes[idx] = key
+        if len(keys) > 2 * CHUNK_SIZE:
+            self._split(idx)
 
     def __delitem__(self, key: K):
-        pos = bisect_left(self._keys, key)
-        if self._keys[pos] != key:
+        maxes = self._maxes
+        idx = bisect_left(maxes, key)
+        if idx == len(maxes):
+            raise KeyError(key)
+        pos = bisect_left(self._keys[idx], key)
+        if self._keys[idx][pos] != key:
             raise KeyError(key)
-        self._keys.pop(pos)
-        self._values.pop(pos)
+
+        self._own(idx)
+        keys, values = self._keys[idx], self._values[idx]
+        del keys[pos]
+        del values[pos]
+        self._len -= 1
+        if not keys:
+            self._set_chunks(idx, idx + 1, [])
+        elif pos == len(keys):
+            self._maxes[idx] = keys[-1]
 
     def clear(self) -> None:
-        self._keys.clear()
-        self._values.clear()
+        self._keys, self._values, self._maxes = [], [], []
+        self._len = 0
+        self._owned = set()
+        self._shared = False
+
+    def _rebuild(self, items: Iterable[Tuple[K, V]]):
+        items = list(items)
+        self.clear()
+        self._extend(items)
+
+    def _owned_items(self) -> Iterator[Tuple[K, V]]:
+        """All items, with the values of shared chunks copied"""
+        copy_value = self._copy_value
+        for keys, values in zip(self._keys, self._values):
+            if copy_value is not None and id(keys) not in self._owned:
+                values = map(copy_value, values)
+            yield from zip(keys, values)
+
+    def update_many(
+            self, items: Iterable[Tuple[K, V]],
+            merge: Callable[[V, V], V] = None,
+    ):
+        """
+        Set many keys at once. Keys that all go after the existing ones
+        are appended as whole chunks, and the mapping is rebuilt in one
+        pass when there are many of them. With merge, the keys already
+        present get merge(current, new), which must not change current.
+        """
+        new_items = sorted(dict(items).items(), key=itemgetter(0))
+        if not new_items:
+            return
+
+        if not self._maxes or new_items[0][0] > self._maxes[-1]:
+            self._extend(new_items)
+        elif len(new_items) > self._len // 4:
+            merged = dict(self._owned_items())
+            if merge is not None:
+                new_items = [
+                    (key, merge(merged[key], value) if key in merged else value)
+                    for key, value in new_items
+                ]
+            merged.update(new_items)
+            self._rebuild(sorted(merged.items(), key=itemgetter(0)))
+        else:
+            for key, value in new_items:
+                if merge is not None and key in self:
+                    value = merge(self[key], value)
+                self[key] = value
+
+    def delete_many(self, keys: Iterable[K]):
+        """
+        Remove many keys at once, in a single pass when there are many
+        of them.
+        """
+        to_delete = set(keys)
+        if not to_delete:
+            return
+
+        if len(to_delete) <= self._len // 4:
+            for key in sorted(to_delete):
+                del self[key]
+            return
 
-    def _item(self, pos: int) -> Tuple[K, V]:
-        return self._keys[pos], self._values[pos]
+        kept = [item for item in self._owned_items() if item[0] not in to_delete]
+        if len(kept) != self._len - len(to_delete):
+            raise KeyError(min(to_delete - set(self)))
+        self._rebuild(kept)
+
+    # Ordered lookups
+
+    def keys_between(self, start: K, end: K) -> List[K]:
+        """Keys from start, included, to end, excluded"""
+        found = []
+        maxes = self._maxes
+        idx = bisect_left(maxes, start)
+        while idx < len(maxes):
+            keys = self._keys[idx]
+            if maxes[idx] >= end:
+                found.extend(
+                    keys[bisect_left(keys, start):bisect_left(keys, end)]
+                )
+                break
+            found.extend(keys[bisect_left(keys, start):])
+            idx += 1
+        return found
 
     def iter_from(self, start: K) -> Iterator[Tuple[K, V]]:
-        pos = bisect_left(self._keys, start)
-        while pos < len(self):
-            yield self._item(pos)
-            pos += 1
+        idx = bisect_left(self._maxes, start)
+        if idx == len(self._maxes):
+            return
+        pos = bisect_left(self._keys[idx], start)
+        while idx < len(self._keys):
+            keys, values = self._keys[idx], self._values[idx]
+            yield from zip(keys[pos:], values[pos:]) if pos else zip(
+                keys, values
+            )
+            idx += 1
+            pos = 0
 
     def get_le(self, item: K) -> Tuple[K, V]:
-        pos = bisect_right(self._keys, item)
-        if pos == 0:
+        idx = bisect_left(self._maxes, item)
+        if idx < len(self._maxes):
+            keys = self._keys[idx]
+            pos = bisect_right(keys, item)
+            if pos:
+                return keys[pos - 1], self._values[idx][pos - 1]
+        if idx == 0:
             raise KeyError(item)
-        return self._item(pos - 1)
+        return self._maxes[idx - 1], self._values[idx - 1][-1]
 
     def get_ge(self, item: K) -> Tuple[K, V]:
-        pos = bisect_right(self._keys, item)
-        if pos > 0 and self._keys[pos - 1] == item:
-            pos -= 1
-        elif pos >= len(self):
+        idx = bisect_left(self._maxes, item)
+        if idx == len(self._maxes):
             raise KeyError(item)
-        return self._item(pos)
+        keys = self._keys[idx]
+        pos = bisect_left(keys, item)
+        return keys[pos], self._values[idx][pos]
 
     def get_gt(self, item: K) -> Tuple[K, V]:
-        pos = bisect_right(self._keys, item)
-        if pos >= len(self):
+        idx = bisect_right(self._maxes, item)
+        if idx == len(self._maxes):
             raise KeyError(item)
-        return self._item(pos)
+        keys = self._keys[idx]
+        pos = bisect_right(keys, item)
+        return keys[pos], self._values[idx][pos]
 
 
 class AddressMapping(SortedMapping[Address, V]):
@@ -97,19 +383,142 @@ class SortedStrMapping(SortedMapping[str, V]):
     """Special case for string keys, where searching is implemented"""
 
     def search(self, string: str) -> Iterator[str]:
-        pos = bisect_left(self._keys, string)
-        lim = len(self)
+        for key, _ in self.iter_from(string):
+            if not key.startswith(string):
+                return
+            yield key
 
-        if not pos < lim:
-            return
-        key = self._keys[pos]
 
-        while key.startswith(string):
-            yield key
-            pos += 1
-            if not pos < lim:
-                break
-            key = self._keys[pos]
+def trigrams(string: str, pad=True) -> Set[str]:
+    if pad:
+        string = f"  {string} "
+    return {string[pos:pos + 3] for pos in range(len(string) - 2)}
+
+
+class TrigramIndex:
+    """
+    Case-insensitive substring and fuzzy search over a set of strings.
+    New strings are only indexed when the next search happens, so that
+    adding many of them in a row stays cheap.
+    """
+
+    def __init__(self, items: Iterable[str] = ()):
+        self._grams: Dict[str, Set[str]] = {}
+        self._sizes: Dict[str, int] = {}
+        self._pending: Set[str] = set(items)
+
+    def __len__(self):
+        return len(self._sizes) + len(self._pending)
+
+    def __contains__(self, item):
+        return item in self._sizes or item in self._pending
+
+    def clear(self):
+        self._grams.clear()
+        self._sizes.clear()
+        self._pending.clear()
+
+    def add(self, string: str):
+        if string not in self._sizes:
+            self._pending.add(string)
+
+    def remove(self, string: str):
+        if string in self._pending:
+            self._pending.remove(string)
+            return
+        if string not in self._sizes:
+            raise KeyError(string)
+
+        del self._sizes[string]
+        for gram in trigrams(string.lower()):
+            strings = self._grams[gram]
+            strings.discard(string)
+            if not strings:
+                del self._grams[gram]
+
+    def discard(self, string: str):
+        if string in self:
+            self.remove(string)
+
+    def _flush(self):
+        self.flush_some(len(self._pending))
+
+    def flush_some(self, count: int) -> int:
+        """
+        Index some of the new strings ahead of the next search, so that
+        it does not have to. Returns the number of strings left.
+        """
+        grams_index, pending = self._grams, self._pending
+        for _ in range(min(count, len(pending))):
+            string = pending.pop()
+            grams = trigrams(string.lower())
+            self._sizes[string] = len(grams)
+            for gram in grams:
+                grams_index.setdefault(gram, set()).add(string)
+        return len(pending)
+
+    def find(
+            self, substring: str, limit: int = None,
+            where: Callable[[str], bool] = None,
+    ) -> List[str]:
+        """
+        The indexed strings containing the substring, sorted, and only
+        those for which `where` is true if given. With a limit, the search
+        stops after finding that many, which are not necessarily the first
+        ones in order.
+        """
+        self._flush()
+        matches = self._matches(substring.lower(), where)
+        if limit is not None:
+            matches = islice(matches, limit)
+        return sorted(matches)
+
+    def _matches(
+            self, substring: str, where: Optional[Callable[[str], bool]]
+    ) -> Iterator[str]:
+        grams = trigrams(substring, pad=False)
+        if not grams:  # Too short to use the index
+            candidates, others = self._sizes.keys(), []
+        else:
+            postings = sorted(
+                (self._grams.get(gram, ()) for gram in grams), key=len
+            )
+            candidates, others = postings[0], postings[1:]
+        # Strings with the only trigram of the substring all contain it
+        check = len(substring) != 3
+
+        for string in candidates:
+            if where is not None and not where(string):
+                continue
+            if others and not all(string in other for other in others):
+                continue
+            if check and substring not in string.lower():
+                continue
+            yield string
+
+    def fuzzy(self, query: str, limit: int = 20) -> List[Tuple[float, str]]:
+        """
+        Rank the indexed strings by similarity with the query, using the
+        Jaccard index of their trigrams. Exact substring matches always
+        rank first. Returns (score, string) pairs, best first.
+        """
+        self._flush()
+        query = query.lower()
+        grams = trigrams(query)
+
+        shared: Counter = Counter()
+        for gram in grams:
+            shared.update(self._grams.get(gram, ()))
+
+        def score(item: Tuple[str, int]) -> float:
+            string, count = item
+            jaccard = count / (len(grams) + self._sizes[string] - count)
+            return jaccard + (query in string.lower())
+
+        ranked = nsmallest(
+            limit, shared.items(), key=lambda item: (-score(item), item[0])
+        )
+        return [(score(item), item[0]) for item in ranked]
 
 
 class StateStack(Sequence[T]):
@@ -1,21 +1,189 @@
+from collections.abc import Mapping
+from enum import Enum
+import sys
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+from typing import Iterator, List, Optional, Set, Tuple
+
 from .manager_base import AsmManager
 from ..address import ROM, Address
+from ..project_save import save_now
+
+# Shared by everything, and not owned by any manager
+OPAQUE_TYPES = (
+    type, ModuleType, FunctionType, MethodType, BuiltinFunctionType, Enum,
+)
+CONTAINERS = (list, tuple, set, frozenset)
+# Attributes of a manager are broken down to that depth in the report
+BREAKDOWN_DEPTH = 4
+
+
+def deep_sizeof(obj, seen: Set[int]) -> int:
+    """
+    Approximate memory used by an object and everything it refers to,
+    except for the objects in `seen`, which then get added to it.
+    """
+    size = 0
+    stack = [obj]
+    getsizeof = sys.getsizeof
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, OPAQUE_TYPES):
+            continue
+        seen.add(id(obj))
+        size += getsizeof(obj)
+
+        if isinstance(obj, dict):
+            stack.extend(obj.keys())
+            stack.extend(obj.values())
+        elif isinstance(obj, CONTAINERS):
+            stack.extend(obj)
+        elif isinstance(obj, (str, bytes, int, float)):
+            continue
+        else:
+            attrs = getattr(obj, '__dict__', None)
+            if attrs is not None:
+                stack.append(attrs)
+            for cls in type(obj).__mro__:
+                for slot in cls.__dict__.get('__slots__', ()):
+                    value = getattr(obj, slot, None)
+                    if value is not None:
+                        stack.append(value)
+    return size
+
+
+def _breakdown(
+        path: str, obj, seen: Set[int], depth: int
+) -> Iterator[Tuple[str, int]]:
+    """Deep size of the attributes of an object, recursively"""
+    if depth and type(obj) is dict and len(obj) <= 16 and all(
+            isinstance(key, str) for key in obj
+    ):
+        items = obj.items()
+    elif depth and hasattr(obj, '__dict__') and not isinstance(obj, Mapping):
+        items = vars(obj).items()
+    else:
+        yield path, deep_sizeof(obj, seen)
+        return
+
+    for name, value in items:
+        yield from _breakdown(f"{path}.{name}", value, seen, depth - 1)
+
+
+def format_size(size: int) -> str:
+    if size >= 1 << 20:
+        return f"{size / (1 << 20):.1f} MiB"
+    return f"{size / (1 << 10):.1f} KiB"
 
 
 class AnalysisManager(AsmManager):
     def detect_empty_banks(self):
-        for bank in range(1, self.asm.rom.n_banks):
+        with self.asm.lock.write():
+            for _ in self.iter_detect_empty_banks():
+                pass
+
+    def iter_detect_empty_banks(
+            self, marked: Optional[List[Address]] = None
+    ) -> Iterator[str]:
+        """
+        Mark the banks full of zeros as empty, yielding after each. The
+        start of the banks marked is added to `marked`, if given.
+        """
+        n_banks = self.asm.rom.n_banks
+        for bank in range(1, n_banks):
+            yield f"bank {bank:02x}/{n_banks - 1:02x}"
             if any(self.asm.rom.rom[bank * 0x4000:(bank + 1) * 0x4000]):
                 continue
             bank_start = Address(ROM, bank, 0)
             if self.asm.data.get_data(bank_start) is None:
                 self.asm.data.create_empty(bank_start, 0x4000)
+                if marked is not None:
+                    marked.append(bank_start)
+
+    def detect_empty_banks_job(self):
+        self.asm.jobs.submit(
+            "analyze detect_empty_banks", self._detect_empty_banks_steps()
+        )
+
+    def _detect_empty_banks_steps(self) -> Iterator[str]:
+        # The job can be cancelled halfway, which a replay of the command
+        # would not do, so the banks it marked are saved, not journaled.
+        marked = []
+        try:
+            yield from self.iter_detect_empty_banks(marked)
+        finally:
+            if marked:
+                save_now(self.asm)
+
+    def memory_usage(self) -> List[Tuple[str, int]]:
+        """
+        Approximate size retained by each attribute of the managers.
+        Objects shared between attributes are counted once, for the
+        first one that refers to them.
+        """
+        asm = self.asm
+        # The managers refer to each other, only measure their own state
+        seen = {id(asm), id(asm.rom)}
+        seen.update(id(manager) for manager in asm.managers)
+
+        usage = []
+        if asm.rom is not None:
+            usage.append(("rom", deep_sizeof(asm.rom, set())))
+        for attr, manager in vars(asm).items():
+            if manager in asm.managers:
+                for name, value in vars(manager).items():
+                    if name == 'asm':
+                        continue
+                    usage.extend(_breakdown(
+                        f"{attr}.{name}", value, seen, BREAKDOWN_DEPTH - 1
+                    ))
+        return usage
+
+    def memory_report(self, top: int = 10, trace=False) -> List[str]:
+        """
+        Memory used per manager, with the largest of their attributes.
+        Allocation sites are listed too while tracemalloc is tracing,
+        which --trace starts for the next reports.
+        """
+        import tracemalloc
+
+        usage = self.memory_usage()
+        totals = {}
+        for path, size in usage:
+            manager = path.split('.')[0]
+            totals[manager] = totals.get(manager, 0) + size
+
+        lines = ["Retained size per manager:"]
+        for manager, size in sorted(totals.items(), key=lambda it: -it[1]):
+            lines.append(f"  {manager:<32} {format_size(size):>12}")
+        lines.append(f"  {'total':<32} {format_size(sum(totals.values())):>12}")
+
+        lines.append("Top offenders:")
+        for path, size in sorted(usage, key=lambda it: -it[1])[:top]:
+            lines.append(f"  {path:<32} {format_size(size):>12}")
+
+        if tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces([
+                tracemalloc.Filter(False, tracemalloc.__file__),
+            ])
+            lines.append("Top allocation sites:")
+            for stat in snapshot.statistics('lineno')[:top]:
+                frame = stat.traceback[0]
+                site = f"{frame.filename}:{frame.lineno}"
+                lines.append(f"  {site:<60} {format_size(stat.size):>12}")
+        elif trace:
+            tracemalloc.start()
+            lines.append("Tracing allocations from now on")
+
+        return lines
 
     def build_cli_v2(self):
         from ..commands import UgbCommandGroup
 
         cli = UgbCommandGroup(self.asm, "analyze")
-        cli.add_command("detect_empty_banks", self.detect_empty_banks)
+        cli.add_command(
+            "detect_empty_banks", self.detect_empty_banks_job, journal=False
+        )
+        cli.add_command("memory", self.memory_report, journal=False)
         return cli
 
     def reset(self):
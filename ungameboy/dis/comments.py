@@ -15,7 +15,9 @@ class CommentsManager(AsmManager):
     def __init__(self, asm: 'Disassembler'):
         super().__init__(asm)
         self.inline: AddressMapping[str] = AddressMapping()
-        self.blocks: AddressMapping[List[str]] = AddressMapping()
+        self.blocks: AddressMapping[List[str]] = AddressMapping(
+            copy_value=list.copy
+        )
 
     def reset(self) -> None:
         self.inline.clear()
@@ -57,7 +59,7 @@ class CommentsManager(AsmManager):
     def pop_block_line(self, address: Address, index: int):
         if address not in self.blocks:
             return
-        block = self.blocks.get(address)
+        block = self.blocks.mutable(address)
         if not 0 <= index < len(block):
             index = len(block) - 1
         if block:  # In case an empty block exists
@@ -79,13 +81,23 @@ class CommentsManager(AsmManager):
         comments_cli.add_command("append", wrap_base64(self.append_block_line))
         return comments_cli
 
-    def save_items(self):
-        def encode(comm):
-            out = b64encode(comm.encode("utf8")).decode("ascii")
-            return (out, "--b64") if out else ()
+    @staticmethod
+    def _encode(comment: str):
+        out = b64encode(comment.encode("utf8")).decode("ascii")
+        return (out, "--b64") if out else ()
 
+    def save_items(self):
         for addr, comment in self.inline.items():
-            yield ('comment', 'inline', addr, *encode(comment))
+            yield ('comment', 'inline', addr, *self._encode(comment))
         for addr, lines in self.blocks.items():
             for comment in lines:
-                yield ('comment', 'append', addr, *encode(comment))
+                yield ('comment', 'append', addr, *self._encode(comment))
+
+    def save_items_at(self, address: Address):
+        """Commands recreating the comments at an address from scratch"""
+        yield ('comment', 'clear', address)
+        if address in self.inline:
+            comment = self._encode(self.inline[address])
+            yield ('comment', 'inline', address, *comment)
+        for comment in self.blocks.get(address, ()):
+            yield ('comment', 'append', address, *self._encode(comment))
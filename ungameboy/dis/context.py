@@ -1,10 +1,11 @@
-from typing import TYPE_CHECKING, Dict, List, Optional, Set, Tuple
+from typing import TYPE_CHECKING, List, Optional, Tuple
 
 from .special_labels import SpecialLabel
 from .labels import LabelOffset
 from .manager_base import AsmManager
 from ..address import Address, ROM
 from ..commands import UgbCommandGroup
+from ..data_structures import AddressMapping
 from ..data_types import Byte, Word, Ref, IORef
 from ..enums import Operation as Op
 
@@ -21,15 +22,23 @@ class ContextManager(AsmManager):
     def __init__(self, asm: "Disassembler"):
         super().__init__(asm)
 
-        self.force_scalar: Set[Address] = set()
-        self.bank_override: Dict[Address, int] = {}
+        # Addresses whose value is a scalar, mapped to True
+        self.force_scalar: AddressMapping[bool] = AddressMapping()
+        self.bank_override: AddressMapping[int] = AddressMapping()
 
     def reset(self) -> None:
         self.force_scalar.clear()
         self.bank_override.clear()
 
+    def snapshot_state(self):
+        # Only flags and bank numbers, which are immutable
+        return {
+            'force_scalar': self.force_scalar.copy(),
+            'bank_override': self.bank_override.copy(),
+        }
+
     def set_force_scalar(self, address: Address):
-        self.force_scalar.add(address)
+        self.force_scalar[address] = True
         self.asm.xrefs.index_from(address, single=True)
 
     def set_bank_number(self, address: Address, bank: int):
@@ -40,7 +49,7 @@ class ContextManager(AsmManager):
         self.asm.xrefs.index_from(address, single=True)
 
     def clear_context(self, address: Address):
-        self.force_scalar.discard(address)
+        self.force_scalar.pop(address, None)
         if address in self.bank_override:
             self.bank_override.pop(address)
         self.asm.xrefs.index_from(address, single=True)
@@ -137,7 +146,7 @@ class ContextManager(AsmManager):
         return context_cli
 
     def save_items(self):
-        addresses = set(self.bank_override) | self.force_scalar
+        addresses = set(self.bank_override) | set(self.force_scalar)
         for address in sorted(addresses):
             if address in self.force_scalar:
                 yield ('context', 'set', 'scalar', address)
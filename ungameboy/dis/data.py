@@ -42,6 +42,8 @@ PROCESSORS: Dict[str, Type['DataProcessor']] = {}
 
 @dataclass
 class Row:
+    __slots__ = ('address', 'num', 'items', 'bytes')
+
     address: Optional[Address]
     num: int
     items: List[RowItem]
@@ -410,12 +412,14 @@ class DataManager(AsmManager):
 
     def __init__(self, asm: 'Disassembler'):
         super().__init__(asm)
-        self.inventory: Dict[Address, Data] = {}
-        self._blocks_map: AddressMapping[int] = AddressMapping()
+        # Data blocks never change once inserted, copies can share them
+        self.inventory: AddressMapping[Data] = AddressMapping()
 
     def reset(self):
         self.inventory.clear()
-        self._blocks_map.clear()
+
+    def snapshot_state(self):
+        return {'inventory': self.inventory.copy()}
 
     def insert(self, data: Data, initial=False):
         data.populate(self.asm.rom)
@@ -432,11 +436,11 @@ class DataManager(AsmManager):
             raise ValueError("Data overlap detected")
 
         self.inventory[data.address] = data
-        self._blocks_map[data.address] = data.size
 
         if not initial:
+            # Indexing from the start of the block indexes the block
             self.asm.xrefs.clear_auto_range(data.address, data.next_address)
-            self.asm.xrefs.index_data(data.address)
+            self.asm.xrefs.index_from(data.address)
 
     def create_basic(
             self, address: Address, size: int, processor: DataProcessor = None
@@ -466,9 +470,8 @@ class DataManager(AsmManager):
         if address not in self.inventory:
             raise IndexError(address)
         blk = self.inventory[address]
-        self.asm.xrefs.clear_auto_range(blk.address, blk.next_address)
         del self.inventory[address]
-        del self._blocks_map[address]
+        self.asm.xrefs.reindex_range(blk.address, blk.next_address)
 
     def load(
             self,
@@ -482,19 +485,19 @@ class DataManager(AsmManager):
 
     def next_block(self, address: Address) -> Optional[Data]:
         try:
-            addr, _ = self._blocks_map.get_ge(address)
+            _, data = self.inventory.get_ge(address)
         except LookupError:
             return None
-        return self.inventory[addr]
+        return data
 
     def get_data(self, address: Address) -> Optional[Data]:
         try:
-            addr, size = self._blocks_map.get_le(address)
+            _, data = self.inventory.get_le(address)
         except LookupError:
             return None
-        if address >= addr + size:
+        if address >= data.next_address:
             return None
-        return self.inventory[addr]
+        return data
 
     def build_cli_v2(self) -> 'UgbCommandGroup':
         from ..commands import UgbCommandGroup
@@ -518,5 +521,5 @@ class DataManager(AsmManager):
         return data_cli
 
     def save_items(self):
-        for addr in sorted(self.inventory):
-            yield self.inventory[addr].save()
+        for data in self.inventory.values():
+            yield data.save()
@@ -1,6 +1,8 @@
-from .instructions import CODE_POINTS, RawInstruction
+from . import instructions
+from .instructions import RawInstruction
 from ..address import Address
 from ..enums import Operation
+from ..profiling import timed
 
 __all__ = ['HeaderDecoder', 'ROMBytes']
 
@@ -14,6 +16,7 @@ class ROMBytes:
     def __init__(self, rom_file):
         # Just store the entire ROM in memory
         self.rom = rom_file.read()
+        self._code_points = instructions.CODE_POINTS
 
     def __len__(self):
         return len(self.rom)
@@ -30,8 +33,9 @@ class ROMBytes:
         return 1 if banks == 2 else banks
 
     def size_of(self, offset: int) -> int:
-        return CODE_POINTS[self.rom[offset]].length
+        return self._code_points[self.rom[offset]].length
 
+    @timed("decode_instruction")
     def decode_instruction(self, offset: int) -> RawInstruction:
         """
         Decode the instruction for which the code is at a given address.
@@ -42,7 +46,7 @@ class ROMBytes:
             offset = addr.rom_file_offset
         else:
             addr = Address.from_rom_offset(offset)
-        op = CODE_POINTS[self.rom[offset]]
+        op = self._code_points[self.rom[offset]]
 
         if op.length == 1:
             parameters = b''
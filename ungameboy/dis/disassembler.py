@@ -1,21 +1,43 @@
+from contextlib import contextmanager
 from datetime import datetime, timezone
-from typing import BinaryIO, List, Optional
+from typing import (
+    TYPE_CHECKING, Any, BinaryIO, Dict, Iterable, Iterator, List, Optional,
+    Tuple, Type,
+)
 
 from .analysis import AnalysisManager
 from .comments import CommentsManager
 from .context import ContextManager
 from .data import DataManager, CartridgeHeader, EmptyData
 from .decoder import HeaderDecoder, ROMBytes
-from .labels import LabelManager
-from .manager_base import AsmManager
+from .labels import Label, LabelManager
+from .manager_base import AsmManager, gc_paused
 from .models import AsmElement, Instruction, DataBlock, DataRow, RamElement
 from .sections import SectionManager
-from .xrefs import XRefManager
+from .xrefs import XRefManager, XRefs
 from ..address import Address, ROM
 from ..commands import LabelName
+from ..jobs import JobScheduler
+from ..locking import RWLock
+from ..project_save import save_project
 from ..scripts import ScriptsManager
 
-__all__ = ['Disassembler']
+if TYPE_CHECKING:
+    from ..project_save import BackgroundSave, Journal
+
+__all__ = ['Disassembler', 'ELEMENT_FIELDS']
+
+
+ELEMENT_FIELDS = frozenset([
+    "address", "size", "next_address",
+    "labels", "scope", "section", "xrefs", "comment", "block_comment",
+    "dest_address", "bytes", "data", "raw_instruction", "value",
+    "values", "row",
+])
+_CONTENT_FIELDS = ELEMENT_FIELDS - {
+    "labels", "scope", "section", "xrefs", "comment", "block_comment",
+}
+_VALUE_FIELDS = {"dest_address", "value", "values"}
 
 
 class Disassembler:
@@ -28,6 +50,17 @@ class Disassembler:
         self.rom_path = None
         self.project_name = ""
         self.last_save = datetime.now(timezone.utc)
+        self.in_batch = False
+        # Whether the project must be saved at the end of the batch
+        self.save_pending = False
+        # Held to change the project, see the locking module
+        self.lock = RWLock()
+        # Log of the commands run since the project was last saved
+        self.journal: Optional['Journal'] = None
+        # Save running in the background, if any
+        self.saving: Optional['BackgroundSave'] = None
+        # Long operations, run in the background by the UI
+        self.jobs = JobScheduler(self)
 
         self.analyze = AnalysisManager(self)
         self.data = DataManager(self)
@@ -35,12 +68,12 @@ class Disassembler:
         self.context = ContextManager(self)
         self.labels = LabelManager(self)
         self.scripts = ScriptsManager(self)
-        self.sections = SectionManager()
+        self.sections = SectionManager(self)
         self.xrefs = XRefManager(self)
 
         self.managers: List[AsmManager] = [
             self.data, self.labels, self.xrefs, self.context, self.comments,
-            self.analyze, self.scripts,
+            self.sections, self.analyze, self.scripts,
         ]
 
     @property
@@ -48,15 +81,92 @@ class Disassembler:
         return self.rom is not None
 
     def reset(self):
-        for manager in self.managers:
-            manager.reset()
+        with self.lock.write():
+            for manager in self.managers:
+                manager.reset()
+
+    def copy_state(self, read_only=False) -> 'Disassembler':
+        """
+        Independent copy of the project, which can be read from another
+        thread while this one keeps changing. The sorted mappings are
+        shared until either side changes them, and the managers are
+        copied rather than built again, so this is cheap.
+        """
+        copy: Disassembler = object.__new__(Disassembler)
+        vars(copy).update(vars(self))
+        copy.in_batch = copy.save_pending = False
+        copy.lock = RWLock(read_only=read_only)
+        copy.journal = copy.saving = None
+        copy.jobs = JobScheduler(copy)
+
+        with self.lock.read(), gc_paused():
+            copies = {id(mgr): mgr.copy_for(copy) for mgr in self.managers}
+        copy.managers = [copies[id(mgr)] for mgr in self.managers]
+        for name, value in vars(self).items():
+            if id(value) in copies:
+                setattr(copy, name, copies[id(value)])
+        return copy
+
+    def snapshot(self) -> 'Disassembler':
+        """
+        Read-only copy of the project as it is now, for background work
+        such as saving. Commands and batches refuse to run on it.
+        """
+        return self.copy_state(read_only=True)
+
+    @contextmanager
+    def batch(self, reindex=True, rollback=True) -> Iterator[None]:
+        """
+        Group many edits together. Indexing is deferred to a single pass
+        at the end, or skipped entirely without reindex, and autosave is
+        suspended. If an exception escapes, the state from before the
+        batch is restored. Nested batches are part of the outer one. The
+        lock is held for writing meanwhile.
+        """
+        with self.lock.write():
+            if self.in_batch:
+                yield
+                return
+
+            states = None
+            if rollback:
+                states = [mgr.snapshot_state() for mgr in self.managers]
+
+            bypass_index = self.xrefs.bypass_index
+            self.in_batch = True
+            try:
+                if reindex:
+                    with self.xrefs.deferred_index():
+                        yield
+                else:
+                    self.xrefs.bypass_index = True
+                    yield
+            except BaseException:
+                if states is not None:
+                    for mgr, state in zip(self.managers, states):
+                        mgr.restore_state(state)
+                self.save_pending = False
+                raise
+            finally:
+                self.xrefs.bypass_index = bypass_index
+                self.in_batch = False
+
+            if self.save_pending:
+                self.save_pending = False
+                save_project(self)
 
     def load_rom(self, rom_file: BinaryIO):
-        if hasattr(rom_file, 'name'):
-            self.rom_path = rom_file.name
-        self.rom = ROMBytes(rom_file)
+        rom = ROMBytes(rom_file)
+        with self.lock.write():
+            if hasattr(rom_file, 'name'):
+                self.rom_path = rom_file.name
+            self.rom = rom
 
     def setup_new_rom(self):
+        with self.lock.write():
+            self._setup_new_rom()
+
+    def _setup_new_rom(self):
         if not self.is_loaded:
             return
 
@@ -76,14 +186,14 @@ class Disassembler:
         if main is not None and not self.labels.get_labels(main):
             self.labels.create(main, LabelName("main"))
 
-    def __getitem__(self, addr) -> AsmElement:
+    def _check_address(self, addr):
         if self.rom is None:
             raise ValueError("No ROM loaded")
         if not isinstance(addr, Address):
             raise TypeError()
 
-        scope = self.labels.scope_at(addr)
-        common_args = {
+    def _common_args(self, addr: Address, scope: List[Label]):
+        return {
             "labels": self.labels.get_labels(addr),
             "section": self.sections.get_section(addr),
             "xrefs": self.xrefs.get_xrefs(addr),
@@ -92,50 +202,150 @@ class Disassembler:
             "block_comment": self.comments.blocks.get(addr, []),
         }
 
+    def _content(
+            self, addr: Address, with_values=True
+    ) -> Tuple[Type[AsmElement], Dict[str, Any]]:
+        """
+        Decode what is at the given address: the element type and the
+        arguments specific to it. Context resolution (values and the
+        destination address) is the costly part, so it can be skipped.
+        """
         data = self.data.get_data(addr)
         if data is not None:
 
             if isinstance(data, (CartridgeHeader, EmptyData)):
-                return DataBlock(
-                    address=addr,
-                    size=data.size,
-                    dest_address=None,
-                    **common_args,
-                    bytes=data.rom_bytes,
-                    data=data,
-                )
+                return DataBlock, {
+                    "address": addr,
+                    "size": data.size,
+                    "dest_address": None,
+                    "bytes": data.rom_bytes,
+                    "data": data,
+                }
 
             row = data[addr]
-            row_values, dest_address = self.context.row_context(row)
-
-            return DataRow(
-                address=row.address,
-                size=len(row.bytes),
-                dest_address=dest_address,
-                **common_args,
-                bytes=row.bytes,
-                data=data,
-                values=row_values,
-                row=row.num,
+            row_values, dest_address = (
+                self.context.row_context(row) if with_values else (None, None)
             )
+            return DataRow, {
+                "address": row.address,
+                "size": len(row.bytes),
+                "dest_address": dest_address,
+                "bytes": row.bytes,
+                "data": data,
+                "values": row_values,
+                "row": row.num,
+            }
 
         elif addr.type is ROM:
             raw_instr = self.rom.decode_instruction(addr.rom_file_offset)
-            value, dest_address = self.context.instruction_context(raw_instr)
-
-            return Instruction(
-                address=raw_instr.address,
-                size=raw_instr.length,
-                dest_address=dest_address,
-                **common_args,
-                bytes=raw_instr.bytes,
-                raw_instruction=raw_instr,
-                value=value,
+            value, dest_address = (
+                self.context.instruction_context(raw_instr)
+                if with_values else (None, None)
             )
+            return Instruction, {
+                "address": raw_instr.address,
+                "size": raw_instr.length,
+                "dest_address": dest_address,
+                "bytes": raw_instr.bytes,
+                "raw_instruction": raw_instr,
+                "value": value,
+            }
 
         # VRAM/SRAM/WRAM/HRAM
-        return RamElement(
-            address=addr,
-            size=1,
-            **common_args,
+        return RamElement, {"address": addr, "size": 1}
+
+    def __getitem__(self, addr) -> AsmElement:
+        self._check_address(addr)
+        elem_type, content = self._content(addr)
+        return elem_type(
+            **content, **self._common_args(addr, self.labels.scope_at(addr))
         )
+
+    def query(
+            self, addr: Address, fields: Iterable[str] = ELEMENT_FIELDS
+    ) -> Dict[str, Any]:
+        """
+        Projection of the element at the given address: only compute the
+        requested fields and return them in a dictionary. Fields that do
+        not apply to the element (e.g. `value` on a data row) are None.
+        """
+        self._check_address(addr)
+        fields = set(fields)
+        unknown = fields - ELEMENT_FIELDS
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+        result = {}
+        if "labels" in fields:
+            result["labels"] = self.labels.get_labels(addr)
+        if "scope" in fields:
+            scope = self.labels.scope_at(addr)
+            result["scope"] = scope[-1] if scope else None
+        if "section" in fields:
+            result["section"] = self.sections.get_section(addr)
+        if "xrefs" in fields:
+            result["xrefs"] = self.xrefs.get_xrefs(addr)
+        if "comment" in fields:
+            result["comment"] = self.comments.inline.get(addr, "")
+        if "block_comment" in fields:
+            result["block_comment"] = self.comments.blocks.get(addr, [])
+
+        content_fields = fields & _CONTENT_FIELDS
+        if content_fields:
+            with_values = not content_fields.isdisjoint(_VALUE_FIELDS)
+            _, content = self._content(addr, with_values)
+            for name in content_fields:
+                result[name] = content.get(name)
+            if "next_address" in fields:
+                result["next_address"] = content["address"] + content["size"]
+
+        return result
+
+    def query_range(
+            self, start: Address, end: Address, with_xrefs=True
+    ) -> Iterator[AsmElement]:
+        """
+        Iterate over the elements from the start address, up to the end
+        address (excluded). Both must be in the same zone. The label and
+        scope lookups are shared between consecutive elements. Without
+        xrefs, the costliest lookup, the elements get empty ones.
+        """
+        self._check_address(start)
+        if start.zone != end.zone:
+            raise ValueError("Address range must be in a single zone")
+
+        get_xrefs = self.xrefs.get_xrefs if with_xrefs else XRefs.empty
+        scope = self.labels.scope_at(start)
+        labels_iter = self.labels.iter_from(start)
+        next_labels = next(labels_iter, None)
+
+        addr = start
+        while addr < end:
+            labels: List[Label] = []
+            # Labels skipped over (e.g. in the middle of an instruction)
+            # still need to be accounted for in the scope.
+            while next_labels is not None and next_labels[0] <= addr:
+                label_addr, found = next_labels
+                if label_addr.zone != addr.zone:
+                    next_labels = None
+                    break
+                glob = [label for label in found if label.is_global]
+                if glob:
+                    scope = glob
+                if label_addr == addr:
+                    labels = found
+                next_labels = next(labels_iter, None)
+
+            elem_type, content = self._content(addr)
+            elem = elem_type(
+                **content,
+                labels=labels,
+                section=self.sections.get_section(addr),
+                xrefs=get_xrefs(addr),
+                scope=scope[-1] if scope else None,
+                comment=self.comments.inline.get(addr, ""),
+                block_comment=self.comments.blocks.get(addr, []),
+            )
+            yield elem
+
+            addr = elem.next_address
@@ -1,4 +1,15 @@
-from typing import ByteString
+from array import array
+import sys
+from typing import TYPE_CHECKING, ByteString, Callable, Dict, List
+from weakref import WeakKeyDictionary
+
+if TYPE_CHECKING:
+    from .data import Data
+
+__all__ = [
+    'BITMAP_FORMATS', 'decode_1bpp', 'decode_2bpp', 'decode_2bpp_planar',
+    'read_bitmap', 'read_2bpp_values', 'zip_bits',
+]
 
 ZIPPED = [
     0b00000000, 0b00000001, 0b00000100, 0b00000101,
@@ -18,9 +29,100 @@ def zip_bits(data: ByteString):
         yield ZIPPED[lo & 15] + (ZIPPED[hi & 15] << 1)
 
 
+# Decoding tables, built on first use. Each entry is the 8 pixel values
+# (one byte each) of a row of a tile. The 1bpp table is indexed by the
+# row byte, the 2bpp table by the 16-bit word ``lo | hi << 8``.
+_TABLE_1BPP: List[bytes] = []
+_TABLE_2BPP: List[bytes] = []
+
+# Map the 0/1 values of 1bpp pixels to white and black
+_PALETTE_1BPP = bytes([0, 3]) + bytes(254)
+
+
+def _spread_bits(byte: int) -> int:
+    """Spread the 8 bits of a byte into the lowest bit of 8 bytes"""
+    return int.from_bytes([(byte >> bit) & 1 for bit in range(7, -1, -1)], 'big')
+
+
+def _table_1bpp() -> List[bytes]:
+    if not _TABLE_1BPP:
+        _TABLE_1BPP.extend(
+            _spread_bits(byte).to_bytes(8, 'big') for byte in range(256)
+        )
+    return _TABLE_1BPP
+
+
+def _table_2bpp() -> List[bytes]:
+    if not _TABLE_2BPP:
+        spread = [_spread_bits(byte) for byte in range(256)]
+        _TABLE_2BPP.extend(
+            (spread[lo] | spread[hi] << 1).to_bytes(8, 'big')
+            for hi in range(256)
+            for lo in range(256)
+        )
+    return _TABLE_2BPP
+
+
+def decode_1bpp(data: ByteString) -> bytes:
+    """One byte per row of 8 pixels, displayed in white and black."""
+    rows = b''.join(map(_table_1bpp().__getitem__, data))
+    return rows.translate(_PALETTE_1BPP)
+
+
+def decode_2bpp(data: ByteString) -> bytes:
+    """
+    Game Boy native format: two bytes per row of 8 pixels, the first
+    one holding the low bit of each pixel and the second the high bit.
+    Returns one byte per pixel, with values between 0 and 3.
+    """
+    if len(data) % 2 != 0:
+        raise ValueError("Must get an even number of bytes")
+    words = array('H')
+    words.frombytes(bytes(data))
+    if sys.byteorder == 'big':
+        words.byteswap()
+    return b''.join(map(_table_2bpp().__getitem__, words))
+
+
+def decode_2bpp_planar(data: ByteString) -> bytes:
+    """
+    Non-interleaved variant: each 16-byte tile stores its 8 bytes of
+    low bits first, followed by its 8 bytes of high bits.
+    """
+    if len(data) % 16 != 0:
+        raise ValueError("Planar tiles must be 16 bytes long")
+    interleaved = bytearray(len(data))
+    for pos in range(0, len(data), 16):
+        interleaved[pos:pos + 16:2] = data[pos:pos + 8]
+        interleaved[pos + 1:pos + 16:2] = data[pos + 8:pos + 16]
+    return decode_2bpp(interleaved)
+
+
 def read_2bpp_values(data: ByteString):
-    for zipped in zip_bits(data):
-        yield zipped >> 6
-        yield (zipped & 0x30) >> 4
-        yield (zipped & 0x0c) >> 2
-        yield zipped & 0x03
+    yield from decode_2bpp(data)
+
+
+# Decoders of each bitmap format, to one byte per pixel
+BITMAP_FORMATS: Dict[str, Callable[[ByteString], bytes]] = {
+    '2bpp': decode_2bpp,
+    '2bpp.planar': decode_2bpp_planar,
+    '1bpp': decode_1bpp,
+}
+# Size in bytes of the smallest unit each format can decode
+_FORMAT_UNITS = {'2bpp': 2, '2bpp.planar': 16, '1bpp': 1}
+
+_BITMAPS_CACHE: 'WeakKeyDictionary[Data, Dict[str, bytes]]' = WeakKeyDictionary()
+
+
+def read_bitmap(data: 'Data', fmt: str = '2bpp') -> bytes:
+    """
+    Decode the contents of a data block as a bitmap, one byte per pixel.
+    The result is cached for as long as the data block exists.
+    """
+    cache = _BITMAPS_CACHE.setdefault(data, {})
+    bitmap = cache.get(fmt)
+    if bitmap is None:
+        raw = data.data
+        raw = raw[:len(raw) - len(raw) % _FORMAT_UNITS[fmt]]
+        bitmap = cache[fmt] = BITMAP_FORMATS[fmt](raw)
+    return bitmap
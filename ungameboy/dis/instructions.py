@@ -1,5 +1,4 @@
-from dataclasses import dataclass
-from typing import List, Optional, Tuple
+from typing import List, NamedTuple, Optional, Tuple
 
 from ..address import Address
 from ..enums import (
@@ -17,8 +16,7 @@ __all__ = ['CODE_POINTS', 'CodePoint', 'RawInstruction']
 Op = Operation
 
 
-@dataclass(frozen=True)
-class RawInstruction:
+class RawInstruction(NamedTuple):
     type: Operation
     args: Tuple
     address: Address
@@ -164,9 +162,6 @@ def _make_bitwise_code_points():
     return code_points
 
 
-BITWISE_CODE_POINTS = _make_bitwise_code_points()
-
-
 META_INSTRUCTIONS = [
     # 0x00
     Op.NoOp,
@@ -495,4 +490,16 @@ def _make_code_points():
     return code_points
 
 
-CODE_POINTS: List[CodePoint] = _make_code_points()
+CODE_POINTS: List[CodePoint]
+BITWISE_CODE_POINTS: List[Tuple[Operation, Optional[int], ParameterMeta]]
+
+
+def __getattr__(name: str):
+    # The tables are built when the first instruction gets decoded, as
+    # nothing is decoded before the UI shows up
+    global CODE_POINTS, BITWISE_CODE_POINTS
+    if name not in ('CODE_POINTS', 'BITWISE_CODE_POINTS'):
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    BITWISE_CODE_POINTS = _make_bitwise_code_points()
+    CODE_POINTS = _make_code_points()
+    return globals()[name]
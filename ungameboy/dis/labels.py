@@ -1,14 +1,18 @@
-from typing import TYPE_CHECKING, Iterator, List, NamedTuple, Tuple
+import operator
+from typing import (
+    TYPE_CHECKING, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+)
 
-from .manager_base import AsmManager
-from ..address import ROM, Address, MemoryType
+from .manager_base import AsmManager, gc_paused
+from ..address import BANKS, ROM, Address, MemoryType
 from ..commands import LabelName, UgbCommandGroup
-from ..data_structures import AddressMapping, SortedStrMapping
+from ..data_structures import AddressMapping, SortedStrMapping, TrigramIndex
+from ..project_save import save_now
 
 if TYPE_CHECKING:
     from .disassembler import Disassembler
 
-__all__ = ['Label', 'LabelManager', 'LabelOffset']
+__all__ = ['Label', 'LabelManager', 'LabelOffset', 'read_sym_file']
 
 
 class Label(NamedTuple):
@@ -37,45 +41,145 @@ class LabelOffset(NamedTuple):
         return self.label.address + self.offset
 
 
+def read_sym_file(lines: Iterable[str]) -> Iterator[Tuple[Address, str]]:
+    """Parse the 'BB:AAAA Name' lines of an RGBDS or emulator .sym file"""
+    for num, line in enumerate(lines, start=1):
+        line = line.partition(';')[0].strip()
+        if not line:
+            continue
+
+        try:
+            location, name = line.split()
+            bank, _, mem_address = location.partition(':')
+            bank, mem_address = int(bank, 16), int(mem_address, 16)
+            if mem_address < 0x4000:  # Most symbols are in ROM
+                address = Address(ROM, 0, mem_address)
+            elif mem_address < 0x8000:
+                address = Address(ROM, bank or 1, mem_address - 0x4000)
+            else:
+                address = Address.from_memory_address(mem_address, bank)
+        except ValueError:
+            raise ValueError(f"Invalid symbol on line {num}: {line}")
+
+        # Bank 0 is used for the switchable area when it is not banked
+        bank_start = BANKS.get(address.type)
+        if bank_start and address.bank == 0:
+            if mem_address >= address.type.offset + bank_start:
+                address = Address(address.type, 1, address.offset)
+        yield address, name
+
+
+def _insert_globals(current: List[Label], labels: List[Label]) -> List[Label]:
+    # Globals are listed before the locals at the same address
+    pos = sum(lb.is_global for lb in current)
+    return current[:pos] + labels + current[pos:]
+
+
+def _is_global_name(name: str) -> bool:
+    return '.' not in name
+
+
 class LabelManager(AsmManager):
     def __init__(self, asm: 'Disassembler'):
         super().__init__(asm)
 
-        self._globals: AddressMapping[List[str]] = AddressMapping()
-        self._locals: AddressMapping[List[str]] = AddressMapping()
-        self._all: AddressMapping[List[Label]] = AddressMapping()
+        self._globals: AddressMapping[List[str]] = AddressMapping(
+            copy_value=list.copy
+        )
+        self._locals: AddressMapping[List[str]] = AddressMapping(
+            copy_value=list.copy
+        )
+        self._all: AddressMapping[List[Label]] = AddressMapping(
+            copy_value=list.copy
+        )
         self._by_name: SortedStrMapping[Address] = SortedStrMapping()
+        # Substring and fuzzy search, kept in sync with _by_name. After a
+        # restore, it is only built again from the names when needed.
+        self._search_index: Optional[TrigramIndex] = TrigramIndex()
+        # Incremented on every change, so that views can tell when
+        # their cached data is stale.
+        self.revision = 0
 
     def reset(self) -> None:
         self._globals.clear()
         self._locals.clear()
         self._all.clear()
         self._by_name.clear()
+        self._search_index = TrigramIndex()
+        self.revision += 1
+
+    def snapshot_state(self):
+        return {
+            '_globals': self._globals.copy(),
+            '_locals': self._locals.copy(),
+            '_all': self._all.copy(),
+            '_by_name': self._by_name.copy(),
+        }
+
+    def restore_state(self, state) -> None:
+        super().restore_state(state)
+        self._search_index = None
+        self.revision += 1
+
+    @property
+    def search_index(self) -> TrigramIndex:
+        """Index of the label names, built on first use after a restore"""
+        if self._search_index is None:
+            self._search_index = TrigramIndex(self._by_name)
+        return self._search_index
+
+    def _index_names(
+            self, added: Iterable[str] = (), removed: Iterable[str] = ()
+    ):
+        """Keep the search index in sync, if it was built"""
+        index = self._search_index
+        if index is None:
+            return
+        for name in removed:
+            index.remove(name)
+        for name in added:
+            index.add(name)
 
     def __contains__(self, item):
         if isinstance(item, str):
             return item in self._by_name
         return False
 
-    def _rebuild_all(self):
-        self._all.clear()
-        self._by_name.clear()
-
-        for addr, names in self._globals.items():
-            for name in names:
-                self._all.setdefault(addr, []).append(Label(addr, name))
-                self._by_name[name] = addr
-
-        for addr, names in self._locals.items():
-            try:
-                _, scope = self._globals.get_le(addr)
-                scope = scope[-1]
-            except LookupError:
+    def _replace_label(self, old: Label, new: Optional[Label]):
+        """Swap a label for another at the same address, or remove it"""
+        labels = self._all.mutable(old.address)
+        pos = labels.index(old)
+        if new is None:
+            del labels[pos]
+            if not labels:
+                del self._all[old.address]
+        else:
+            labels[pos] = new
+
+        del self._by_name[old.name]
+        if new is not None:
+            self._by_name[new.name] = new.address
+        self._index_names([new.name] if new else [], [old.name])
+
+    def _rescope(self, address: Address, scope_name: str):
+        """Move the locals following a global label to a new scope name"""
+        old_names, new_names = [], []
+        for addr, name in self.locals_at(address):
+            labels = self._all.mutable(addr)
+            pos = next(
+                n for n, lb in enumerate(labels) if lb.local_name == name
+            )
+            if labels[pos].global_name == scope_name:
                 continue
+            old_names.append(labels[pos].name)
+            labels[pos] = Label(addr, scope_name, name)
+            new_names.append((labels[pos].name, addr))
 
-            for name in names:
-                self._all.setdefault(addr, []).append(Label(addr, scope, name))
-                self._by_name[f'{scope}.{name}'] = addr
+        # All the names of a scope are next to each other in the sorted
+        # names, so they can be moved in bulk.
+        self._by_name.delete_many(old_names)
+        self._by_name.update_many(new_names)
+        self._index_names((name for name, _ in new_names), old_names)
 
     def lookup(self, name: str) -> Label:
         addr = self._by_name[name]
@@ -88,9 +192,44 @@ class LabelManager(AsmManager):
             if '.' not in name or search_local:
                 yield name
 
+    def find(self, string: str, limit: int = None, local=True) -> List[str]:
+        """
+        Label names containing the string, ignoring case, sorted. Only the
+        first ones are returned with a limit, and only the global labels
+        without local.
+        """
+        return self.search_index.find(
+            string, limit, None if local else _is_global_name
+        )
+
+    def iter_index_names(self) -> Iterator[int]:
+        """
+        Build the search index of the label names a bit at a time, for a
+        background job. Yields the number of names left.
+        """
+        while True:
+            left = self.search_index.flush_some(2000)
+            if not left:
+                return
+            yield left
+
+    def fuzzy_search(self, string: str, limit=20) -> List[Tuple[float, str]]:
+        """Label names ranked by similarity, as (score, name) pairs"""
+        return self.search_index.fuzzy(string, limit)
+
     def get_labels(self, address: Address) -> List[Label]:
         return self._all.get(address, [])
 
+    def iter_from(
+            self, address: Address
+    ) -> Iterator[Tuple[Address, List[Label]]]:
+        """Iterate over all labels, starting at the given address"""
+        return self._all.iter_from(address)
+
+    def addresses_between(self, start: Address, end: Address) -> List[Address]:
+        """Addresses with labels from start, included, to end, excluded"""
+        return self._all.keys_between(start, end)
+
     def get_all_in_bank(
             self, mem_type: MemoryType, bank: int
     ) -> Iterator[Tuple[Address, List[Label]]]:
@@ -117,59 +256,133 @@ class LabelManager(AsmManager):
         return _locals
 
     def scope_at(self, address: Address) -> List[Label]:
+        addr, names = self._scope_names(address)
+        return [Label(addr, name) for name in names]
+
+    def _scope_names(self, address: Address) -> Tuple[Optional[Address], list]:
+        """Address and names of the globals in scope, without the labels"""
         try:
             addr, names = self._globals.get_le(address)
         except LookupError:
-            return []
+            return None, []
         # TODO: Also consider sections as scope boundaries
         if (addr.type, addr.bank) != (address.type, address.bank):
-            return []
-        return [Label(addr, name) for name in names]
+            return None, []
+        return addr, names
+
+    @staticmethod
+    def _extend_many(
+            mapping: AddressMapping[list],
+            additions: Dict[Address, list],
+            globals_first=False,
+    ):
+        """Add items to the lists of a mapping, with a bulk insertion"""
+        mapping.update_many(
+            additions.items(),
+            merge=_insert_globals if globals_first else operator.add,
+        )
 
-    def _add_local(self, address: Address, name: str):
-        _glob, _, _loc = name.partition('.')
-        if '.' in _loc:
-            raise ValueError(f"Invalid label name: {name}")
+    def _add_globals(self, labels: Iterable[Tuple[Address, str]]):
+        new: Dict[Address, List[str]] = {}
+        pending: Dict[str, Address] = {}
 
-        if _loc in self._locals.get(address, []):
-            return  # Already exists
+        for address, name in labels:
+            if '.' in name:
+                raise ValueError("Global labels cannot have a '.' in their name")
 
-        scope = self.scope_at(address)
-        if not scope:
-            raise ValueError("Local labels must be in scope of a global label")
+            cur_addr = self._by_name.get(name, pending.get(name))
+            if cur_addr is None:
+                pending[name] = address
+                new.setdefault(address, []).append(name)
+            elif cur_addr != address:
+                raise ValueError(f"Label {name} already exists at {cur_addr}")
 
-        if _glob != '' and all(lb.name != _glob for lb in scope):
-            raise ValueError(f"Global label {_glob} not in scope at {address}")
+        if not new:
+            return
 
-        scope_name = scope[-1].global_name
-        current_locals = self.locals_at(scope[-1].address)
-        if any(n == _loc for _, n in current_locals):
-            raise ValueError(f"Label {scope_name}.{_loc} already exists")
+        self.revision += 1
+        self._extend_many(self._globals, new)
+        self._extend_many(
+            self._all,
+            {addr: [Label(addr, name) for name in names]
+             for addr, names in new.items()},
+            globals_first=True,
+        )
+        self._by_name.update_many(pending.items())
+        self._index_names(pending)
+
+        # The new labels become the scope of the locals that follow them
+        if self._locals:
+            for address in new:
+                self._rescope(address, self._globals[address][-1])
+
+    def _add_locals(self, labels: Iterable[Tuple[Address, str]]):
+        new: Dict[Address, List[str]] = {}
+        pending: Dict[str, Label] = {}
+        scope_start = scope_end = scope = None
+        scope_names = []
+        # Local names cannot clash with globals, only with other locals
+        existing = self._locals if self._locals else None
+
+        for address, name in labels:
+            _glob, _, _loc = name.partition('.')
+            if '.' in _loc:
+                raise ValueError(f"Invalid label name: {name}")
+
+            if existing is not None and _loc in existing.get(address, ()):
+                continue  # Already exists
+
+            # Labels usually come in order, so the scope is often the same
+            if scope_end is None or not scope_start <= address < scope_end:
+                scope_start, scope_names = self._scope_names(address)
+                if not scope_names:
+                    raise ValueError(
+                        "Local labels must be in scope of a global label"
+                    )
+                scope = scope_names[-1]
+                scope_end = Address(scope_start.type, scope_start.bank + 1, 0)
+                try:
+                    scope_end = min(scope_end, self._globals.get_gt(address)[0])
+                except LookupError:
+                    pass
+
+            if _glob != scope:
+                if _glob != '' and _glob not in scope_names:
+                    raise ValueError(
+                        f"Global label {_glob} not in scope at {address}"
+                    )
+                name = f"{scope}.{_loc}"
 
-        label = Label(address, scope_name, _loc)
-        self._locals.setdefault(address, []).append(_loc)
-        self._all.setdefault(address, []).append(label)
-        self._by_name[label.name] = address
+            label = pending.get(name)
+            if label is not None:
+                if label.address == address:
+                    continue
+                raise ValueError(f"Label {name} already exists")
+            if existing is not None and name in self._by_name:
+                raise ValueError(f"Label {name} already exists")
 
-    def _add_global(self, address, name: str):
-        if '.' in name:
-            raise ValueError("Global labels cannot have a '.' in their name")
+            pending[name] = Label(address, scope, _loc)
+            new.setdefault(address, []).append(_loc)
 
-        cur_addr = self._by_name.get(name)
-        if cur_addr is None:
-            pass
-        elif cur_addr == address:
+        if not new:
             return
-        else:
-            raise ValueError(f"Label {name} already exists at {cur_addr}")
 
-        self._globals.setdefault(address, []).append(name)
-        if not self.locals_at(address):
-            label = Label(address, name)
-            self._all.setdefault(address, []).append(label)
-            self._by_name[name] = address
-        else:
-            self._rebuild_all()
+        self.revision += 1
+        self._extend_many(self._locals, new)
+        labels_at: Dict[Address, List[Label]] = {}
+        for label in pending.values():
+            labels_at.setdefault(label.address, []).append(label)
+        self._extend_many(self._all, labels_at)
+        self._by_name.update_many(
+            (name, label.address) for name, label in pending.items()
+        )
+        self._index_names(pending)
+
+    def _add_local(self, address: Address, name: str):
+        self._add_locals([(address, name)])
+
+    def _add_global(self, address, name: str):
+        self._add_globals([(address, name)])
 
     def create(self, address: Address, name: LabelName):
         if "." in name:
@@ -179,6 +392,23 @@ class LabelManager(AsmManager):
         if address.type is ROM:
             self.asm.xrefs.index_from(address)
 
+    def create_many(self, labels: Iterable[Tuple[Address, str]]):
+        """
+        Create many labels at once. The mappings are updated in bulk,
+        globals first, and the code is indexed from all of them in a
+        single pass.
+        """
+        with self.asm.xrefs.deferred_index():
+            with gc_paused():
+                labels = list(labels)
+                self._add_globals(
+                    (a, name) for a, name in labels if '.' not in name
+                )
+                self._add_locals((a, name) for a, name in labels if '.' in name)
+            for address, _ in labels:
+                if address.type is ROM:
+                    self.asm.xrefs.index_from(address)
+
     def auto_create(self, address: Address, local=False):
         if address.bank < 0:
             raise ValueError("Cannot place label at unknown bank")
@@ -220,19 +450,26 @@ class LabelManager(AsmManager):
             scope = self.scope_at(address)
             assert any(lb.name == old_glob for lb in scope)
 
-            locals_there = self._locals[address]
+            locals_there = self._locals.mutable(address)
             pos = locals_there.index(old_loc)
             locals_there[pos] = new_loc
+            self._replace_label(
+                Label(address, old_glob, old_loc),
+                Label(address, old_glob, new_loc),
+            )
 
         else:
             if '.' in new_name:
                 raise ValueError("Invalid global label name")
             # Rename global
-            globals_there = self._globals[address]
+            globals_there = self._globals.mutable(address)
             pos = globals_there.index(old_name)
             globals_there[pos] = new_name
+            self._replace_label(Label(address, old_name), Label(address, new_name))
+            if pos == len(globals_there) - 1:
+                self._rescope(address, new_name)
 
-        self._rebuild_all()
+        self.revision += 1
 
     def delete(self, name: LabelName):
         if name not in self._by_name:
@@ -244,15 +481,16 @@ class LabelManager(AsmManager):
             glob, _, loc = name.partition('.')
             assert glob and loc and '.' not in loc
 
-            locals_here = self._locals[address]
+            locals_here = self._locals.mutable(address)
             if len(locals_here) == 1:
                 del self._locals[address]
             else:
                 locals_here.remove(loc)
+            self._replace_label(Label(address, glob, loc), None)
 
         else:
             # Deleting global label
-            globals_here = self._globals[address]
+            globals_here = self._globals.mutable(address)
             locals_here = self.locals_at(address)
 
             if locals_here and len(globals_here) == 1:
@@ -277,12 +515,43 @@ class LabelManager(AsmManager):
                         f"new scope: {', '.join(conflicts)}"
                     )
 
+            was_scope = globals_here[-1] == name
             if len(globals_here) == 1:
                 del self._globals[address]
             else:
                 globals_here.remove(name)
-
-        self._rebuild_all()
+            self._replace_label(Label(address, name), None)
+
+            if was_scope and locals_here:
+                new_scope = self.scope_at(address)[-1]
+                self._rescope(address, new_scope.global_name)
+
+        self.revision += 1
+
+    def find_command(self, query: str, limit: int = 20) -> List[str]:
+        """Find labels by name, best matches first"""
+        lines = []
+        for _, name in self.fuzzy_search(query, limit):
+            lines.append(f"{self._by_name[name]}  {name}")
+        if not lines:
+            lines.append(f"No label matching {query}")
+        return lines
+
+    def import_sym(self, path: str):
+        with open(path, 'r', encoding='utf8') as sym_file, self.asm.batch():
+            self.create_many(read_sym_file(sym_file))
+        # The import is not journaled as it depends on an outside file,
+        # so the project is saved with it before anything else is.
+        save_now(self.asm)
+
+    def export_sym(self, path: str):
+        with open(path, 'w', encoding='utf8') as sym_file:
+            sym_file.write("; Symbols exported by UnGameBoy\n")
+            sym_file.writelines(
+                f"{max(addr.bank, 0):02x}:{addr.memory_address:04x} {lb.name}\n"
+                for addr, labels in self._all.items()
+                for lb in labels
+            )
 
     def build_cli_v2(self) -> UgbCommandGroup:
         labels_cli = UgbCommandGroup(self.asm, "label")
@@ -290,6 +559,9 @@ class LabelManager(AsmManager):
         labels_cli.add_command("auto", self.auto_create)
         labels_cli.add_command("rename", self.rename)
         labels_cli.add_command("delete", self.delete)
+        labels_cli.add_command("find", self.find_command, journal=False)
+        labels_cli.add_command("import-sym", self.import_sym, journal=False)
+        labels_cli.add_command("export-sym", self.export_sym, journal=False)
         return labels_cli
 
     def save_items(self):
@@ -1,11 +1,31 @@
 from abc import ABCMeta, abstractmethod
-from typing import TYPE_CHECKING
+from contextlib import contextmanager
+from copy import copy, deepcopy
+import gc
+from typing import TYPE_CHECKING, Any, Dict, Iterator
 
 if TYPE_CHECKING:
     from .disassembler import Disassembler
     from ..commands import UgbCommandGroup
 
 
+@contextmanager
+def gc_paused() -> Iterator[None]:
+    """
+    Bulk operations allocate lots of small containers at once, which
+    would otherwise trigger the garbage collector over and over. Only
+    wrap the bulk work itself, so that the garbage of whatever else runs
+    meanwhile still gets collected.
+    """
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
 class AsmManager(metaclass=ABCMeta):
     def __init__(self, asm: 'Disassembler'):
         self.asm = asm
@@ -21,3 +41,20 @@ class AsmManager(metaclass=ABCMeta):
     @abstractmethod
     def save_items(self):
         pass
+
+    def snapshot_state(self) -> Dict[str, Any]:
+        """Independent copy of the manager's state, see restore_state"""
+        return deepcopy({
+            key: value for key, value in vars(self).items() if key != 'asm'
+        })
+
+    def restore_state(self, state: Dict[str, Any]) -> None:
+        """Go back to a state returned by snapshot_state"""
+        vars(self).update(state)
+
+    def copy_for(self, asm: 'Disassembler') -> 'AsmManager':
+        """Same manager with an independent copy of its state, for asm"""
+        manager = copy(self)
+        manager.asm = asm
+        manager.restore_state(self.snapshot_state())
+        return manager
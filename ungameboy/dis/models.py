@@ -19,8 +19,17 @@ __all__ = [
 Value = Union[int, str, Address, Label, LabelOffset, SpecialLabel]
 
 
+# The elements are created by the thousands when rendering and indexing,
+# so they all use slots rather than a per-instance dictionary. Each
+# class must only list the slots for the fields that it adds.
+
 @dataclass
 class AsmElement:
+    __slots__ = (
+        'address', 'size', 'labels', 'scope', 'section', 'xrefs',
+        'comment', 'block_comment',
+    )
+
     address: Address
     size: int
 
@@ -38,18 +47,24 @@ class AsmElement:
 
 @dataclass
 class RomElement(AsmElement):
+    __slots__ = ('dest_address', 'bytes')
+
     dest_address: Optional[Address]
     bytes: bytes
 
 
 @dataclass
 class Instruction(RomElement):
+    __slots__ = ('raw_instruction', 'value')
+
     raw_instruction: 'RawInstruction'
     value: Value
 
 
 @dataclass
 class DataRow(RomElement):
+    __slots__ = ('data', 'values', 'row')
+
     data: 'Data'
     values: List[Value]
     row: int
@@ -57,9 +72,11 @@ class DataRow(RomElement):
 
 @dataclass
 class DataBlock(RomElement):
+    __slots__ = ('data',)
+
     data: 'Data'
 
 
 @dataclass
 class RamElement(AsmElement):
-    pass
+    __slots__ = ()
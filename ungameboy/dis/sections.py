@@ -1,8 +1,13 @@
-from typing import NamedTuple, Optional
+from typing import TYPE_CHECKING, NamedTuple, Optional
 
+from .manager_base import AsmManager
 from ..address import Address
+from ..commands import UgbCommandGroup
 from ..data_structures import AddressMapping
 
+if TYPE_CHECKING:
+    from .disassembler import Disassembler
+
 __all__ = ['Section', 'SectionManager']
 
 
@@ -11,10 +16,14 @@ class Section(NamedTuple):
     name: str
 
 
-class SectionManager:
-    def __init__(self):
+class SectionManager(AsmManager):
+    def __init__(self, asm: 'Disassembler'):
+        super().__init__(asm)
         self._sections: AddressMapping[str] = AddressMapping()
 
+    def reset(self) -> None:
+        self._sections.clear()
+
     def create(self, address: Address, name: str):
         if '"' in name:
             raise ValueError("Section name cannot contain double quote")
@@ -40,3 +49,12 @@ class SectionManager:
     def list_sections(self):
         for addr, name in self._sections.items():
             yield Section(addr, name)
+
+    def build_cli_v2(self) -> UgbCommandGroup:
+        sections_cli = UgbCommandGroup(self.asm, "section")
+        sections_cli.add_command("create", self.create)
+        return sections_cli
+
+    def save_items(self):
+        for addr, name in self._sections.items():
+            yield ('section', 'create', addr, name)
@@ -1,59 +1,92 @@
-from typing import TYPE_CHECKING, NamedTuple, Set, Tuple
+from contextlib import contextmanager
+from typing import (
+    TYPE_CHECKING, AbstractSet, Dict, FrozenSet, Iterable, Iterator, List,
+    NamedTuple, Optional, Set, Tuple,
+)
 
 from .data import DataTable, Jumptable
-from .manager_base import AsmManager
-from .models import DataRow, Instruction
+from .manager_base import AsmManager, gc_paused
 from ..address import ROM, Address
 from ..commands import UgbCommandGroup
 from ..data_structures import AddressMapping
 from ..data_types import Ref
 from ..enums import Condition, Operation as Op
+from ..profiling import timed
 
 if TYPE_CHECKING:
     from .disassembler import Disassembler
 
 
+# Shared result for addresses without links, to avoid creating new empty
+# sets for every query. Must never be mutated, hence the frozenset.
+NO_LINKS: FrozenSet[Address] = frozenset()
+
+
 class XRefs(NamedTuple):
     address: Address
-    calls: Set[Address]
-    called_by: Set[Address]
-    jumps_to: Set[Address]
-    jumps_from: Set[Address]
-    reads: Set[Address]
-    read_by: Set[Address]
-    writes_to: Set[Address]
-    written_by: Set[Address]
-    refers_to: Set[Address]
-    referred_by: Set[Address]
+    calls: AbstractSet[Address]
+    called_by: AbstractSet[Address]
+    jumps_to: AbstractSet[Address]
+    jumps_from: AbstractSet[Address]
+    reads: AbstractSet[Address]
+    read_by: AbstractSet[Address]
+    writes_to: AbstractSet[Address]
+    written_by: AbstractSet[Address]
+    refers_to: AbstractSet[Address]
+    referred_by: AbstractSet[Address]
+
+    @classmethod
+    def empty(cls, address: Address) -> 'XRefs':
+        return cls(address, *[NO_LINKS] * (len(cls._fields) - 1))
 
 
 class LinksCollection:
     def __init__(self):
-        self.refs_out: AddressMapping[Set[Address]] = AddressMapping()
-        self.refs_in: AddressMapping[Set[Address]] = AddressMapping()
+        self.refs_out: AddressMapping[Set[Address]] = AddressMapping(
+            copy_value=set.copy
+        )
+        self.refs_in: AddressMapping[Set[Address]] = AddressMapping(
+            copy_value=set.copy
+        )
+        # Incremented on every change, so that views can tell when
+        # their cached data is stale.
+        self.revision = 0
 
     def reset(self):
         self.refs_out.clear()
         self.refs_in.clear()
+        self.revision += 1
 
     def items(self):
         return self.refs_out.items()
 
+    def copy(self) -> 'LinksCollection':
+        new = LinksCollection()
+        new.refs_out = self.refs_out.copy()
+        new.refs_in = self.refs_in.copy()
+        new.revision = self.revision
+        return new
+
     def has_link(self, addr_from: Address, addr_to: Address):
         return addr_to in self.refs_out.get(addr_from, ())
 
     def create_link(self, addr_from: Address, addr_to: Address):
         self.refs_out.setdefault(addr_from, set()).add(addr_to)
         self.refs_in.setdefault(addr_to, set()).add(addr_from)
+        self.revision += 1
 
     def remove_link(self, addr_from: Address, addr_to: Address):
         if addr_from in self.refs_in.get(addr_to, ()):
-            self.refs_in[addr_to].remove(addr_from)
-            if not self.refs_in[addr_to]:
+            self.revision += 1
+            refs_in = self.refs_in.mutable(addr_to)
+            refs_in.remove(addr_from)
+            if not refs_in:
                 del self.refs_in[addr_to]
         if addr_to in self.refs_out.get(addr_from, ()):
-            self.refs_out[addr_from].remove(addr_to)
-            if not self.refs_out[addr_from]:
+            self.revision += 1
+            refs_out = self.refs_out.mutable(addr_from)
+            refs_out.remove(addr_to)
+            if not refs_out:
                 del self.refs_out[addr_from]
 
     def clear_incoming(self, address: Address):
@@ -69,13 +102,15 @@ class LinksCollection:
     def clear(self, address: Address):
         self.clear_outgoing(address)
 
-    def incoming(self, address: Address) -> Set[Address]:
-        return self.refs_in.get(address, set())
+    def incoming(self, address: Address) -> AbstractSet[Address]:
+        return self.refs_in.get(address, NO_LINKS)
 
-    def outgoing(self, address: Address) -> Set[Address]:
-        return self.refs_out.get(address, set())
+    def outgoing(self, address: Address) -> AbstractSet[Address]:
+        return self.refs_out.get(address, NO_LINKS)
 
-    def get_links(self, address: Address) -> Tuple[Set[Address], Set[Address]]:
+    def get_links(
+            self, address: Address
+    ) -> Tuple[AbstractSet[Address], AbstractSet[Address]]:
         return self.outgoing(address), self.incoming(address)
 
 
@@ -89,6 +124,16 @@ class XRefCollection:
         self.manual.reset()
         self.auto.reset()
 
+    @property
+    def revision(self) -> int:
+        return self.manual.revision + self.auto.revision
+
+    def copy(self) -> 'XRefCollection':
+        new = XRefCollection()
+        new.auto = self.auto.copy()
+        new.manual = self.manual.copy()
+        return new
+
     def create_link(self, addr_from: Address, addr_to: Address):
         if self.auto.has_link(addr_from, addr_to):
             return
@@ -108,15 +153,17 @@ class XRefCollection:
     def clear_auto(self, address: Address):
         self.auto.clear(address)
 
-    def incoming(self, address: Address) -> Set[Address]:
-        return self.manual.incoming(address) | self.auto.incoming(address)
+    def incoming(self, address: Address) -> AbstractSet[Address]:
+        manual, auto = self.manual.incoming(address), self.auto.incoming(address)
+        return manual | auto if manual or auto else NO_LINKS
 
-    def outgoing(self, address: Address) -> Set[Address]:
-        return self.manual.outgoing(address) | self.auto.outgoing(address)
+    def outgoing(self, address: Address) -> AbstractSet[Address]:
+        manual, auto = self.manual.outgoing(address), self.auto.outgoing(address)
+        return manual | auto if manual or auto else NO_LINKS
 
     def get_links(
             self, address: Address, include_auto=True
-    ) -> Tuple[Set[Address], Set[Address]]:
+    ) -> Tuple[AbstractSet[Address], AbstractSet[Address]]:
         links = self if include_auto else self.manual
         return links.outgoing(address), links.incoming(address)
 
@@ -127,6 +174,8 @@ class XRefManager(AsmManager):
     def __init__(self, asm: "Disassembler"):
         super().__init__(asm)
         self.bypass_index = False
+        # Start addresses to index later, with their (fast, single) flags
+        self._deferred: Optional[Dict[Address, Tuple[bool, bool]]] = None
 
         self._mappings = {
             'call': XRefCollection(),
@@ -140,6 +189,29 @@ class XRefManager(AsmManager):
         for collection in self._mappings.values():
             collection.reset()
 
+    @property
+    def revision(self) -> int:
+        """Changes whenever any cross-reference is created or removed"""
+        return sum(links.revision for links in self._mappings.values())
+
+    def snapshot_state(self):
+        return {
+            name: links.copy() for name, links in self._mappings.items()
+        }
+
+    def restore_state(self, state) -> None:
+        revision = self.revision
+        self._mappings = state
+        # Make sure that the revision still goes up, so that views do not
+        # mistake the restored links for a state they have cached.
+        self._mappings['ref'].manual.revision += revision + 1
+
+    def copy_for(self, asm: "Disassembler") -> "XRefManager":
+        manager = super().copy_for(asm)
+        # The indexing deferred by a batch is left to the original
+        manager.bypass_index, manager._deferred = False, None
+        return manager
+
     def index_data(self, address: Address, fast=False, single=False):
         data = self.asm.data.get_data(address)
         if data is None:
@@ -179,25 +251,71 @@ class XRefManager(AsmManager):
 
         return True
 
+    @contextmanager
+    def deferred_index(self) -> Iterator[None]:
+        """
+        Collect the calls to index_from instead of running them, and
+        index everything in one merged pass when leaving the context.
+        Code reachable from several start addresses is walked once.
+        """
+        if self._deferred is not None:  # Already deferring
+            yield
+            return
+
+        self._deferred = {}
+        try:
+            yield
+        finally:
+            starts, self._deferred = self._deferred, None
+            self.index_many(starts)
+
+    def index_many(self, starts: Dict[Address, Tuple[bool, bool]]):
+        """Index from several addresses, visiting each instruction once"""
+        visited: Set[Address] = set()
+        with gc_paused():
+            for address in sorted(starts):
+                fast, single = starts[address]
+                self.index_from(address, fast, single, _visited=visited)
+
+    @timed("index_from")
     def index_from(
-            self, address: Address, fast=False, single=False
+            self, address: Address, fast=False, single=False,
+            _visited: Set[Address] = None,
     ) -> Address:
         if self.asm.rom is None or self.bypass_index:
             return address
 
+        if self._deferred is not None:
+            prev_fast, prev_single = self._deferred.get(address, (True, True))
+            self._deferred[address] = (fast and prev_fast, single and prev_single)
+            return address
+
         get_instr = self.asm.rom.decode_instruction
         get_value = self.asm.context.instruction_value
         terminating = {Op.AbsJump, Op.RelJump, Op.Return, Op.ReturnIntEnable}
 
+        if single:
+            _visited = None
+
+        # No automatic link starts between the address and next_auto, so
+        # the instructions up to there have none to clear.
+        next_auto = None if fast else self._next_auto_source(address)
+
         bank = address.bank
         while address.bank == bank and address.is_valid:
+            if _visited is not None:
+                if address in _visited:
+                    break
+                _visited.add(address)
+
             if self.index_data(address, fast, single):
                 break
 
             instr = get_instr(address.rom_file_offset)
             address, prev_address = instr.next_address, address
-            if not fast:
+            if next_auto is not None and next_auto < address:
                 self.clear_auto_range(prev_address, address)
+                next_auto = self._next_auto_source(address)
 
             op = instr.type
             if op in (Op.Invalid, Op.ReturnIntEnable):
@@ -230,6 +348,14 @@ class XRefManager(AsmManager):
         return address
 
     def index(self, bank: int, fast=False):
+        for _ in self.iter_index(bank, fast):
+            pass
+
+    def iter_index(self, bank: int, fast=False) -> Iterator[Address]:
+        """
+        Index a bank step by step, yielding the address reached after each
+        label, so that the caller can pause in between.
+        """
         if self.asm.rom is None:
             return
 
@@ -245,28 +371,58 @@ class XRefManager(AsmManager):
             if prev_addr > addr:
                 continue
             prev_addr = self.index_from(addr, fast=fast)
+            yield prev_addr
+
+    def index_job(self, bank: int, fast=False):
+        """
+        Index a bank as a job, which can run in the background. It is not
+        journaled: it may be cancelled halfway, and the automatic xrefs
+        are not saved anyway, the banks get indexed again after loading.
+        """
+        steps = (f"at {addr}" for addr in self.iter_index(bank, fast))
+        self.asm.jobs.submit(f"xref index {bank:02x}", steps)
+
+    def auto_links(self, bank: int) -> List[Tuple[str, Address, Address]]:
+        """Links found by indexing a ROM bank, see create_auto_links"""
+        start, end = Address(ROM, bank, 0), Address(ROM, bank + 1, 0)
+        links = []
+        for link_type, collection in self._mappings.items():
+            refs_out = collection.auto.refs_out
+            for addr_from in refs_out.keys_between(start, end):
+                links.extend(
+                    (link_type, addr_from, addr_to)
+                    for addr_to in refs_out[addr_from]
+                )
+        return links
+
+    def create_auto_links(self, links: Iterable[Tuple[str, Address, Address]]):
+        """Add the links from a bank indexed by another process"""
+        for link_type, addr_from, addr_to in links:
+            self._mappings[link_type].create_auto(addr_from, addr_to)
 
     def auto_declare(self, address: Address):
-        elem = self.asm[address]
-        if isinstance(elem, Instruction):
-            if elem.dest_address is None:
-                return
+        elem = self.asm.query(
+            address, ("address", "raw_instruction", "row", "dest_address")
+        )
+        if elem["dest_address"] is None:
+            return
 
-            op = elem.raw_instruction.type
+        instr = elem["raw_instruction"]
+        if instr is not None:
+            op = instr.type
             declare = ''
             if op in (Op.Call, Op.Vector):
                 declare = 'call'
             elif op in (Op.AbsJump, Op.RelJump):
                 declare = 'jump'
             elif op in (Op.Load, Op.LoadFast):
-                declare = ('', 'write', 'read')[elem.raw_instruction.value_pos]
+                declare = ('', 'write', 'read')[instr.value_pos]
 
             if declare:
-                self.declare(declare, elem.address, elem.dest_address)
+                self.declare(declare, elem["address"], elem["dest_address"])
 
-        elif isinstance(elem, DataRow):
-            if elem.dest_address is not None:
-                self.declare('jump', elem.address, elem.dest_address)
+        elif elem["row"] is not None:
+            self.declare('jump', elem["address"], elem["dest_address"])
 
     def declare(self, link_type: str, addr_from: Address, addr_to: Address):
         self._mappings[link_type].create_link(addr_from, addr_to)
@@ -281,17 +437,37 @@ class XRefManager(AsmManager):
         for links in self._mappings.values():
             links.clear_auto(address)
 
+    def _next_auto_source(self, address: Address) -> Optional[Address]:
+        """First address with automatic links, from the given one on"""
+        sources = []
+        for links in self._mappings.values():
+            try:
+                sources.append(links.auto.refs_out.get_ge(address)[0])
+            except LookupError:
+                pass
+        return min(sources, default=None)
+
     def clear_auto_range(self, addr_start: Address, addr_end: Address):
         if addr_start.zone != addr_end.zone:
             raise ValueError("Address range to clear must be in same zone")
-        length = addr_end.offset - addr_start.offset
-        for offset in range(length):
-            for links in self._mappings.values():
-                links.clear_auto(addr_start + offset)
+        for links in self._mappings.values():
+            for address in links.auto.refs_out.keys_between(addr_start, addr_end):
+                links.clear_auto(address)
+
+    def reindex_range(self, addr_start: Address, addr_end: Address):
+        """
+        Index a range again after its contents changed, from each label
+        in it, the way iter_index would. In a batch, this is done by the
+        deferred pass at the end.
+        """
+        self.clear_auto_range(addr_start, addr_end)
+        for address in self.asm.labels.addresses_between(addr_start, addr_end):
+            self.index_from(address)
 
     def count_incoming(self, link_type: str, address: Address):
         return len(self._mappings[link_type].incoming(address))
 
+    @timed("get_xrefs")
     def get_xrefs(self, address: Address, include_auto=True) -> XRefs:
         return XRefs(
             address,
@@ -316,7 +492,7 @@ class XRefManager(AsmManager):
         xrefs_cli.add_group(declare_cli)
         xrefs_cli.add_command("auto", self.auto_declare)
         xrefs_cli.add_command("clear", self.clear)
-        xrefs_cli.add_command("index", self.index)
+        xrefs_cli.add_command("index", self.index_job, journal=False)
         return xrefs_cli
 
     def save_items(self):
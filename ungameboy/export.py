@@ -0,0 +1,390 @@
+"""
+Export of the disassembly as RGBDS source files.
+
+Each ROM bank is written to its own file, and a main file includes them
+all along with the RAM labels, so the whole thing can be assembled with
+a single call to rgbasm. Banks are streamed line by line to their file,
+which keeps the memory use bounded even for the largest ROMs, and they
+can be rendered by several worker processes at once.
+"""
+
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING, Dict, Iterator, List, Optional, Tuple,
+)
+
+from .address import ROM, VRAM, SRAM, WRAM, OAM, HRAM, Address
+from .data_types import CgbColor, IORef, Ref
+from .dis.data import DataTable, EmptyData
+from .dis.labels import Label, LabelOffset
+from .dis.models import AsmElement, DataBlock, DataRow, Instruction
+from .enums import C, Condition, DoubleRegister, Operation, Register
+from .project_save import pickle_state, unpickle_state
+
+if TYPE_CHECKING:
+    from .dis.disassembler import Disassembler
+
+__all__ = ['RgbdsExporter', 'export_project']
+
+# Managers read to render the disassembly, without the cross-references
+EXPORT_MANAGERS = ('data', 'labels', 'context', 'comments', 'sections')
+
+INDENT = ' ' * 4
+BYTES_PER_LINE = 8
+
+# RAM zones for which labels are declared in sections, the other ones
+# (e.g. the IO registers) use constants instead.
+RAM_SECTIONS = {
+    VRAM: 'VRAM',
+    SRAM: 'SRAM',
+    WRAM: 'WRAMX',
+    OAM: 'OAM',
+    HRAM: 'HRAM',
+}
+
+
+def section_header(name: str, address: Address) -> str:
+    if address.type is ROM:
+        sec_type = 'ROM0' if address.bank == 0 else 'ROMX'
+    elif address.type is WRAM and address.bank == 0:
+        sec_type = 'WRAM0'
+    else:
+        sec_type = RAM_SECTIONS[address.type]
+
+    header = f'SECTION "{name}", {sec_type}[${address.memory_address:04x}]'
+    if sec_type in ('ROMX', 'WRAMX', 'VRAM', 'SRAM'):
+        header += f", BANK[${address.bank:02x}]"
+    return header
+
+
+def raw_bytes(data: bytes) -> Iterator[str]:
+    for pos in range(0, len(data), BYTES_PER_LINE):
+        chunk = data[pos:pos + BYTES_PER_LINE]
+        yield INDENT + "db " + ", ".join(f"${b:02x}" for b in chunk)
+
+
+class RgbdsExporter:
+    """Renders the disassembly as plain text, in the RGBDS syntax"""
+
+    def __init__(self, asm: 'Disassembler'):
+        self.asm = asm
+        # Instructions without a reference always render the same way,
+        # so their text is kept for the next time the same bytes appear.
+        self._instructions_cache: Dict[bytes, str] = {}
+        # Global label that rgbasm resolves the local ones against, as it
+        # goes through the lines written so far
+        self._scope: Optional[str] = None
+
+    @property
+    def n_banks(self) -> int:
+        return len(self.asm.rom) // 0x4000
+
+    @staticmethod
+    def bank_file_name(bank: int) -> str:
+        return f"bank_{bank:02x}.asm"
+
+    def render_reference(self, elem: AsmElement, reference) -> str:
+        if isinstance(reference, Label):
+            if reference.local_name and reference.global_name == self._scope:
+                return '.' + reference.local_name
+            return reference.name
+
+        if isinstance(reference, LabelOffset):
+            out = self.render_reference(elem, reference.label)
+            if reference.offset:
+                sign = '-' if reference.offset < 0 else '+'
+                out += f" {sign} ${abs(reference.offset):x}"
+            return out
+
+        return f"${reference.memory_address:04x}"
+
+    def render_value(self, elem: AsmElement, value) -> str:
+        if isinstance(value, Ref):
+            target = value.target
+            if isinstance(value, IORef) and target is C:
+                return '[c]'
+            if isinstance(value, IORef) and isinstance(target, int):
+                return f"[${target + 0xff00:04x}]"
+            return f"[{self.render_value(elem, target)}]"
+
+        if isinstance(value, (Register, DoubleRegister, Condition)):
+            return str(value).lower()
+        if isinstance(value, (Address, Label, LabelOffset)):
+            return self.render_reference(elem, value)
+        if isinstance(value, CgbColor):
+            return f"${value:04x}"
+        if isinstance(value, int):
+            return str(value).lower()
+        return str(value)
+
+    def render_instruction(self, elem: Instruction) -> str:
+        if isinstance(elem.value, (Address, Label, LabelOffset)):
+            return self._render_instruction(elem)
+        line = self._instructions_cache.get(elem.bytes)
+        if line is None:
+            line = self._render_instruction(elem)
+            self._instructions_cache[elem.bytes] = line
+        return line
+
+    def _render_instruction(self, elem: Instruction) -> str:
+        instr = elem.raw_instruction
+
+        # rgbasm adds a padding byte after STOP, and does not take the
+        # RST destination as an address, so they are spelled out.
+        if instr.type in (Operation.Invalid, Operation.Stop):
+            return INDENT + "db " + ", ".join(f"${b:02x}" for b in elem.bytes)
+        if instr.type is Operation.Vector:
+            return INDENT + f"rst ${instr.args[0]:02x}"
+
+        args = []
+        for pos, arg in enumerate(instr.args):
+            if pos + 1 == instr.value_pos:
+                value = elem.value
+                if isinstance(value, (Address, Label, LabelOffset)):
+                    arg = arg.cast(value) if isinstance(arg, Ref) else value
+                elif instr.type is Operation.RelJump:
+                    # Scalar relative jump, from the start of the instruction
+                    arg = f"@ {arg + instr.length:+d}"
+            args.append(self.render_value(elem, arg))
+
+        op = str(instr.type).lower()
+        return INDENT + f"{op} {', '.join(args)}".rstrip()
+
+    def render_data_row(self, elem: DataRow) -> Iterator[str]:
+        data = elem.data
+        if (
+                not isinstance(data, DataTable)
+                or data.data_bytes
+                or len(elem.bytes) != data.row_size
+        ):
+            yield from raw_bytes(elem.bytes)
+            return
+
+        # Group the consecutive items that use the same directive
+        items: List[Tuple[str, str]] = []
+        for row_type, value in zip(data.row_struct, elem.values):
+            text = self.render_value(elem, value)
+            if row_type.n_bytes == 1:
+                items.append(('db', text))
+            elif row_type.endian == 'big':
+                items.append(('db', f"HIGH({text}), LOW({text})"))
+            else:
+                items.append(('dw', text))
+
+        line_type, values = None, []
+        for item_type, text in items:
+            if item_type != line_type and values:
+                yield INDENT + f"{line_type} {', '.join(values)}"
+                values = []
+            line_type = item_type
+            values.append(text)
+        yield INDENT + f"{line_type} {', '.join(values)}"
+
+    def render_data_block(self, elem: DataBlock) -> Iterator[str]:
+        data = elem.data
+        if isinstance(data, EmptyData) and elem.bytes.count(data.fill) == elem.size:
+            yield INDENT + f"ds ${elem.size:x}, ${data.fill:02x}"
+        else:
+            yield from raw_bytes(elem.bytes)
+
+    def render_section(self, name: str, address: Address) -> str:
+        # Local labels cannot refer to a global from a previous section
+        self._scope = None
+        return section_header(name, address)
+
+    def render_label(self, label: Label) -> str:
+        if not label.local_name:
+            self._scope = label.name
+            return f"{label.name}:"
+        if label.global_name == self._scope:
+            return f".{label.local_name}"
+        return f"{label.name}:"
+
+    def render_head(self, elem: AsmElement) -> Iterator[str]:
+        """Section, labels and block comments placed before the element"""
+        # Looked up where the element resumes, if not at its start
+        section = elem.section
+        if section is not None and section.address.offset > 0:
+            yield ""
+            yield self.render_section(section.name, section.address)
+        if elem.labels and elem.labels[0].is_global:
+            yield ""
+        for label in elem.labels:
+            yield self.render_label(label)
+        for line in elem.block_comment:
+            yield INDENT + f"; {line}"
+
+    def render_element(self, elem: AsmElement) -> Iterator[str]:
+        yield from self.render_head(elem)
+
+        if isinstance(elem, Instruction):
+            line = self.render_instruction(elem)
+            if elem.comment:
+                line += f"  ; {elem.comment}"
+            yield line
+
+        elif isinstance(elem, DataRow):
+            if elem.row == 0:
+                yield INDENT + f"; {elem.data.description}"
+            lines = list(self.render_data_row(elem))
+            if elem.comment:
+                lines[-1] += f"  ; {elem.comment}"
+            yield from lines
+
+        elif isinstance(elem, DataBlock):
+            yield INDENT + f"; {elem.data.description} ({elem.size} bytes)"
+            yield from self.render_data_block(elem)
+
+    def _boundaries(self, start: Address, end: Address) -> List[Address]:
+        """
+        Addresses in the bank where an element must start, because there
+        is a label, a data block or a section there.
+        """
+        boundaries = set()
+        for addr, _ in self.asm.labels.iter_from(start):
+            if addr >= end:
+                break
+            boundaries.add(addr)
+
+        block = self.asm.data.next_block(start)
+        while block is not None and block.address < end:
+            boundaries.add(block.address)
+            block = self.asm.data.next_block(block.address + 1)
+
+        for section in self.asm.sections.list_sections():
+            if start <= section.address < end:
+                boundaries.add(section.address)
+
+        boundaries.add(end)
+        return sorted(boundaries)
+
+    def iter_bank(self, bank: int) -> Iterator[str]:
+        """Lines of the source file for a single ROM bank"""
+        start = Address(ROM, bank, 0)
+        end = start.zone_end + 1
+        boundaries = self._boundaries(start, end)
+
+        section = self.asm.sections.get_section(start)
+        yield f"; ROM bank ${bank:02x}"
+        yield ""
+        yield self.render_section(
+            section.name if section else f"ROM Bank ${bank:02x}", start
+        )
+
+        addr = start
+        while addr < end:
+            for elem in self.asm.query_range(addr, end, with_xrefs=False):
+                # Elements overlapping the next boundary (e.g. code that
+                # runs into a data block), or resumed in their middle, are
+                # written as plain bytes.
+                stop = boundaries[bisect_right(boundaries, addr)]
+                next_addr = elem.next_address
+                if elem.address != addr:
+                    stop = min(stop, next_addr)
+                elif next_addr <= stop:
+                    yield from self.render_element(elem)
+                    addr = next_addr
+                    continue
+
+                yield from self.render_head(elem)
+                offset = addr.rom_file_offset
+                size = stop.offset - addr.offset
+                yield from raw_bytes(self.asm.rom[offset:offset + size])
+                addr = stop
+                break
+            else:
+                addr = end
+
+    def iter_ram(self) -> Iterator[str]:
+        """Declaration of the labels placed in RAM"""
+        yield "; RAM labels"
+
+        zone, pos = None, 0
+        for addr, labels in self.asm.labels.iter_from(Address(VRAM, 0, 0)):
+            if addr.type not in RAM_SECTIONS:
+                for label in labels:
+                    yield f"DEF {label.name} EQU ${addr.memory_address:04x}"
+                continue
+
+            if addr.zone != zone:
+                zone, pos = addr.zone, 0
+                zone_start = Address(addr.type, addr.bank, 0)
+                name = addr.type.name
+                if addr.type in (VRAM, SRAM) or addr.type is WRAM and addr.bank:
+                    name += f" Bank ${addr.bank:02x}"
+                yield ""
+                yield self.render_section(name, zone_start)
+
+            if addr.offset > pos:
+                yield INDENT + f"ds ${addr.offset - pos:x}"
+                pos = addr.offset
+            for label in labels:
+                yield self.render_label(label)
+
+    def iter_main(self) -> Iterator[str]:
+        yield "; Disassembly exported by UnGameBoy"
+        yield 'INCLUDE "ram.asm"'
+        for bank in range(self.n_banks):
+            yield f'INCLUDE "{self.bank_file_name(bank)}"'
+
+    @staticmethod
+    def write_lines(lines: Iterator[str], path: Path):
+        with open(path, 'w', encoding='utf8') as out_file:
+            for line in lines:
+                out_file.write(line + "\n")
+
+    def write_bank(self, directory: Path, bank: int) -> Path:
+        path = directory / self.bank_file_name(bank)
+        self.write_lines(self.iter_bank(bank), path)
+        return path
+
+    def export(self, directory: Path, workers: int = 1) -> List[Path]:
+        """
+        Write the source files to the given directory, the main one is
+        `main.asm`. With more than one worker, banks are rendered by
+        that many processes.
+        """
+        if self.asm.rom is None:
+            raise ValueError("No ROM loaded")
+        directory.mkdir(parents=True, exist_ok=True)
+
+        self.write_lines(self.iter_main(), directory / "main.asm")
+        self.write_lines(self.iter_ram(), directory / "ram.asm")
+        banks = range(self.n_banks)
+
+        if workers <= 1:
+            return [self.write_bank(directory, bank) for bank in banks]
+
+        # The workers get the state of the managers that the rendering
+        # reads, pickled once. They are spawned rather than forked, as the
+        # UI runs other threads.
+        state = pickle_state(self.asm, EXPORT_MANAGERS)
+        with ProcessPoolExecutor(
+                workers,
+                mp_context=get_context('spawn'),
+                initializer=_init_worker,
+                initargs=(self.asm.rom.rom, state),
+        ) as pool:
+            return list(pool.map(
+                _export_bank, [directory] * len(banks), banks,
+            ))
+
+
+_worker_exporter: Optional[RgbdsExporter] = None
+
+
+def _init_worker(rom: bytes, state: bytes):
+    global _worker_exporter
+    asm = unpickle_state(rom, state)
+    _worker_exporter = RgbdsExporter(asm)
+
+
+def _export_bank(directory: Path, bank: int) -> Path:
+    return _worker_exporter.write_bank(directory, bank)
+
+
+def export_project(asm: 'Disassembler', directory: Path, workers: int = 1):
+    return RgbdsExporter(asm).export(Path(directory), workers)
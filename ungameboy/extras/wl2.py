@@ -120,17 +120,18 @@ def detect_sprites_table(asm: 'Disassembler', address: Address):
     table = DataTable(address, 0, 'addr', JumpTableDetector())
     asm.data.insert(table)
 
-    asm.labels.auto_create(address)
+    with asm.xrefs.deferred_index():
+        asm.labels.auto_create(address)
 
-    visited = set()
-    for row in table:
-        ref = asm.context.detect_addr_bank(address, row.items[0])
-        if ref in visited:
-            continue
-        visited.add(ref)
+        visited = set()
+        for row in table:
+            ref = asm.context.detect_addr_bank(address, row.items[0])
+            if ref in visited:
+                continue
+            visited.add(ref)
 
-        asm.data.insert(WL2Sprite(ref))
-        asm.labels.auto_create(ref, local=True)
+            asm.data.insert(WL2Sprite(ref))
+            asm.labels.auto_create(ref, local=True)
 
 
 class WL2SoundTrackIndex(Data):
@@ -296,9 +297,12 @@ def detect_audio_track(asm: 'Disassembler', address: Address):
     for voice_addr in index.voices:
         asm.data.insert(WL2SoundVoice(voice_addr))
 
-    asm.labels.auto_create(min(index.voices))
-    for i, voice_addr in enumerate(index.voices, start=1):
-        asm.labels.create(voice_addr, f".voice_{i}")
-    for extra_addr in index.extras:
-        asm.labels.auto_create(extra_addr, local=True)
-    asm.labels.create(address, ".index")
+    with asm.xrefs.deferred_index():
+        asm.labels.auto_create(min(index.voices))
+        asm.labels.create_many(
+            (voice_addr, f".voice_{i}")
+            for i, voice_addr in enumerate(index.voices, start=1)
+        )
+        for extra_addr in index.extras:
+            asm.labels.auto_create(extra_addr, local=True)
+        asm.labels.create(address, ".index")
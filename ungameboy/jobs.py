@@ -0,0 +1,179 @@
+"""
+Long operations run as jobs: generators that do their work one step at
+a time, and yield their progress in between. The UI runs the pending
+jobs in the background a slice at a time, highest priority first, and
+they can be cancelled between two steps. Without the UI, or inside a
+batch, a job runs to completion as soon as it is submitted.
+"""
+
+from collections import deque
+from enum import Enum
+from time import perf_counter
+from typing import (
+    TYPE_CHECKING, Callable, Deque, Iterator, List, Optional,
+)
+
+if TYPE_CHECKING:
+    from .dis import Disassembler
+
+__all__ = ['Job', 'JobScheduler', 'JobStatus']
+
+# Finished jobs kept around for `jobs list`
+MAX_FINISHED = 20
+
+Steps = Iterator[Optional[str]]
+
+
+class JobStatus(str, Enum):
+    Pending = "pending"
+    Running = "running"
+    Done = "done"
+    Cancelled = "cancelled"
+    Failed = "failed"
+
+    def __str__(self):
+        return self.value
+
+
+class Job:
+    """
+    A named generator of steps. Each step yields a progress message, or
+    None to keep the previous one.
+    """
+
+    def __init__(self, job_id: int, name: str, steps: Steps, priority=0):
+        self.id = job_id
+        self.name = name
+        self.priority = priority
+        self.status = JobStatus.Pending
+        self.progress = ""
+        self.error: Optional[BaseException] = None
+        self._steps = steps
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (
+            JobStatus.Done, JobStatus.Cancelled, JobStatus.Failed
+        )
+
+    def step(self) -> bool:
+        """Run the next step, False once there are no more"""
+        self.status = JobStatus.Running
+        try:
+            progress = next(self._steps)
+        except StopIteration:
+            self.status = JobStatus.Done
+            return False
+        except BaseException as exc:
+            self.status = JobStatus.Failed
+            self.error = exc
+            raise
+        if progress is not None:
+            self.progress = progress
+        return True
+
+    def cancel(self):
+        if self.finished:
+            return
+        self._steps.close()
+        self.status = JobStatus.Cancelled
+
+    def __str__(self):
+        line = f"{self.id:>3} {self.status:<9} {self.priority:>3}  {self.name}"
+        if self.error is not None:
+            return f"{line}: {self.error!r}"
+        if self.progress and not self.finished:
+            return f"{line}: {self.progress}"
+        return line
+
+
+class JobScheduler:
+    def __init__(self, asm: 'Disassembler'):
+        self.asm = asm
+        # Jobs waiting for their turn, or started and not finished yet
+        self.jobs: List[Job] = []
+        self.finished: Deque[Job] = deque(maxlen=MAX_FINISHED)
+        # Set while something runs the jobs in the background, see
+        # run_slice. Otherwise they run when they are submitted.
+        self.background = False
+        # Called when a job is submitted, possibly from another thread
+        self.on_submit: Optional[Callable[[], None]] = None
+        self._next_id = 1
+
+    @property
+    def current(self) -> Optional[Job]:
+        """Job that runs next: highest priority, then oldest"""
+        if not self.jobs:
+            return None
+        return max(self.jobs, key=lambda job: (job.priority, -job.id))
+
+    def submit(self, name: str, steps: Steps, priority=0) -> Job:
+        job = Job(self._next_id, name, steps, priority)
+        self._next_id += 1
+
+        # A batch expects its changes to be done when it ends
+        if not self.background or self.asm.in_batch:
+            try:
+                with self.asm.lock.write():
+                    while job.step():
+                        pass
+            finally:
+                self.finished.append(job)
+            return job
+
+        self.jobs.append(job)
+        if self.on_submit is not None:
+            self.on_submit()
+        return job
+
+    def run_slice(self, duration: float) -> List[Job]:
+        """
+        Run steps of the pending jobs for about that many seconds, and
+        return the jobs that finished meanwhile. A job that fails does
+        not raise, its exception is kept in `error`. Nothing runs while
+        another thread holds the lock.
+        """
+        if not self.asm.lock.acquire_write(blocking=False):
+            return []
+        try:
+            return self._run_slice(duration)
+        finally:
+            self.asm.lock.release_write()
+
+    def _run_slice(self, duration: float) -> List[Job]:
+        deadline = perf_counter() + duration
+        finished = []
+        # The current job is looked up at each step, as steps can submit
+        # jobs of a higher priority
+        job = self.current
+        while job is not None:
+            try:
+                running = job.step()
+            except Exception:
+                running = False
+            if not running:
+                self._remove(job)
+                finished.append(job)
+            if perf_counter() >= deadline:
+                break
+            job = self.current
+        return finished
+
+    def run_all(self) -> List[Job]:
+        return self.run_slice(float('inf'))
+
+    def _remove(self, job: Job):
+        self.jobs.remove(job)
+        self.finished.append(job)
+
+    def cancel(self, job_id: int) -> Job:
+        for job in self.jobs:
+            if job.id == job_id:
+                job.cancel()
+                self._remove(job)
+                return job
+        raise KeyError(f"No pending job {job_id}")
+
+    def list(self) -> List[str]:
+        header = f"{'id':>3} {'status':<9} {'pri':>3}  name"
+        return [header, *map(str, self.finished), *map(str, self.jobs)]
@@ -0,0 +1,140 @@
+"""
+Concurrency model: the project can be changed by one thread at a time,
+and read by any number of threads while nobody changes it. Every change
+holds `asm.lock` for writing (commands, batches and jobs take it), and
+the threads other than the one changing the project hold it for reading.
+
+The UI thread never waits for the lock: while a worker changes the
+project, the lines that cannot be read are drawn as placeholders, and
+the background jobs wait for the next slice.
+"""
+
+from threading import Condition, Lock, get_ident
+from typing import Callable, Dict, Optional
+
+__all__ = ['RWLock']
+
+
+class RWLock:
+    """
+    Readers-writer lock. Both sides are reentrant, and the thread that
+    writes can read as well. A thread that reads cannot start writing,
+    as two of them doing so would wait for each other forever. Writers
+    waiting for the lock go before new readers. A read-only lock refuses
+    all writers, for the snapshots of a project.
+    """
+
+    def __init__(self, read_only=False):
+        self.read_only = read_only
+        self._cond = Condition(Lock())
+        # Reading depth per thread
+        self._readers: Dict[int, int] = {}
+        self._writer: Optional[int] = None
+        self._write_depth = 0
+        self._writers_waiting = 0
+        self._read = _Held(self.acquire_read, self.release_read)
+        self._write = _Held(self.acquire_write, self.release_write)
+
+    def _can_read(self) -> bool:
+        return self._writer is None and not self._writers_waiting
+
+    def _can_write(self) -> bool:
+        return self._writer is None and not self._readers
+
+    def acquire_read(self, blocking=True, timeout: float = None) -> bool:
+        me = get_ident()
+        with self._cond:
+            depth = self._readers.get(me)
+            if depth is None and self._writer != me:
+                if not blocking:
+                    if not self._can_read():
+                        return False
+                elif not self._cond.wait_for(self._can_read, timeout):
+                    return False
+            self._readers[me] = (depth or 0) + 1
+            return True
+
+    def release_read(self):
+        me = get_ident()
+        with self._cond:
+            depth = self._readers.get(me)
+            if depth is None:
+                raise RuntimeError("Read lock not held")
+            if depth > 1:
+                self._readers[me] = depth - 1
+                return
+            del self._readers[me]
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self, blocking=True, timeout: float = None) -> bool:
+        me = get_ident()
+        # Only this thread can have set the writer to itself
+        if self._writer == me:
+            self._write_depth += 1
+            return True
+
+        with self._cond:
+            if self.read_only:
+                raise RuntimeError("Cannot change a read-only snapshot")
+            if me in self._readers:
+                raise RuntimeError("Cannot write while holding a read lock")
+            if not blocking:
+                if not self._can_write():
+                    return False
+            else:
+                self._writers_waiting += 1
+                try:
+                    acquired = self._cond.wait_for(self._can_write, timeout)
+                finally:
+                    self._writers_waiting -= 1
+                if not acquired:
+                    # Readers may have been waiting for this writer
+                    self._cond.notify_all()
+                    return False
+            self._writer = me
+            self._write_depth = 1
+            return True
+
+    def release_write(self):
+        if self._writer != get_ident():
+            raise RuntimeError("Write lock not held")
+        if self._write_depth > 1:
+            self._write_depth -= 1
+            return
+        with self._cond:
+            self._write_depth = 0
+            self._writer = None
+            self._cond.notify_all()
+
+    @property
+    def writing(self) -> bool:
+        """Whether the current thread holds the lock for writing"""
+        return self._writer == get_ident()
+
+    def read(self) -> '_Held':
+        """Context manager holding the lock for reading"""
+        return self._read
+
+    def write(self) -> '_Held':
+        """Context manager holding the lock for writing"""
+        return self._write
+
+
+class _Held:
+    """
+    Context manager for one side of the lock. Each command takes the
+    lock, a generator based one would be noticeably slower.
+    """
+
+    __slots__ = ('_acquire', '_release')
+
+    def __init__(self, acquire: Callable[[], bool], release: Callable[[], None]):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+
+    def __exit__(self, *exc_info):
+        self._release()
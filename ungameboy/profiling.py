@@ -0,0 +1,175 @@
+"""
+Timing of the hot paths, to find out where the time goes when the UI
+stutters. It is off by default, and then costs nothing: the methods
+marked with `timed` are only wrapped while the profiler is enabled.
+
+Set the UGB_PROFILE environment variable to enable it from the start,
+the report is then printed on exit. Otherwise, use the `profile`
+commands.
+"""
+
+import atexit
+from contextlib import contextmanager
+from functools import wraps
+import os
+import random
+import sys
+from time import perf_counter
+from typing import Callable, Dict, Iterator, List, Tuple
+
+__all__ = ['PROFILER', 'Profiler', 'Timings', 'timed']
+
+# Keep at most that many samples per timer, to compute the percentiles
+MAX_SAMPLES = 10_000
+
+
+class Timings:
+    """Call count and durations of one timer, in seconds"""
+
+    __slots__ = ('count', 'total', 'max', 'samples', '_rng')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+        self.samples: List[float] = []
+        self._rng = random.Random(0)
+
+    def add(self, elapsed: float):
+        self.count += 1
+        self.total += elapsed
+        if elapsed > self.max:
+            self.max = elapsed
+
+        # Reservoir sampling: all the calls have the same odds to be kept
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(elapsed)
+        else:
+            pos = self._rng.randrange(self.count)
+            if pos < MAX_SAMPLES:
+                self.samples[pos] = elapsed
+
+    def percentile(self, pct: float) -> float:
+        if not self.samples:
+            return 0.
+        ordered = sorted(self.samples)
+        return ordered[min(int(len(ordered) * pct / 100), len(ordered) - 1)]
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.timings: Dict[str, Timings] = {}
+        # Methods that get timed: class, attribute, timer, function
+        self._methods: List[Tuple[type, str, str, Callable]] = []
+
+    def register(self, owner: type, attr: str, name: str, func: Callable):
+        self._methods.append((owner, attr, name, func))
+        setattr(owner, attr, self._wrap(name, func) if self.enabled else func)
+
+    def _wrap(self, name: str, func: Callable) -> Callable:
+        record = self.record
+
+        @wraps(func)
+        def timed_func(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                record(name, perf_counter() - start)
+
+        return timed_func
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        for owner, attr, name, func in self._methods:
+            setattr(owner, attr, self._wrap(name, func))
+
+    def disable(self):
+        self.enabled = False
+        for owner, attr, _, func in self._methods:
+            setattr(owner, attr, func)
+
+    def reset(self):
+        self.timings.clear()
+
+    def record(self, name: str, elapsed: float):
+        timer = self.timings.get(name)
+        if timer is None:
+            timer = self.timings[name] = Timings()
+        timer.add(elapsed)
+
+    @contextmanager
+    def section(self, name: str) -> Iterator[None]:
+        """Time a block of code, when the profiler is enabled"""
+        if not self.enabled:
+            yield
+            return
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, perf_counter() - start)
+
+    def report(self) -> List[str]:
+        """Timers sorted by cumulative time, with durations in ms"""
+        lines = [
+            f"{'timer':<28} {'calls':>9} {'total':>10} {'mean':>8} "
+            f"{'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}"
+        ]
+        ordered = sorted(
+            self.timings.items(), key=lambda item: item[1].total, reverse=True
+        )
+        for name, timer in ordered:
+            ms = [
+                timer.total / timer.count, timer.percentile(50),
+                timer.percentile(95), timer.percentile(99), timer.max,
+            ]
+            lines.append(
+                f"{name:<28} {timer.count:>9,} {timer.total * 1000:>10.1f} "
+                + " ".join(f"{value * 1000:>8.3f}" for value in ms)
+            )
+        return lines
+
+    @staticmethod
+    def dump(path: str, func: Callable, *args):
+        """Run a function under cProfile, and write the stats to a file"""
+        import cProfile
+
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(func, *args)
+        finally:
+            profile.dump_stats(path)
+
+
+PROFILER = Profiler()
+
+
+class timed:
+    """
+    Mark a method to be timed by the profiler, under the given name. The
+    method is left untouched while the profiler is disabled.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.func = None
+
+    def __call__(self, func: Callable) -> 'timed':
+        self.func = func
+        return self
+
+    def __set_name__(self, owner: type, attr: str):
+        PROFILER.register(owner, attr, self.name, self.func)
+
+
+def _print_report():
+    print("\n".join(PROFILER.report()), file=sys.stderr)
+
+
+if os.environ.get('UGB_PROFILE'):
+    PROFILER.enable()
+    atexit.register(_print_report)
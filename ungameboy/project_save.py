@@ -1,10 +1,18 @@
 from datetime import datetime, timedelta, timezone
 import os
 from importlib import import_module
+from io import BytesIO
 from pathlib import Path
+import pickle
 import shlex
+from shutil import copyfile
 from tempfile import NamedTemporaryFile
-from typing import TYPE_CHECKING
+from threading import Lock, Thread
+from typing import (
+    TYPE_CHECKING, Callable, Iterable, Iterator, Optional, Sequence, Union,
+)
+
+from .profiling import PROFILER
 
 if TYPE_CHECKING:
     from .dis.disassembler import Disassembler
@@ -15,54 +23,231 @@ AUTOSAVE_NUM = 3
 PLUGINS = []
 
 
-def get_save_state(asm: "Disassembler"):
+def get_save_state(asm: "Disassembler", plugins: Iterable[str] = None):
     if asm.rom is not None:
         yield ('load-rom', Path(asm.rom_path).resolve())
 
-    for plugin in PLUGINS:
+    for plugin in PLUGINS if plugins is None else plugins:
         yield ('plugin', 'import', plugin)
 
     for mgr in asm.managers:
         yield from mgr.save_items()
 
 
-def autosave_project(asm: "Disassembler"):
+def quote_command(command: Union[str, Sequence]) -> str:
+    if isinstance(command, str):
+        return command
+    # Reproduce shlex.join, which was introduced in Python 3.8
+    return ' '.join(shlex.quote(str(item)) for item in command)
+
+
+class Journal:
+    """
+    Append-only log of the commands run on a project since its last
+    snapshot. Each command is written once, as it runs, so that saving
+    costs as much as the edit and not as much as the project.
+
+    When a snapshot is taken, a mark is added to the journal and the
+    snapshot records the mark's token. On load, only the lines after the
+    mark are replayed, even if the journal could not be trimmed yet.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._lock = Lock()
+
+    def append(self, line: str):
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, 'a', encoding='utf8') as journal:
+                journal.write(line + '\n')
+
+    def mark(self) -> str:
+        token = os.urandom(16).hex()
+        self.append(f"# snapshot {token}")
+        return token
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf8') as journal:
+                return journal.read().splitlines()
+        except FileNotFoundError:
+            return []
+
+    def read_after(self, token: Optional[str]) -> Iterator[str]:
+        """Lines following the mark of the given token, or all of them"""
+        lines = self._read()
+        marker = f"# snapshot {token}"
+        if token and marker in lines:
+            lines = lines[lines.index(marker) + 1:]
+        return iter(lines)
+
+    def discard_until(self, token: str):
+        """Drop the lines up to a mark, once the snapshot is written"""
+        with self._lock:
+            lines = self._read()
+            marker = f"# snapshot {token}"
+            if marker not in lines:
+                return
+            lines = lines[lines.index(marker) + 1:]
+
+            with NamedTemporaryFile(
+                    'w', encoding='utf8', dir=self.path.parent, delete=False
+            ) as tmp:
+                tmp.writelines(line + '\n' for line in lines)
+            os.replace(tmp.name, self.path)
+
+
+def get_journal(asm: "Disassembler") -> Optional[Journal]:
     if not asm.project_name:
-        return
+        return None
+
+    path = PROJECTS_DIR / f"{asm.project_name}.ugb_journal.txt"
+    if asm.journal is None or asm.journal.path != path:
+        asm.journal = Journal(path)
+    return asm.journal
+
+
+def record_command(asm: "Disassembler", command: Union[str, Sequence]):
+    """Add a command that was just run to the project's journal"""
+    journal = get_journal(asm)
+    if journal is not None:
+        journal.append(quote_command(command))
+
+
+class BackgroundSave:
+    """
+    Compaction of a project's journal into a new snapshot, written from
+    a worker thread. It works from asm.snapshot(), so that edits can go
+    on while the save is written.
+    """
+
+    def __init__(
+            self, asm: "Disassembler", on_progress: Callable[[], None] = None
+    ):
+        self.project_name = asm.project_name
+        self.journal = get_journal(asm)
+        self.token = self.journal.mark()
+        self.state = asm.snapshot()
+        self.plugins = PLUGINS.copy()
+        self.on_progress = on_progress or (lambda: None)
+
+        self.lines = 0
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def join(self):
+        self.thread.join()
+
+    @property
+    def status(self) -> str:
+        if self.error is not None:
+            return f"Autosave failed: {self.error}"
+        return f"Saving project… {self.lines} lines"
+
+    def commands(self):
+        for n, command in enumerate(get_save_state(self.state, self.plugins)):
+            self.lines = n + 1
+            if not n % 10000:
+                self.on_progress()
+            yield command
+
+    def run(self):
+        try:
+            project_path = PROJECTS_DIR / f"{self.project_name}.ugb.txt"
+            if project_path.exists():
+                now = datetime.now(timezone.utc)
+                backup = f"{self.project_name}.ugb_autosave_{now:%Y-%m-%d-%H%M%S}"
+                copyfile(project_path, PROJECTS_DIR / f"{backup}.txt")
+
+                # Remove the old backups
+                pattern = f'{self.project_name}.ugb_autosave_*.txt'
+                backups = sorted(PROJECTS_DIR.glob(pattern), reverse=True)
+                for save in backups[AUTOSAVE_NUM:]:
+                    save.unlink()
+
+            write_commands(self.commands(), project_path, self.token)
+            self.journal.discard_until(self.token)
+        except Exception as exc:
+            self.error = exc
+        finally:
+            self.done = True
+            self.on_progress()
+
+
+def autosave_project(
+        asm: "Disassembler", on_progress: Callable[[], None] = None
+) -> Optional[BackgroundSave]:
+    """
+    Periodically compact the journal into a new project snapshot, in the
+    background. The previous snapshot is kept as a backup. No new save
+    is started while the previous one is still being written.
+    """
+    if not asm.project_name or asm.in_batch:
+        return None
 
     now = datetime.now(timezone.utc)
     if now <= asm.last_save + AUTOSAVE_PERIOD:
-        return
+        return None
+    if asm.saving is not None and not asm.saving.done:
+        return None
 
-    name = f"{asm.project_name}.ugb_autosave_{now:%Y-%m-%d-%H%M%S}.txt"
-    save_to_file(asm, PROJECTS_DIR / name)
+    asm.saving = BackgroundSave(asm, on_progress)
+    asm.saving.start()
     asm.last_save = now
-
-    current_saves = list(PROJECTS_DIR.glob('*.ugb_autosave_*.txt'))
-    # Remove the old auto-saves
-    current_saves.sort(reverse=True)
-    for save in current_saves[AUTOSAVE_NUM:]:
-        save.unlink()
+    return asm.saving
 
 
 def save_project(asm: "Disassembler"):
     if not asm.project_name:
         raise ValueError("Cannot save a project without name!")
 
+    # A save still running would replace this one with an older state
+    if asm.saving is not None:
+        asm.saving.join()
+
+    journal = get_journal(asm)
+    token = journal.mark()
     project_path = PROJECTS_DIR / f"{asm.project_name}.ugb.txt"
-    save_to_file(asm, project_path)
+    save_to_file(asm, project_path, token)
+    journal.discard_until(token)
 
     asm.last_save = datetime.now(timezone.utc)
 
 
-def save_to_file(asm: "Disassembler", path: Path):
+def save_now(asm: "Disassembler"):
+    """
+    Save right away after a command that changes the project but cannot
+    be journaled, such as an import from an outside file, so that the
+    commands journaled next apply on top of it. In a batch, the save is
+    done once the batch succeeds, as a rollback would undo the change.
+    """
+    if not asm.project_name:
+        return
+    if asm.in_batch:
+        asm.save_pending = True
+    else:
+        save_project(asm)
+
+
+def save_to_file(asm: "Disassembler", path: Path, token: str = None):
+    write_commands(get_save_state(asm), path, token)
+
+
+def write_commands(commands: Iterable, path: Path, token: str = None):
     path.parent.mkdir(parents=True, exist_ok=True)
 
-    with NamedTemporaryFile('w', encoding='utf8', delete=False) as tmp:
-        for command in get_save_state(asm):
-            # Reproduce shlex.join, which was introduced in Python 3.8
-            line = ' '.join(shlex.quote(str(item)) for item in command)
-            tmp.write(line + os.linesep)
+    with NamedTemporaryFile(
+            'w', encoding='utf8', dir=path.parent, delete=False
+    ) as tmp:
+        if token:
+            tmp.write(f"# journal {token}" + os.linesep)
+        for command in commands:
+            tmp.write(quote_command(command) + os.linesep)
 
     os.replace(tmp.name, path)
 
@@ -81,13 +266,47 @@ def load_project(asm: "Disassembler"):
 
     cli = create_core_cli_v2(asm)
     asm.reset()
-    asm.xrefs.bypass_index = True
-    with open(project_path, 'r', encoding='utf8') as proj_read:
-        for line in proj_read:
-            cli(line.strip())
-    asm.xrefs.bypass_index = False
+    # The banks get fully indexed once the project is loaded
+    replay = PROFILER.section("load_project replay")
+    with replay, asm.batch(reindex=False, rollback=False):
+        with open(project_path, 'r', encoding='utf8') as proj_read:
+            header = proj_read.readline()
+            token = None
+            if header.startswith("# journal "):
+                token = header.split()[-1]
+            cli.run_many([header])
+            cli.run_many(proj_read)
+
+        # Then the commands run since that snapshot
+        cli.run_many(get_journal(asm).read_after(token))
+
+
+def pickle_state(asm: "Disassembler", managers: Iterable[str]) -> bytes:
+    """
+    State of some of the managers of a project, by attribute name,
+    pickled once to be sent to worker processes. Loading it back is
+    much cheaper than replaying the project's commands.
+    """
+    with asm.lock.read():
+        states = {name: getattr(asm, name).snapshot_state() for name in managers}
+        return pickle.dumps(states, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def unpickle_state(rom: bytes, state: bytes) -> "Disassembler":
+    """
+    Rebuild a project from the ROM and the result of pickle_state,
+    typically in a worker process. Nothing gets indexed.
+    """
+    from .dis import Disassembler
+
+    asm = Disassembler()
+    asm.load_rom(BytesIO(rom))
+    for name, manager_state in pickle.loads(state).items():
+        getattr(asm, name).restore_state(manager_state)
+    return asm
 
 
 def import_plugin(name: str):
     import_module(name)
-    PLUGINS.append(name)
+    if name not in PLUGINS:
+        PLUGINS.append(name)
@@ -1,12 +1,13 @@
+import asyncio
 from functools import partial
 from itertools import product
+from typing import Iterator, List, Optional
 
 from prompt_toolkit.application import Application
 from prompt_toolkit.eventloop import run_in_executor_with_context
 from prompt_toolkit.layout.containers import Float, Window
 from prompt_toolkit.layout.controls import FormattedTextControl
 from prompt_toolkit.styles import Style
-from prompt_toolkit.widgets.dialogs import Dialog
 
 from .filters import UGBFilters
 from .gfx_display import GraphicsDisplayState
@@ -14,8 +15,9 @@ from .key_bindings import create_global_bindings
 from .layout import UGBLayout
 from .prompt import UGBPrompt
 from .xref_browser import XRefBrowserState
-from ..address import Address
+from ..address import ROM, Address
 from ..dis import Disassembler
+from ..jobs import Job
 from ..project_save import load_project
 
 
@@ -34,6 +36,7 @@ UGB_STYLE = {
     'gfx.pixel.2': 'bg:#555555 fg:#ffffff bold',
     'gfx.pixel.3': 'bg:#000000 fg:#aaaaaa bold',
     'sidebar.title': 'bold',
+    'status': 'reverse',
     # Address classes
     'address': 'fg:#10b020',
     'address data': 'fg:#10a080',
@@ -78,6 +81,12 @@ UGB_STYLE = {
     'instr.op.invalid': 'fg:ansired',
 }
 
+# Longest time that the background jobs run without letting the UI
+# handle events, in seconds
+JOB_SLICE = 0.02
+# The initial indexing makes way for the jobs started from the prompt
+INDEX_PRIORITY = -1
+
 for _op, _type in product(['call', 'jp', 'jr'], ['addr', 'label']):
     UGB_STYLE[f'value.{_type}.{_op}'] = UGB_STYLE[f'instr.op.{_op}']
 
@@ -90,6 +99,8 @@ class UGBApplication:
 
         self.xrefs = XRefBrowserState()
         self.gfx = GraphicsDisplayState()
+        # Text returned by the last command, if still displayed
+        self.output: Optional[List[str]] = None
 
         self.filters = UGBFilters(self)
         self.prompt = UGBPrompt(self)
@@ -104,6 +115,7 @@ class UGBApplication:
 
     def run(self):
         def _pre_run():
+            self.app.create_background_task(self._run_jobs())
             self.app.create_background_task(self._pre_run())
 
         main_offset = Address.from_rom_offset(0x0100)
@@ -153,17 +165,70 @@ class UGBApplication:
                 self.asm.analyze.detect_empty_banks
             )
 
-        # Index all the banks. This can take a while.
-        n_banks = self.asm.rom.n_banks
-        for bank in range(n_banks):
-            msg = f"Indexing bank {bank:02x}/{n_banks - 1:02x}"
-            index = partial(self.asm.xrefs.index, bank, fast=True)
-            yield msg, run_in_executor_with_context(index)
-
         yield "", run_in_executor_with_context(self.layout.refresh)
 
+    def _next_bank(self, pending: List[int]) -> int:
+        """Bank to index next: the one on screen, if not done yet"""
+        mem_type, bank = self.layout.main_control.current_zone
+        if mem_type is ROM and bank in pending:
+            return bank
+        return pending[0]
+
+    def _index_banks(self) -> Iterator[str]:
+        """
+        Steps of the job indexing all the banks while the editor is in
+        use, starting with the bank on screen.
+        """
+        pending = list(range(self.asm.rom.n_banks))
+        total = len(pending)
+
+        while pending:
+            bank = self._next_bank(pending)
+            pending.remove(bank)
+            progress = f"bank {bank:02x}… {total - len(pending)}/{total}"
+            yield progress
+            for _ in self.asm.xrefs.iter_index(bank, fast=True):
+                yield progress
+
+            # Show the xrefs of the bank on screen as soon as it is done
+            if self.layout.main_control.current_zone == (ROM, bank):
+                self.layout.refresh()
+
+    async def _run_jobs(self):
+        """
+        Run the jobs in the event loop, a slice of work at a time, so
+        that the UI stays responsive and never sees the project in the
+        middle of a change.
+        """
+        jobs = self.asm.jobs
+        wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        jobs.on_submit = partial(loop.call_soon_threadsafe, wakeup.set)
+        jobs.background = True
+
+        try:
+            while True:
+                if not jobs.jobs:
+                    await wakeup.wait()
+                wakeup.clear()
+                finished = jobs.run_slice(JOB_SLICE)
+                if finished:
+                    self._jobs_finished(finished)
+                self.app.invalidate()
+                await asyncio.sleep(0)
+        finally:
+            jobs.background = False
+            jobs.on_submit = None
+
+    def _jobs_finished(self, finished: List[Job]):
+        self.layout.refresh()
+        errors = [str(job) for job in finished if job.error is not None]
+        if errors:
+            self.layout.show_output(errors)
+
     async def _pre_run(self):
         """Run the initialization tasks asynchronously"""
+        from prompt_toolkit.widgets.dialogs import Dialog
 
         # Prepare the loading progress dialog
         progress_msg = "Starting UnGameBoy"
@@ -187,9 +252,19 @@ class UGBApplication:
 
         finally:
             self.app.layout.focus_last()
-            self.prompt.refresh_completion()
             self.layout.floats.remove(progress_float)
 
+        if self.asm.is_loaded:
+            # Labels are searched as the user types, their index goes first
+            self.asm.jobs.submit(
+                "Indexing labels",
+                (f"{left} left" for left in self.asm.labels.iter_index_names()),
+                priority=INDEX_PRIORITY,
+            )
+            self.asm.jobs.submit(
+                "Indexing", self._index_banks(), priority=INDEX_PRIORITY
+            )
+
 
 def run():
     import sys
@@ -1,17 +1,19 @@
-from typing import TYPE_CHECKING, Optional, Tuple
+from typing import TYPE_CHECKING, Dict, Optional, Tuple
 
 from prompt_toolkit.application import get_app
 from prompt_toolkit.data_structures import Point
 from prompt_toolkit.layout.controls import UIContent, UIControl
 
 from .common import ControlMode
-from .lexer import AssemblyRender
 from ..address import ROM, Address, MemoryType
 from ..data_structures import DoubleMapping, StateStack
-from ..dis import Disassembler, RomElement
+from ..dis import Disassembler
+from ..profiling import timed
+from ..project_save import record_command
 
 if TYPE_CHECKING:
     from prompt_toolkit.layout import Window
+    from .lexer import AssemblyRender, FormattedText
 
 
 class AsmControl(UIControl):
@@ -20,7 +22,7 @@ class AsmControl(UIControl):
         from .key_bindings import create_asm_control_bindings
 
         self.asm = asm
-        self.renderer = AssemblyRender(self)
+        self._renderer: Optional['AssemblyRender'] = None
         self.key_bindings = create_asm_control_bindings(self)
 
         self.current_zone: Tuple[MemoryType, int] = (ROM, 0)
@@ -33,15 +35,27 @@ class AsmControl(UIControl):
         self.cursor_y = 0
         self.cursor_x = 0
 
+        # Rendered elements, only kept for the duration of a redraw
+        self._render_cache: Dict[Address, 'FormattedText'] = {}
+
         self._stack: StateStack[Address] = StateStack()
         self._stack.push(Address(ROM, 0, 0))
 
         self.load_zone(self.current_zone)
 
+    @property
+    def renderer(self) -> 'AssemblyRender':
+        # The lexer is only needed once there is code to show
+        if self._renderer is None:
+            from .lexer import AssemblyRender
+            self._renderer = AssemblyRender(self)
+        return self._renderer
+
     def get_key_bindings(self):
         return self.key_bindings
 
     def create_content(self, width: int, height: int) -> UIContent:
+        self._render_cache.clear()
         if not self.asm.is_loaded:
             return UIContent(lambda _: [('', "Loading...")], 1)
         return UIContent(
@@ -57,8 +71,19 @@ class AsmControl(UIControl):
         except IndexError:
             return []
         line -= ref_line
+        rendered = self._render_cache.get(addr)
+        if rendered is None:
+            # Never wait for a worker thread changing the project
+            lock = self.asm.lock
+            if not lock.acquire_read(blocking=False):
+                return [('class:comment', "…")]
+            try:
+                rendered = self.renderer.render(addr)
+            finally:
+                lock.release_read()
+            self._render_cache[addr] = rendered
         try:
-            return self.renderer.render(addr)[line]
+            return rendered[line]
         except IndexError:
             msg = f"RENDER ERROR: Line {line} out of bounds at {addr}"
             return [("fg:ansired bold", msg)]
@@ -124,11 +149,7 @@ class AsmControl(UIControl):
 
     @property
     def destination_address(self) -> Optional[Address]:
-        item = self.asm[self.address]
-        if isinstance(item, RomElement):
-            return item.dest_address
-        else:
-            return None
+        return self.asm.query(self.address, ("dest_address",))["dest_address"]
 
     def get_vertical_scroll(self, window: "Window") -> int:
         if self.default_mode:
@@ -280,17 +301,28 @@ class AsmControl(UIControl):
         addr, index = self.comment_index
         if index is None or self.comment_buffer is None:
             return
-        elif index < 0:
-            self.asm.comments.set_inline(addr, self.comment_buffer)
-        else:
-            self.asm.comments.set_block_line(addr, index, self.comment_buffer)
+        with self.asm.lock.write():
+            if index < 0:
+                self.asm.comments.set_inline(addr, self.comment_buffer)
+            else:
+                self.asm.comments.set_block_line(
+                    addr, index, self.comment_buffer
+                )
+        self.journal_comments(addr)
+
+    def journal_comments(self, addr: Address):
+        """Comments are edited directly, not through commands"""
+        for command in self.asm.comments.save_items_at(addr):
+            record_command(self.asm, command)
 
     def add_line_above(self):
         self.save_comment()
         addr, offset = self.comment_index
         if offset is None or offset < 0:
             offset = -1
-        self.asm.comments.add_block_line(addr, offset, "")
+        with self.asm.lock.write():
+            self.asm.comments.add_block_line(addr, offset, "")
+        self.journal_comments(addr)
 
         # Cursor is now on the new line but with the old value. Setting
         # the buffer to None will prevent writing on move.
@@ -301,9 +333,10 @@ class AsmControl(UIControl):
         addr, offset = self.comment_index
         if offset is None or offset < 0:
             addr = self.current_view.find_address(self.cursor + 1)
-            self.asm.comments.add_block_line(addr, 0, "")
-        else:
+            offset = -1
+        with self.asm.lock.write():
             self.asm.comments.add_block_line(addr, offset + 1, "")
+        self.journal_comments(addr)
 
         self.refresh()
         self.move_down(1)
@@ -312,7 +345,9 @@ class AsmControl(UIControl):
         addr, offset = self.comment_index
         if offset is None or offset < 0:
             return
-        self.asm.comments.pop_block_line(addr, offset)
+        with self.asm.lock.write():
+            self.asm.comments.pop_block_line(addr, offset)
+        self.journal_comments(addr)
 
         # Cursor is now on the line that was below the one that we just
         # deleted. Set buffer to None to avoid unwanted write.
@@ -357,7 +392,12 @@ class AsmRegionView:
         if self.control.asm.is_loaded:
             self.build_lines_map()
 
+    @timed("build_lines_map")
     def build_lines_map(self):
+        with self.control.asm.lock.read():
+            self._build_lines_map()
+
+    def _build_lines_map(self):
         self.map.clear()
 
         lines = 0
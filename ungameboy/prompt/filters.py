@@ -15,6 +15,8 @@ class UGBFilters:
         self.prompt_active = Condition(self._prompt_active)
         self.xrefs_visible = Condition(self._xrefs_visible)
         self.gfx_visible = Condition(self._gfx_visible)
+        self.output_visible = Condition(self._output_visible)
+        self.status_visible = Condition(self._status_visible)
         self.editor_active = Condition(self._editor_active)
         self.cursor_active = Condition(self._cursor_active)
         self.commenting = Condition(self._comment_mode_active)
@@ -41,3 +43,9 @@ class UGBFilters:
 
     def _gfx_visible(self):
         return self.ugb.gfx.address is not None
+
+    def _output_visible(self):
+        return self.ugb.output is not None
+
+    def _status_visible(self):
+        return bool(self.ugb.layout.status_text())
@@ -1,5 +1,5 @@
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
 from prompt_toolkit.layout.containers import Window
 from prompt_toolkit.layout.controls import UIControl, UIContent
@@ -8,11 +8,13 @@ from prompt_toolkit.data_structures import Point
 from .key_bindings import create_gfx_display_bindings
 from ..address import Address
 from ..dis.data import Data
-from ..dis.graphics import read_2bpp_values
+from ..dis.graphics import read_bitmap
 
 if TYPE_CHECKING:
     from .application import UGBApplication
 
+PIXEL_CLASSES = [f'class:gfx.pixel.{i}' for i in range(4)]
+
 
 @dataclass
 class GraphicsDisplayState:
@@ -20,6 +22,7 @@ class GraphicsDisplayState:
     columns: int = 2
     tile_height: int = 8
     show_ids: bool = False
+    fmt: str = '2bpp'
 
 
 class GraphicsControl(UIControl):
@@ -29,7 +32,10 @@ class GraphicsControl(UIControl):
         self.scroll_pos = 0
 
         self._loaded_data: Optional[Data] = None
+        self._loaded_fmt = ''
         self._bitmap = b''
+        self._lines_key = None
+        self._lines: Dict[int, List[Tuple[str, str]]] = {}
         self._kb = create_gfx_display_bindings(ugb)
 
     def make_window(self):
@@ -48,8 +54,12 @@ class GraphicsControl(UIControl):
             return b''
 
         latest_data = self.ugb.asm.data.get_data(self.gfx.address)
-        if latest_data is not self._loaded_data:
+        if (
+                latest_data is not self._loaded_data or
+                self.gfx.fmt != self._loaded_fmt
+        ):
             self._loaded_data = latest_data
+            self._loaded_fmt = self.gfx.fmt
             self._bitmap = self.read_bitmap()
 
         return self._bitmap
@@ -57,12 +67,12 @@ class GraphicsControl(UIControl):
     def read_bitmap(self):
         if self._loaded_data is None:
             return b''
-        bitmap = self._loaded_data.data
-        return bytes(read_2bpp_values(bitmap))
+        return read_bitmap(self._loaded_data, self.gfx.fmt)
 
     def reset(self) -> None:
         self.scroll_pos = 0
         self._loaded_data = None
+        self._loaded_fmt = ''
         self._bitmap = b''
 
     def preferred_width(self, max_available_width: int) -> Optional[int]:
@@ -82,20 +92,22 @@ class GraphicsControl(UIControl):
     def create_content(self, width: int, height: int) -> "UIContent":
         bitmap = self.bitmap
         cols, size = self.gfx.columns, self.gfx.tile_height
+        show_ids = self.gfx.show_ids
 
-        classes = [f'class:gfx.pixel.{i}' for i in range(4)]
+        # Rendered lines stay valid as long as the display parameters
+        # do not change, which makes scrolling much cheaper.
+        key = (self._loaded_data, self._loaded_fmt, cols, size, show_ids)
+        if key != self._lines_key:
+            self._lines_key = key
+            self._lines.clear()
+        lines = self._lines
 
         def get_line(line: int):
-            i = (line % size) * 8 + (line // size) * cols * size * 8
-            tokens = []
-            for _ in range(cols):
-                row = bitmap[i:i + 8]
-                tokens.extend((classes[px], '  ') for px in row)
-                if self.gfx.show_ids and i % 64 == 0 and row:
-                    tile_num = f'{i // 64:04x}'
-                    tokens[-8] = (tokens[-8][0], tile_num[0:2])
-                    tokens[-7] = (tokens[-7][0], tile_num[2:4])
-                i += size * 8
+            tokens = lines.get(line)
+            if tokens is None:
+                tokens = lines[line] = self.render_line(
+                    bitmap, line, cols, size, show_ids
+                )
             return tokens
 
         return UIContent(
@@ -105,6 +117,34 @@ class GraphicsControl(UIControl):
             show_cursor=False,
         )
 
+    @staticmethod
+    def render_line(
+            bitmap: bytes, line: int, cols: int, size: int, show_ids: bool
+    ) -> List[Tuple[str, str]]:
+        i = (line % size) * 8 + (line // size) * cols * size * 8
+        tokens: List[Tuple[str, str]] = []
+
+        def add(pixel: int, text: str):
+            cls = PIXEL_CLASSES[pixel]
+            # Merge consecutive pixels of the same color in one token
+            if tokens and tokens[-1][0] is cls:
+                tokens[-1] = (cls, tokens[-1][1] + text)
+            else:
+                tokens.append((cls, text))
+
+        for _ in range(cols):
+            row = bitmap[i:i + 8]
+            if show_ids and i % 64 == 0 and len(row) >= 2:
+                tile_num = f'{i // 64:04x}'
+                add(row[0], tile_num[0:2])
+                add(row[1], tile_num[2:4])
+                row = row[2:]
+            for px in row:
+                add(px, '  ')
+            i += size * 8
+
+        return tokens
+
     def move_down(self, n):
         self.scroll_pos = min(self.scroll_pos + n, self.height - 1)
 
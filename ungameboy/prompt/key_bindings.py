@@ -7,6 +7,7 @@ from prompt_toolkit.keys import Keys
 
 from .control import AsmControl
 from .xref_browser import count_xrefs, get_selected_xref
+from ..dis.graphics import BITMAP_FORMATS
 
 if TYPE_CHECKING:
     from prompt_toolkit.key_binding import KeyBindingsBase, KeyPressEvent
@@ -179,6 +180,18 @@ def create_xref_inspect_bindings(ugb: 'UGBApplication'):
     return bindings
 
 
+def create_output_bindings(ugb: 'UGBApplication'):
+    bindings = KeyBindings()
+
+    @bindings.add("q")
+    @bindings.add("c-c")
+    @quit_sidebar(ugb)
+    def quit_output(_):
+        ugb.output = None
+
+    return bindings
+
+
 def create_gfx_display_bindings(ugb: 'UGBApplication'):
     bindings = KeyBindings()
 
@@ -201,6 +214,12 @@ def create_gfx_display_bindings(ugb: 'UGBApplication'):
         # Toggle between 8 and 16
         ugb.gfx.tile_height = 8 * (3 - ugb.gfx.tile_height // 8)
 
+    @bindings.add('f')
+    def cycle_format(_):
+        formats = list(BITMAP_FORMATS)
+        pos = formats.index(ugb.gfx.fmt) if ugb.gfx.fmt in formats else -1
+        ugb.gfx.fmt = formats[(pos + 1) % len(formats)]
+
     @bindings.add('n')
     def show_ids(_):
         ugb.gfx.show_ids = not ugb.gfx.show_ids
@@ -9,6 +9,7 @@ from prompt_toolkit.layout.controls import FormattedTextControl
 
 from .control import AsmControl
 from .gfx_display import GraphicsControl
+from .key_bindings import create_output_bindings
 from .xref_browser import make_xrefs_control, make_xrefs_title_function
 
 if TYPE_CHECKING:
@@ -21,6 +22,11 @@ class UGBLayout:
         self.main_control = AsmControl(ugb.asm)
         self.gfx_control = GraphicsControl(ugb)
         self.xrefs_control = make_xrefs_control(ugb)
+        self.output_control = FormattedTextControl(
+            lambda: '\n'.join(ugb.output or ()),
+            focusable=True,
+            key_bindings=create_output_bindings(ugb),
+        )
         self.floats: List[Float] = []
 
         main_window = Window(
@@ -34,6 +40,7 @@ class UGBLayout:
         body = FloatContainer(
             content=HSplit([
                 VSplit([main_window, self.build_sidebar()]),
+                self.build_status_bar(),
                 ugb.prompt.container,
             ]),
             floats=self.floats,
@@ -54,6 +61,11 @@ class UGBLayout:
                 "Bitmap preview",
                 self.ugb.filters.gfx_visible
             ),
+            (
+                Window(self.output_control),
+                "Command output",
+                self.ugb.filters.output_visible
+            ),
         ]
 
         return HSplit([
@@ -61,9 +73,39 @@ class UGBLayout:
             for window, header, filter in views
         ])
 
+    def build_status_bar(self):
+        return ConditionalContainer(
+            Window(
+                FormattedTextControl(self.status_text),
+                height=1,
+                style='class:status',
+            ),
+            filter=self.ugb.filters.status_visible,
+        )
+
+    def status_text(self):
+        """Messages about the tasks running in the background"""
+        messages = []
+        jobs = self.ugb.asm.jobs
+        job = jobs.current
+        if job is not None:
+            msg = f"{job.name}: {job.progress}" if job.progress else job.name
+            if len(jobs.jobs) > 1:
+                msg += f" (+{len(jobs.jobs) - 1} jobs)"
+            messages.append(msg)
+        saving = self.ugb.asm.saving
+        if saving is not None and (not saving.done or saving.error):
+            messages.append(saving.status)
+        return ' | '.join(messages)
+
     def refresh(self):
         self.main_control.refresh()
 
+    def show_output(self, lines: List[str]):
+        self.ugb.output = lines
+        self.ugb.prompt_active = False
+        self.layout.focus(self.output_control)
+
     def focus_prompt(self):
         self.ugb.prompt_active = True
         self.layout.focus(self.ugb.prompt.container)
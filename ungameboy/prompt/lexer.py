@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from functools import partial
-from typing import TYPE_CHECKING, List, Set, Tuple, Union
+from typing import TYPE_CHECKING, AbstractSet, List, Tuple, Union
 
 from .common import ControlMode
 from ..address import ROM, Address
@@ -18,6 +18,7 @@ from ..dis import (
 )
 from ..dis.data import CartridgeHeader, Data, EmptyData
 from ..dis.decoder import HeaderDecoder
+from ..profiling import timed
 from ..enums import Condition, DoubleRegister, Register, C
 
 if TYPE_CHECKING:
@@ -275,7 +276,7 @@ class AssemblyRender:
 
     def _render_ref_lines(self, elem: AsmElement, name: str) -> FormattedText:
         _, attr, _, single, plural = self.XREF_TYPES[name]
-        refs: Set[Address] = getattr(elem.xrefs, attr)
+        refs: AbstractSet[Address] = getattr(elem.xrefs, attr)
 
         lines = []
         if len(refs) > 3:
@@ -321,8 +322,8 @@ class AssemblyRender:
         return lines
 
     def render_inline_xrefs(self, elem: AsmElement) -> FormattedLine:
-        reads = elem.xrefs.reads.copy()
-        writes = elem.xrefs.writes_to.copy()
+        reads = set(elem.xrefs.reads)
+        writes = set(elem.xrefs.writes_to)
         if isinstance(elem, RomElement) and elem.dest_address is not None:
             reads.discard(elem.dest_address)
             writes.discard(elem.dest_address)
@@ -456,6 +457,7 @@ class AssemblyRender:
         var_byte = ('class:ram.byte', 'db')
         return [*self.render_address(elem), S4, var_byte]
 
+    @timed("render")
     def render(self, address: Address) -> FormattedText:
         elem = self.asm[address]
         lines = self.render_labels(elem)
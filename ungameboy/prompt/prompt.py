@@ -1,13 +1,12 @@
 from pathlib import Path
 import re
 import shlex
-from typing import TYPE_CHECKING, Iterable
+from itertools import islice
+from typing import TYPE_CHECKING, Dict, Iterable, List, Sequence, Tuple, Union
 
 from prompt_toolkit.application import get_app
 from prompt_toolkit.buffer import Buffer
-from prompt_toolkit.completion import (
-    Completer, CompleteEvent, Completion, NestedCompleter
-)
+from prompt_toolkit.completion import Completer, CompleteEvent, Completion
 from prompt_toolkit.document import Document
 from prompt_toolkit.history import FileHistory
 from prompt_toolkit.filters import Condition
@@ -17,9 +16,10 @@ from prompt_toolkit.widgets.base import TextArea
 from .control import AsmControl
 from ..address import Address
 from ..commands import (
-    LabelName, UgbCommand, UgbCommandGroup, create_core_cli_v2
+    LabelName, UgbCommand, UgbCommandGroup, create_core_cli_v2, format_output,
+    split_command, split_commands,
 )
-from ..project_save import autosave_project
+from ..project_save import autosave_project, record_command
 
 if TYPE_CHECKING:
     from .application import UGBApplication
@@ -30,14 +30,14 @@ def create_ui_cli_v2(ugb: "UGBApplication"):
     """Add the the main CLI the UI-specific options"""
     ugb_cli = create_core_cli_v2(ugb.asm)
 
-    @ugb_cli.add_command("seek")
+    @ugb_cli.add_command("seek", journal=False)
     def seek(address: Address):
         control = ugb.layout.layout.previous_control
         if isinstance(control, AsmControl):
             control.seek(address)
         return False
 
-    @ugb_cli.add_command("inspect")
+    @ugb_cli.add_command("inspect", journal=False)
     def inspect(address: Address):
         ugb.xrefs.address = address
         ugb.xrefs.cursor = 0
@@ -45,7 +45,7 @@ def create_ui_cli_v2(ugb: "UGBApplication"):
         ugb.layout.layout.focus(ugb.layout.xrefs_control)
         return False
 
-    @ugb_cli.add_command("display")
+    @ugb_cli.add_command("display", journal=False)
     def display(address: Address):
         ugb.layout.gfx_control.reset()
         ugb.gfx.address = address
@@ -57,9 +57,14 @@ def create_ui_cli_v2(ugb: "UGBApplication"):
 
 class LabelCompleter(Completer):
     RE_LABEL = re.compile(r'([a-zA-Z0-9_]+(\.[a-zA-Z0-9_-]+)?)')
+    # Stop looking for candidates past that number, there is no point
+    # in showing more than a screen's worth of them.
+    MAX_COMPLETIONS = 100
 
     def __init__(self, asm: "Disassembler"):
         self.asm = asm
+        self._cache_key = None
+        self._cached: List[Completion] = []
 
     def get_refs_at_address(self, address: Address):
         yield from (
@@ -67,24 +72,48 @@ class LabelCompleter(Completer):
             for lb in self.asm.labels.get_labels(address)
         )
 
+    def get_cursor_refs(self) -> List[Completion]:
+        """Completions for the cursor position, cached until it moves"""
+        control = get_app().layout.previous_control
+        if not isinstance(control, AsmControl):
+            return []
+
+        addr = control.address
+        key = (addr, self.asm.labels.revision)
+        if key != self._cache_key:
+            dest = control.destination_address
+            refs = list(self.get_refs_at_address(addr))
+            if dest is not None:
+                refs.extend(self.get_refs_at_address(dest))
+            self._cache_key, self._cached = key, refs
+        return self._cached
+
     def get_completions(
             self, document: "Document", complete_event: CompleteEvent
     ) -> Iterable[Completion]:
         name_head = document.get_word_before_cursor(pattern=self.RE_LABEL)
 
         if not name_head:
-            control = get_app().layout.previous_control
-            if not isinstance(control, AsmControl):
-                return
-
-            addr = control.address
-            dest = control.destination_address
-            yield from self.get_refs_at_address(addr)
-            if dest is not None:
-                yield from self.get_refs_at_address(dest)
+            yield from self.get_cursor_refs()
             return
 
-        for name in self.asm.labels.search(name_head):
+        # Prefix matches come first, then names containing the text. Too
+        # many names contain a character or two for that to be useful.
+        names = list(islice(
+            self.asm.labels.search(name_head), self.MAX_COMPLETIONS
+        ))
+        if len(names) < self.MAX_COMPLETIONS and len(name_head) >= 3:
+            seen = set(names)
+            # The prefix matches are part of these
+            found = self.asm.labels.find(
+                name_head, self.MAX_COMPLETIONS, local='.' in name_head
+            )
+            names.extend(islice(
+                (name for name in found if name not in seen),
+                self.MAX_COMPLETIONS - len(names)
+            ))
+
+        for name in names:
             yield Completion(name, -len(name_head))
 
 
@@ -94,6 +123,76 @@ class AddressCompleter(LabelCompleter):
         yield Completion(str(address))
 
 
+def split_typed(text: str) -> Tuple[List[str], str]:
+    """
+    Split a command being typed into the words before the cursor and
+    the word under it, which may be empty, the way split_command does.
+    """
+    # The marker ends the word under the cursor, and any open quote gets
+    # closed to make the command complete.
+    for closing in ('', '"', "'"):
+        try:
+            words = split_command(text + '\0' + closing)
+        except ValueError:
+            continue
+        return words, words.pop()[:-1]
+    return text.split(), ''
+
+
+class CommandCompleter(Completer):
+    """
+    Completion for the commands, following the live command tree. The
+    arguments typed as addresses or labels get completed as well.
+    """
+
+    def __init__(self, cli: UgbCommandGroup, asm: "Disassembler"):
+        self.cli = cli
+        self.arg_completers: Dict[type, Completer] = {
+            Address: AddressCompleter(asm),
+            LabelName: LabelCompleter(asm),
+        }
+
+    def get_completions(
+            self, document: "Document", complete_event: CompleteEvent
+    ) -> Iterable[Completion]:
+        words, current = split_typed(document.text_before_cursor)
+
+        node: Union[UgbCommand, UgbCommandGroup] = self.cli
+        while isinstance(node, UgbCommandGroup) and words:
+            node = node.commands.get(words.pop(0))
+            if node is None:
+                return
+
+        if isinstance(node, UgbCommandGroup):
+            for name in sorted(node.commands):
+                if name.startswith(current):
+                    yield Completion(name, -len(current))
+            return
+
+        if current.startswith('--'):
+            for name in node.options:
+                if f'--{name}'.startswith(current):
+                    yield Completion(f'--{name}', -len(current))
+            return
+
+        # Find which positional argument is being typed
+        n_args, expect_value = 0, False
+        for word in words:
+            if expect_value:
+                expect_value = False
+            elif word.startswith('--'):
+                option = node.options.get(word[2:])
+                expect_value = option is not None and option.default is not False
+            else:
+                n_args += 1
+        if expect_value or n_args >= len(node.args):
+            return
+
+        completer = self.arg_completers.get(node.args[n_args].annotation)
+        if completer is not None:
+            yield from completer.get_completions(document, complete_event)
+
+
 class UGBPrompt:
     def __init__(self, ugb: "UGBApplication"):
         self.ugb = ugb
@@ -107,7 +206,7 @@ class UGBPrompt:
             history=self.history,
             dont_extend_height=True,
             multiline=False,
-            completer=self.create_completer_v2(),
+            completer=CommandCompleter(self.cli_v2, ugb.asm),
             accept_handler=self.accept_handler,
         )
 
@@ -117,40 +216,6 @@ class UGBPrompt:
             Condition(lambda: ugb.prompt_active)
         )
 
-    def refresh_completion(self):
-        # TODO: This is a hack; make the completion dynamic
-        self.cli_v2 = create_ui_cli_v2(self.ugb)
-        self.prompt.completer = self.create_completer_v2()
-
-    def create_completer_v2(self):
-        label_complete = LabelCompleter(self.ugb.asm)
-        addr_complete = AddressCompleter(self.ugb.asm)
-
-        def _create_cmd_completer(cmd: UgbCommand):
-            if cmd.args:
-                p0 = cmd.args[0].annotation
-                if p0 is Address:
-                    return addr_complete
-                if p0 is LabelName:
-                    return label_complete
-            return None
-
-        def _iter_groups(group: UgbCommandGroup):
-            opts = {}
-            for name in sorted(group.commands):
-                cmd = group.commands.get(name)
-                if isinstance(cmd, UgbCommandGroup):
-                    value = _iter_groups(cmd)
-                elif isinstance(cmd, UgbCommand):
-                    value = _create_cmd_completer(cmd)
-                else:
-                    value = None
-                opts[name] = value
-            return opts
-
-        cli_dict = _iter_groups(self.cli_v2)
-        return NestedCompleter.from_nested_dict(cli_dict)
-
     def accept_handler(self, buffer: Buffer):
         if buffer.text:
             self.run_command(buffer.text.strip())
@@ -162,12 +227,33 @@ class UGBPrompt:
         line = ' '.join(shlex.quote(arg) for arg in args) + ' '
         self.prompt.buffer.reset(Document(line))
 
-    def run_command(self, command: str):
-        res = self.cli_v2(command)
-        autosave_project(self.ugb.asm)
-        if res is not False:
+    def run_command(self, command: Union[str, Sequence[str]]):
+        if not isinstance(command, str):  # Arguments of a shortcut
+            command = ' '.join(shlex.quote(arg) for arg in command)
+        # Several commands separated by ';' are run as a single batch
+        commands = split_commands(command)
+        if len(commands) > 1:
+            with self.ugb.asm.batch():
+                results = [self.cli_v2(cmd) for cmd in commands]
+        else:
+            results = [self.cli_v2(cmd) for cmd in commands]
+
+        for cmd in commands:
+            handler, _ = self.cli_v2.get_handler(cmd)
+            if handler.journal:
+                record_command(self.ugb.asm, cmd)
+        autosave_project(self.ugb.asm, on_progress=self.ugb.app.invalidate)
+        if any(res is not False for res in results):
             self.ugb.layout.refresh()
-        return res
+
+        output = [
+            line
+            for res in results if res is not None and not isinstance(res, bool)
+            for line in format_output(res)
+        ]
+        if output:
+            self.ugb.layout.show_output(output)
+        return results[-1] if results else None
 
     def reset(self) -> None:
         self.prompt.buffer.reset()
@@ -1,8 +1,8 @@
 from dataclasses import dataclass
-from typing import TYPE_CHECKING, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
 
 from prompt_toolkit.data_structures import Point
-from prompt_toolkit.layout.controls import FormattedTextControl
+from prompt_toolkit.layout.controls import UIContent, UIControl
 
 from ..address import Address
 from ..dis import Label, LabelOffset
@@ -17,147 +17,150 @@ class XRefBrowserState:
     cursor: int = 0
 
 
-def make_xrefs_control(ugb: 'UGBApplication'):
-    from .key_bindings import create_xref_inspect_bindings
-
-    asm = ugb.asm
-
-    def get_xrefs_content():
-        if ugb.xrefs.address is None:
-            return []
-
-        xrefs = asm.xrefs.get_xrefs(ugb.xrefs.address)
-        calls = list(sorted(xrefs.called_by))
-        jumps = list(sorted(xrefs.jumps_from))
-        reads = list(sorted(xrefs.read_by))
-        writes = list(sorted(xrefs.written_by))
-        refs = list(sorted(xrefs.referred_by))
-        comment = asm.comments.blocks.get(ugb.xrefs.address, [])
-
-        if not any([calls, jumps, reads, writes, refs, comment]):
-            return [('', 'No references found')]
-
-        nl = ('', '\n')
-        line_index = 0
-        tokens = []
+XREF_SECTIONS = [
+    ('Called from:', 'called_by'),
+    ('Jumps from:', 'jumps_from'),
+    ('Read from:', 'read_by'),
+    ('Written from:', 'written_by'),
+    ('Referred by:', 'referred_by'),
+]
+
+
+class XRefBrowserControl(UIControl):
+    """
+    Lists the incoming references to the inspected address. The sorted
+    references are cached until the inspected address, the xrefs, the
+    labels or the docstring change, and only the lines actually on
+    screen get rendered.
+    """
+
+    def __init__(self, ugb: 'UGBApplication'):
+        from .key_bindings import create_xref_inspect_bindings
+
+        self.ugb = ugb
+        self.asm = ugb.asm
+        self._kb = create_xref_inspect_bindings(ugb)
+
+        self._key = None
+        # Each line is either a text token, or the index of a xref
+        self._lines: List[Union[Tuple[str, str], int]] = []
+        self._xrefs: List[Address] = []
+        self._xref_lines: List[int] = []
+        self._rendered: Dict[int, List[Tuple[str, str]]] = {}
+
+    def get_key_bindings(self):
+        return self._kb
+
+    def is_focusable(self) -> bool:
+        return True
+
+    def _refresh(self):
+        address = self.ugb.xrefs.address
+        comment = self.asm.comments.blocks.get(address, []) if address else []
+        key = (
+            address,
+            self.asm.xrefs.revision,
+            self.asm.labels.revision,
+            tuple(comment),
+        )
+        if key == self._key:
+            return
+
+        self._key = key
+        self._lines, self._xrefs, self._xref_lines = [], [], []
+        self._rendered.clear()
+        if address is None:
+            return
 
+        blank = ('', '')
+        for line in comment:
+            self._lines.append(('class:comment', f'; {line}'))
         if comment:
-            for line in comment:
-                tokens.extend([('class:comment', f'; {line}'), nl])
-            tokens.append(nl)
-
-        def display_xref(_addr):
-            tokens.append(('', '  '))
-            sel = ',hl' * (line_index == ugb.xrefs.cursor)
-            tokens.append(('class:address' + sel, str(_addr)))
-
-            name = asm.context.address_context(_addr, _addr, relative=True)
-            if isinstance(name, Label):
-                tokens.extend([
-                    ('', ' ('),
-                    ('class:value.label', name.name),
-                    ('', ')'),
-                ])
-            elif isinstance(name, LabelOffset):
-                offset = f"{'-' if name.offset < 0 else '+'}${name.offset:x}"
-                tokens.extend([
-                    ('', ' ('),
-                    ('class:value.label', name.label.name),
-                    ('', ' '),
-                    ('class:value', offset),
-                    ('', ')'),
-                ])
-
-            tokens.append(nl)
-
-        if calls:
-            tokens.extend([('', 'Called from:'), nl])
-            for addr in calls:
-                display_xref(addr)
-                line_index += 1
-            tokens.append(nl)
-        if jumps:
-            tokens.extend([('', 'Jumps from:'), nl])
-            for addr in jumps:
-                display_xref(addr)
-                line_index += 1
-            tokens.append(nl)
-        if reads:
-            tokens.extend([('', 'Read from:'), nl])
-            for addr in reads:
-                display_xref(addr)
-                line_index += 1
-            tokens.append(nl)
-        if writes:
-            tokens.extend([('', 'Written from:'), nl])
-            for addr in writes:
-                display_xref(addr)
-                line_index += 1
-            tokens.append(nl)
-        if refs:
-            tokens.extend([('', 'Referred by:'), nl])
-            for addr in refs:
-                display_xref(addr)
-                line_index += 1
-            tokens.append(nl)
-
-        if tokens:  # Remove last newlines
-            tokens.pop()
-            tokens.pop()
+            self._lines.append(blank)
+
+        xrefs = self.asm.xrefs.get_xrefs(address)
+        for title, attr in XREF_SECTIONS:
+            refs = getattr(xrefs, attr)
+            if not refs:
+                continue
+            self._lines.append(('', title))
+            for addr in sorted(refs):
+                self._xref_lines.append(len(self._lines))
+                self._lines.append(len(self._xrefs))
+                self._xrefs.append(addr)
+            self._lines.append(blank)
+
+        if self._lines:  # Remove last empty line
+            self._lines.pop()
+        else:
+            self._lines = [('', 'No references found')]
+
+    @property
+    def xrefs(self) -> List[Address]:
+        """All the incoming references, in the order of the display"""
+        self._refresh()
+        return self._xrefs
+
+    def render_xref(self, index: int) -> List[Tuple[str, str]]:
+        tokens = self._rendered.get(index)
+        if tokens is not None:
+            return tokens
+
+        addr = self._xrefs[index]
+        tokens = [('', '  '), ('class:address', str(addr))]
+
+        name = self.asm.context.address_context(addr, addr, relative=True)
+        if isinstance(name, Label):
+            tokens.extend([
+                ('', ' ('),
+                ('class:value.label', name.name),
+                ('', ')'),
+            ])
+        elif isinstance(name, LabelOffset):
+            offset = f"{'-' if name.offset < 0 else '+'}${name.offset:x}"
+            tokens.extend([
+                ('', ' ('),
+                ('class:value.label', name.label.name),
+                ('', ' '),
+                ('class:value', offset),
+                ('', ')'),
+            ])
+
+        self._rendered[index] = tokens
+        return tokens
 
+    def get_line(self, line: int) -> List[Tuple[str, str]]:
+        item = self._lines[line]
+        if not isinstance(item, int):
+            return [item]
+
+        tokens = self.render_xref(item)
+        if item == self.ugb.xrefs.cursor:
+            cls, text = tokens[1]
+            tokens = [tokens[0], (cls + ',hl', text), *tokens[2:]]
         return tokens
 
-    def get_cursor_pos():
-        """Used by PT to handle scrolling in the XREF browser"""
-        if ugb.xrefs.address is None:
-            return None
+    def create_content(self, width: int, height: int) -> UIContent:
+        self._refresh()
 
-        line_pos = cursor = ugb.xrefs.cursor
-        if cursor == 0:
+        cursor = self.ugb.xrefs.cursor
+        if 0 < cursor < len(self._xref_lines):
+            cursor_line = self._xref_lines[cursor]
+        else:
             # Always return 0 at top of file (even if actual cursor is
             # lower), otherwise no amount of scrolling up would show it.
-            return Point(0, 0)
-
-        # Handle the offset caused by the comment/docstring
-        doc_size = len(asm.comments.blocks.get(ugb.xrefs.address, []))
-        line_pos += doc_size + doc_size > 0
-
-        xrefs = asm.xrefs.get_xrefs(ugb.xrefs.address)
-        n_calls = len(xrefs.called_by)
-        n_jumps = len(xrefs.jumps_from)
-        n_reads = len(xrefs.read_by)
-        n_writes = len(xrefs.written_by)
-        n_refs = len(xrefs.referred_by)
-        multi_section = False
-
-        # For each section, if it exists:
-        # - add 1 to account for the section name,
-        # - add 1 more if there was any section before,
-        # - if cursor not in that section, decrement and try next.
-
-        def _process(count):
-            nonlocal line_pos, multi_section, cursor
-            line_pos += (count > 0) * (1 + multi_section)
-            if cursor < count:
-                return Point(0, line_pos)
-            multi_section |= count > 0
-            cursor -= count
-            return None
-
-        for _count in (n_calls, n_jumps, n_reads, n_writes, n_refs):
-            res = _process(_count)
-            if res is not None:
-                return res
-
-        return None
-
-    return FormattedTextControl(
-        text=get_xrefs_content,
-        show_cursor=False,
-        focusable=True,
-        key_bindings=create_xref_inspect_bindings(ugb),
-        get_cursor_position=get_cursor_pos,
-    )
+            cursor_line = 0
+
+        return UIContent(
+            get_line=self.get_line,
+            line_count=len(self._lines),
+            cursor_position=Point(0, cursor_line),
+            show_cursor=False,
+        )
+
+
+def make_xrefs_control(ugb: 'UGBApplication'):
+    return XRefBrowserControl(ugb)
 
 
 def make_xrefs_title_function(ugb: 'UGBApplication'):
@@ -182,29 +185,8 @@ def get_selected_xref(ugb: 'UGBApplication'):
     index = ugb.xrefs.cursor
     if index < 0:
         raise IndexError(index)
-
-    xr = ugb.asm.xrefs.get_xrefs(ugb.xrefs.address)
-    refs = [
-        xr.called_by,
-        xr.jumps_from,
-        xr.read_by,
-        xr.written_by,
-        xr.referred_by,
-    ]
-    for col in refs:
-        if index < len(col):
-            return list(sorted(col))[index]
-        index -= len(col)
-
-    raise IndexError(ugb.xrefs.cursor)
+    return ugb.layout.xrefs_control.xrefs[index]
 
 
 def count_xrefs(ugb: 'UGBApplication'):
-    xr = ugb.asm.xrefs.get_xrefs(ugb.xrefs.address)
-    return (
-            len(xr.called_by) +
-            len(xr.jumps_from) +
-            len(xr.read_by) +
-            len(xr.written_by) +
-            len(xr.referred_by)
-    )
+    return len(ugb.layout.xrefs_control.xrefs)
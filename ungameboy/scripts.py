@@ -1,8 +1,10 @@
-from functools import partial
-from typing import TYPE_CHECKING, Any, Callable
+from functools import partial, wraps
+from inspect import isgeneratorfunction, signature
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, Optional, Union
 
-from .commands import UgbCommandGroup
+from .commands import UgbCommand, UgbCommandGroup
 from .dis.manager_base import AsmManager
+from .project_save import save_now
 
 if TYPE_CHECKING:
     from .dis import Disassembler
@@ -10,6 +12,78 @@ if TYPE_CHECKING:
 SCRIPTS = {}
 
 
+class ScriptsRunGroup(UgbCommandGroup):
+    """
+    Commands group that stays in sync with the registered scripts, so
+    that scripts from plugins imported later are available right away.
+    """
+
+    @property
+    def commands(self) -> Dict[str, Union[UgbCommand, UgbCommandGroup]]:
+        for name, call in SCRIPTS.items():
+            if name not in self._commands:
+                # Jobs can be cancelled halfway, they save their changes
+                # instead of being journaled
+                self._commands[name] = UgbCommand(
+                    self.asm, self.wrap(call),
+                    journal=not isgeneratorfunction(call),
+                )
+        return self._commands
+
+    @commands.setter
+    def commands(self, value: Dict[str, Union[UgbCommand, UgbCommandGroup]]):
+        self._commands = value
+
+    def wrap(self, script: Callable) -> Callable:
+        """
+        Bind the script to the disassembler and run it as a batch. Scripts
+        that are generators run as jobs instead, each step as a batch of
+        its own when the job runs in the background, and the project is
+        saved once the job stops.
+        """
+        asm = self.asm
+
+        @wraps(script)
+        def run_script(*args, **kwargs):
+            if not isgeneratorfunction(script):
+                with asm.batch():
+                    return script(asm, *args, **kwargs)
+
+            steps = _saved_steps(
+                asm, _batched_steps(asm, script(asm, *args, **kwargs))
+            )
+            name = f"script {script.__name__}"
+            if asm.jobs.background:
+                asm.jobs.submit(name, steps)
+            else:
+                with asm.batch():
+                    asm.jobs.submit(name, steps)
+
+        run_script.__signature__ = signature(partial(script, asm))
+        return run_script
+
+
+def _batched_steps(
+        asm: "Disassembler", steps: Iterator[Any]
+) -> Iterator[Optional[str]]:
+    while True:
+        with asm.batch(rollback=False):
+            try:
+                progress = next(steps)
+            except StopIteration:
+                return
+        yield None if progress is None else str(progress)
+
+
+def _saved_steps(
+        asm: "Disassembler", steps: Iterator[Optional[str]]
+) -> Iterator[Optional[str]]:
+    try:
+        yield from steps
+    finally:
+        save_now(asm)
+
+
 class ScriptsManager(AsmManager):
 
     def __init__(self, asm: "Disassembler"):
@@ -17,11 +91,7 @@ class ScriptsManager(AsmManager):
 
     def build_cli_v2(self) -> UgbCommandGroup:
         scripts_cli = UgbCommandGroup(self.asm, "script")
-
-        run_cli = scripts_cli.create_group("run")
-        for name, call in SCRIPTS.items():
-            run_cli.add_command(name, partial(call, self.asm))
-
+        scripts_cli.add_group(ScriptsRunGroup(self.asm, "run"))
         return scripts_cli
 
     def reset(self):
@@ -0,0 +1,355 @@
+"""
+Synthetic ROMs and projects, to test every part of the disassembler at
+the scale of real games without shipping any of them.
+
+The ROMs are generated from a seed, so the same arguments always give
+the same bytes. They have a valid header and checksums, and their banks
+are made of functions calling each other (including across banks),
+jump tables, tile data, RLE blobs, and empty space. The matching
+project declares labels, comments and data blocks over all of that.
+
+    python -m ungameboy.synthetic game.gb --size 1024 --project game
+"""
+
+from argparse import ArgumentParser
+from bisect import bisect_right
+from pathlib import Path
+import random
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+from .address import ROM, Address
+from .dis.decoder import HeaderDecoder
+from . import project_save
+
+__all__ = ['SyntheticROM', 'generate_rom', 'project_commands', 'write_project']
+
+TITLE = b"SYNTHETIC"
+FILL = 0xff
+RLE_PLUGIN = 'ungameboy.extras.wl2'
+
+# Instruction templates, picked at random to fill the functions
+SIMPLE_OPS = [
+    0x78, 0x79, 0x7a, 0x7e, 0x47, 0x4f, 0x57, 0x5f,  # ld r, r
+    0x3c, 0x3d, 0x04, 0x05, 0x23, 0x13,  # inc, dec
+    0x2a, 0x22, 0x1a, 0x12,  # ld a, [hl+] and co.
+    0xa7, 0xaf, 0xb7, 0x87, 0x80, 0x90,  # arithmetics
+]
+BYTE_OPS = [0x3e, 0x06, 0x0e, 0xfe, 0xe6, 0xc6]  # ld a, n and co.
+IO_OPS = [0xe0, 0xf0]  # ldh [n], a / ldh a, [n]
+RAM_OPS = [0x21, 0x11, 0xfa, 0xea]  # ld hl, nn / ld a, [nn] and co.
+CALL, RET, JR_NZ = 0xcd, 0xc9, 0x20
+
+
+class SyntheticROM(NamedTuple):
+    rom: bytes
+    # Entry points of all the functions, main is the first one
+    functions: List[Address]
+    # ROM offsets of the instructions within functions, for local labels
+    instructions: List[int]
+    # Address and number of rows
+    jump_tables: List[Tuple[Address, int]]
+    # Address and size in bytes
+    tiles: List[Tuple[Address, int]]
+    rle_blobs: List[Tuple[Address, int]]
+    empty: List[Tuple[Address, int]]
+    # RAM addresses read or written by the functions
+    variables: List[Address]
+    # Calls to other banks, with the bank they switch to
+    far_calls: List[Tuple[Address, int]]
+
+    @property
+    def n_banks(self) -> int:
+        return len(self.rom) // 0x4000
+
+
+def _rom_size_code(n_banks: int) -> int:
+    # 32 KiB is 2 "banks" and has code 0, then each code doubles it
+    code = n_banks.bit_length() - 2
+    if n_banks != 2 << code or not 0 <= code <= 8:
+        raise ValueError("ROM size must be a power of 2, from 32 KiB to 8 MiB")
+    return code
+
+
+def _header(rom: bytearray, n_banks: int):
+    rom[0x100:0x150] = bytes(0x50)
+    rom[0x100:0x104] = bytes([0x00, 0xc3, 0x50, 0x01])  # nop; jp $0150
+    rom[0x104:0x134] = HeaderDecoder.NINTENDO_LOGO
+    rom[0x134:0x134 + len(TITLE)] = TITLE
+    rom[0x147] = 0x1b if n_banks > 2 else 0x00  # MBC5 + RAM + battery
+    rom[0x148] = _rom_size_code(n_banks)
+    rom[0x149] = 0x03 if n_banks > 2 else 0x00  # 32 KiB of SRAM
+    rom[0x14a] = 0x01  # Non-Japanese
+    rom[0x14b] = 0x33  # Use the new licensee code
+
+    checksum = 0
+    for byte in rom[0x134:0x14d]:
+        checksum = (checksum - byte - 1) & 0xff
+    rom[0x14d] = checksum
+
+
+def _global_checksum(rom: bytearray):
+    rom[0x14e:0x150] = b'\x00\x00'
+    rom[0x14e:0x150] = (sum(rom) & 0xffff).to_bytes(2, 'big')
+
+
+def _rle_blob(rng: random.Random) -> bytes:
+    """Data compressed in the format of the wl2.rle processor"""
+    blob = bytearray()
+    for _ in range(rng.randrange(2, 8)):
+        if rng.random() < 0.5:
+            blob.extend([rng.randrange(2, 0x80), rng.randrange(256)])
+        else:
+            size = rng.randrange(1, 0x20)
+            blob.append(0x80 | size)
+            blob.extend(rng.getrandbits(8) for _ in range(size))
+    blob.append(0)
+    return bytes(blob)
+
+
+class _Generator:
+    def __init__(self, n_banks: int, seed: int, empty_ratio: float):
+        self.rng = random.Random(seed)
+        self.n_banks = n_banks
+        self.empty_ratio = empty_ratio
+        self.rom = bytearray([FILL]) * (n_banks * 0x4000)
+
+        self.functions: List[Tuple[Address, int]] = []
+        self.instructions: List[int] = []
+        self.jump_tables: List[Tuple[Address, int]] = []
+        self.tiles: List[Tuple[Address, int]] = []
+        self.rle_blobs: List[Tuple[Address, int]] = []
+        self.empty: List[Tuple[Address, int]] = []
+        self.far_calls: List[Tuple[Address, int]] = []
+        self.by_bank: List[List[Address]] = [[] for _ in range(n_banks)]
+
+        self.variables = sorted({
+            Address.from_memory_address(self.rng.randrange(0xc000, 0xd000))
+            for _ in range(256)
+        })
+
+    def plan_bank(self, bank: int):
+        """Pick what goes where in the bank, functions are written later"""
+        rng = self.rng
+        start = 0x150 if bank == 0 else 0
+        if bank > 1 and rng.random() < self.empty_ratio:
+            self.empty.append((Address(ROM, bank, 0), 0x4000))
+            return
+
+        pos = start
+        while pos < 0x3f00:
+            addr = Address(ROM, bank, pos)
+            kind = rng.random()
+            if kind < 0.75 or pos == start:
+                size = rng.randrange(16, 128)
+                self.functions.append((addr, size))
+            elif kind < 0.85:
+                rows = rng.randrange(4, 16)
+                self.jump_tables.append((addr, rows))
+                size = rows * 2
+            elif kind < 0.95:
+                size = 16 * rng.randrange(8, 64)
+                size = min(size, (0x4000 - pos) & ~0xf)
+                self.tiles.append((addr, size))
+                self.write(addr, rng.getrandbits(size * 8).to_bytes(size, 'big'))
+            else:
+                blob = _rle_blob(rng)
+                size = len(blob)
+                self.rle_blobs.append((addr, size))
+                self.write(addr, blob)
+            pos += size
+
+        if pos < 0x4000:
+            self.empty.append((Address(ROM, bank, pos), 0x4000 - pos))
+
+    def write(self, address: Address, data: bytes):
+        pos = address.rom_file_offset
+        self.rom[pos:pos + len(data)] = data
+
+    def call(self, address: Address) -> bytes:
+        """Call to a function of the same bank, bank 0, or another bank"""
+        target, _ = self.rng.choice(self.functions)
+        call = bytes([CALL, *target.memory_address.to_bytes(2, 'little')])
+        if target.bank in (0, address.bank):
+            return call
+        # ld a, BANK; ld [$2000], a; call nn
+        self.far_calls.append((address + 5, target.bank))
+        return bytes([0x3e, target.bank & 0xff, 0xea, 0x00, 0x20]) + call
+
+    def function(self, address: Address, size: int):
+        rng = self.rng
+        body = bytearray()
+        starts: List[int] = []
+
+        # Keep enough room for the longest template and the final ret
+        while len(body) < size - 9:
+            kind = rng.random()
+            if kind < 0.45:
+                instr = bytes([rng.choice(SIMPLE_OPS)])
+            elif kind < 0.6:
+                instr = bytes([rng.choice(BYTE_OPS), rng.randrange(256)])
+            elif kind < 0.7:
+                instr = bytes([rng.choice(IO_OPS), rng.randrange(0x80, 0xff)])
+            elif kind < 0.82:
+                var = rng.choice(self.variables).memory_address
+                instr = bytes([rng.choice(RAM_OPS), *var.to_bytes(2, 'little')])
+            elif kind < 0.95 or not starts:
+                instr = self.call(address + len(body))
+            else:  # Loop back to an earlier instruction
+                jump = rng.choice(starts) - (len(body) + 2)
+                instr = bytes([JR_NZ, jump & 0xff])
+            starts.append(len(body))
+            body.extend(instr)
+
+        body.extend([0x00] * (size - 1 - len(body)))
+        body.append(RET)
+        self.write(address, body)
+        base = address.rom_file_offset
+        self.instructions.extend(base + pos for pos in starts[1:])
+
+    def jump_table(self, address: Address, rows: int):
+        # Jump tables point to functions of the same bank, or bank 0
+        targets = self.by_bank[0] + self.by_bank[address.bank]
+        table = bytearray()
+        for _ in range(rows):
+            target = self.rng.choice(targets)
+            table.extend(target.memory_address.to_bytes(2, 'little'))
+        self.write(address, table)
+
+    def build(self) -> SyntheticROM:
+        for bank in range(self.n_banks):
+            self.plan_bank(bank)
+        for address, size in self.functions:
+            self.function(address, size)
+            self.by_bank[address.bank].append(address)
+        for address, rows in self.jump_tables:
+            self.jump_table(address, rows)
+
+        _header(self.rom, self.n_banks)
+        _global_checksum(self.rom)
+        return SyntheticROM(
+            rom=bytes(self.rom),
+            functions=[addr for addr, _ in self.functions],
+            instructions=self.instructions,
+            jump_tables=self.jump_tables,
+            tiles=self.tiles,
+            rle_blobs=self.rle_blobs,
+            empty=self.empty,
+            variables=self.variables,
+            far_calls=self.far_calls,
+        )
+
+
+def generate_rom(size_kib: int = 1024, seed=0, empty_ratio=0.1) -> SyntheticROM:
+    """
+    Build a ROM of the given size, from 32 KiB to 8 MiB. A share of the
+    banks after the first two is left empty.
+    """
+    n_banks = size_kib // 16
+    _rom_size_code(n_banks)
+    return _Generator(n_banks, seed, empty_ratio).build()
+
+
+def project_commands(
+        synth: SyntheticROM,
+        rom_path: Path,
+        n_labels: int = 10_000,
+        n_comments: Optional[int] = None,
+        seed=0,
+) -> Iterator[tuple]:
+    """
+    Commands of a project file for the ROM: data blocks for everything
+    that is not code, and up to N labels, made of the functions, then
+    the RAM variables, then local labels within the functions.
+    """
+    rng = random.Random(seed)
+    if n_comments is None:
+        n_comments = n_labels // 10
+
+    yield ('load-rom', Path(rom_path).resolve())
+    yield ('plugin', 'import', RLE_PLUGIN)
+
+    yield ('data', 'load', Address.from_rom_offset(0x104), 0x4c, 'header')
+    for address, rows in synth.jump_tables:
+        yield ('data', 'load', address, rows * 2, 'jumptable')
+    for address, size in synth.tiles:
+        yield ('data', 'load', address, size)
+    for address, size in synth.rle_blobs:
+        yield ('data', 'load', address, size, 'basic', '--processor', 'wl2.rle')
+    for address, size in synth.empty:
+        yield ('data', 'load', address, size, f'empty:{FILL}')
+    for address, bank in synth.far_calls:
+        yield ('context', 'set', 'bank', address, bank)
+
+    labels = [(Address.from_rom_offset(0x100), 'entry_point')]
+    labels.append((synth.functions[0], 'main'))
+    for address in synth.functions[1:]:
+        name = f"Func_{address.bank:02x}_{address.memory_address:04x}"
+        labels.append((address, name))
+    for address in synth.variables:
+        labels.append((address, f"wVar_{address.memory_address:04x}"))
+    labels = labels[:n_labels]
+
+    # Local labels go to the instructions of the functions that have one
+    globals_at = {address: name for address, name in labels}
+    n_locals = max(n_labels - len(labels), 0)
+    for offset in sorted(rng.sample(
+            synth.instructions, min(n_locals, len(synth.instructions))
+    )):
+        address = Address.from_rom_offset(offset)
+        func = synth.functions[bisect_right(synth.functions, address) - 1]
+        scope = globals_at.get(func)
+        if scope is not None:
+            labels.append((address, f"{scope}.loc_{address.offset:04x}"))
+
+    for address, name in labels:
+        yield ('label', 'create', address, name)
+
+    for n in range(n_comments):
+        address, name = rng.choice(labels)
+        if n % 4:
+            yield ('comment', 'inline', address, f"Comment {n} on {name}")
+        else:
+            yield ('comment', 'append', address, f"Block comment {n}")
+
+
+def write_project(
+        synth: SyntheticROM,
+        rom_path: Path,
+        name: str,
+        n_labels: int = 10_000,
+        seed=0,
+) -> Path:
+    """Write the ROM and a project using it, which can then be loaded"""
+    rom_path = Path(rom_path)
+    rom_path.write_bytes(synth.rom)
+    project_path = project_save.PROJECTS_DIR / f"{name}.ugb.txt"
+    project_save.write_commands(
+        project_commands(synth, rom_path, n_labels, seed=seed), project_path
+    )
+    return project_path
+
+
+def main(argv: List[str] = None):
+    parser = ArgumentParser(description="Generate a synthetic Game Boy ROM")
+    parser.add_argument("rom_path", type=Path)
+    parser.add_argument("--size", type=int, default=1024,
+                        help="ROM size in KiB (default: %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--project", metavar="NAME",
+                        help="Also write a project with that name")
+    parser.add_argument("--labels", type=int, default=10_000,
+                        help="Number of labels in the project")
+    args = parser.parse_args(argv)
+
+    synth = generate_rom(args.size, args.seed)
+    if args.project:
+        path = write_project(
+            synth, args.rom_path, args.project, args.labels, args.seed
+        )
+        print(f"Project written to {path}")
+    else:
+        args.rom_path.write_bytes(synth.rom)
+
+
+if __name__ == '__main__':
+    main()